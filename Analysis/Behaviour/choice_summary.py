@@ -12,6 +12,7 @@ from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import confusion_matrix
 
 from Analysis.Behaviour.utils.experiments_analyser import ExperimentsAnalyser
+from Analysis.Behaviour.utils.resampling import bootstrap_pr, permutation_test_pr, get_resampling_units
 from Processing.rois_toolbox.rois_stats import convert_roi_id_to_tag
 
 def save_plot(name, f):
@@ -590,13 +591,10 @@ for windows_size in [600]:
             # random sampling
             if n_random_iters is not None:
                 if n_trials_in_bin > min_trials_in_bin:
-                    random_prs = []
-                    for n in range(n_random_iters):
-                        random_trials = trials.sample(n=n_trials_in_bin, axis=0)
-                        random_trials = random_trials.loc[random_trials.escape_arm != "center"]
-                        r_binary_trials = [1 if e == "right" else 0 for e in random_trials.escape_arm.values]
-                        _, _, mean, _, sigmasquared, _ = ea.grouped_bayes_analytical([len(r_binary_trials)], [np.sum(r_binary_trials)])
-                        random_prs.append(mean)
+                    k, _ = get_resampling_units(trials, level="trial")
+                    random_prs = bootstrap_pr(k, size=n_trials_in_bin, n_resamples=n_random_iters)
+                    # ? posterior mean of each resample, as for the binned trials
+                    random_prs = ea.grouped_bayes_analytical(n_trials_in_bin, random_prs*n_trials_in_bin)[2]
                     ax.errorbar(x[-1], np.mean(random_prs), yerr=np.std(random_prs), fmt="-", color=[.2, .2, .2], alpha=.85)
                     ax.scatter(x[-1], np.mean(random_prs), edgecolor=white, color=[.1, .1, .1], zorder=99)
 
@@ -762,6 +760,11 @@ for i, (condition, trials) in enumerate(ea.conditions.items()):
     delta = [l-r for l,r in zip(random.choices(ldist, k=50000), random.choices(rdist, k=50000))]
     percdelta = percentile_range(delta)
 
+    # permutation test on the trials
+    (k_l, n_l), (k_r, n_r) = [get_resampling_units(t, level="trial") for t in sub_conds.values()]
+    observed, null, pvalue = permutation_test_pr(k_l, n_l, k_r, n_r, n_resamples=100000)
+    print("{} - p(R|left origin) - p(R|right origin): {}, permutation p value: {}".format(condition, round(observed, 3), round(pvalue, 5)))
+
     axarr[1].hist(delta, bins=30, color=maze_colors[condition], edgecolor=maze_colors[condition],  
                 alpha=.1, histtype="stepfilled", density=True)
     axarr[1].hist(delta, bins=30, color=maze_colors[condition], edgecolor=maze_colors[condition],  
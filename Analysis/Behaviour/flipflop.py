@@ -4,6 +4,7 @@ sys.path.append('./')
 from Utilities.imports import *
 
 from Analysis.Behaviour.utils.experiments_analyser import ExperimentsAnalyser
+from Analysis.Behaviour.utils.resampling import bootstrap_pr, permutation_test_pr
 palette = makePalette(teal, lilla, 4, False)
 arms_colors = {
     "left": teal,
@@ -122,21 +123,11 @@ f, axarr = create_figure(subplots=True, ncols=2, figsize=(10, 10), sharey=True)
 # PLOT subsample from M1
 bootstrap = False
 if bootstrap:
-    for i in range(50):
-        n = 41 
-        trials = ea.conditions['m1'].sample(n) 
-        k = len(trials.loc[trials.escape_arm == 'right'])
-
-        a, b, mean, mode, sigmasquared, prange = ea.grouped_bayes_analytical(n, k)
-        plot_distribution(a, b, ax=axarr[0], dist_type="beta", shaded=True, line_alpha=0, shade_alpha=.02, plot_kwargs={"color":black})
-
-    for i in range(50):
-        n = 91 
-        trials = ea.conditions['m1'].sample(n) 
-        k = len(trials.loc[trials.escape_arm == 'right'])
-
-        a, b, mean, mode, sigmasquared, prange = ea.grouped_bayes_analytical(n, k)
-        plot_distribution(a, b, ax=axarr[0], dist_type="beta", shaded=True, line_alpha=0, shade_alpha=.02, plot_kwargs={"color":black})
+    # ? p(R) of M1 resampled with the same number of trials as the flip flop conditions
+    m1_escapes = (ea.conditions['m1'].escape_arm.values == 'right').astype(int)
+    for n in [41, 91]:
+        samples = bootstrap_pr(m1_escapes, size=n, n_resamples=100000)
+        axarr[0].hist(samples, bins=np.linspace(0, 1, 42), color=black, alpha=.1, histtype="stepfilled", density=True)
 
 # PLOT M1
 pr = pRs.loc[pRs.condition == 'm1']
@@ -193,15 +184,21 @@ axarr[1].scatter(mean, -.8, color=darkseagreen, edgecolor=black, s=250, lw=2, zo
 axarr[1].legend()
 _ = axarr[1].set(xlabel='difference', ylabel="density", title="p(R|m1) - p(R|flipflop)")
 
+# Permutation tests: p(shortest) in m1 vs before and after the flip
+m1_escapes = (ea.conditions['m1'].escape_arm.values == 'right').astype(int)
+for name, escapes in zip(["baseline", "after flip"], [(left_long_trials.escape_arm.values == 'right').astype(int),
+                                                    (right_long_trials.escape_arm.values == 'left').astype(int)]):
+    observed, null, pvalue = permutation_test_pr(escapes, None, m1_escapes, None, n_resamples=100000)
+    print("{} - m1: {}, permutation p value: {}".format(name, round(observed, 3), round(pvalue, 5)))
+
+
 # %%
 # ----------------------------------- TESET ---------------------------------- #
 
-escapes =  [1 if i.escape_arm == 'right' else 0 for _, i in ea.conditions['m1'].iterrows()]
+escapes =  (ea.conditions['m1'].escape_arm.values == 'right').astype(int)
 
-prs, prs2, prs3 = [], [], []
-for i in tqdm(range(10000)):
-    prs.append(np.mean(random.choices(escapes, k=41)))
-    prs2.append(np.mean(random.choices(escapes, k=91)))
+prs = bootstrap_pr(escapes, size=41, n_resamples=10000)
+prs2 = bootstrap_pr(escapes, size=91, n_resamples=10000)
 
 _  = plt.hist(prs, bins=10, density=True, alpha=.5)
 _  = plt.hist(prs2, bins=10, density=True, alpha=.5)
@@ -3,8 +3,6 @@ import networkx as nx
 import matplotlib.pyplot as plt
 import numpy.random as npr
 import numpy as np
-import math
-from tqdm import tqdm
 import seaborn as sns
 
 from fcutils.maths.geometry import calc_distance_between_points_2d
@@ -49,54 +47,79 @@ def get_random_graph():
     return G, edges, nodes
 
 def sas(x0, x1, cos_theta):
-    return math.sqrt(x1**2 + x0**2 + 2*x0*x1*cos_theta)
+    return np.sqrt(x1**2 + x0**2 + 2*x0*x1*cos_theta)
 
-def get_side_max_eucl(x_p, y_p, y_s, len_a, len_b, len_c, ):
+def get_side_max_eucl(y_s, len_a, len_b, len_c):
+    """[Max of sas(l, y_s, cos_theta) for l in [0, len_b + 1], for arrays of arms]
+
+    sas(l)^2 is a convex quadratic in l, so the max over the interval is at one of its ends
+    and there's no need to evaluate it on a grid of points along the arm.
+
+    Arguments:
+        y_s {[float, np.ndarray]} -- [y coordinate of the shelter]
+        len_a {[np.ndarray]} -- [length of the arm's edge to the shelter]
+        len_b {[np.ndarray]} -- [length of the arm's edge to the threat]
+        len_c {[float, np.ndarray]} -- [distance between shelter and threat]
+    """
     # Get angle of arm
     cos_theta = (len_c**2 + len_b**2 - len_a**2)/(2*len_b*len_c)
 
     # GEt max eucl dist.
-    eucls = [sas(l, y_s, cos_theta) for l in np.linspace(0, len_b+1, 300)]
-    return np.max(eucls)
+    return np.maximum(sas(0, y_s, cos_theta), sas(len_b+1, y_s, cos_theta))
+
+def simulate_mazes(n, seed=None):
+    """[Draws n random mazes and computes the ratio between the left and right arms' geodesic and max euclidean distances]
+
+    Arguments:
+        n {[int]} -- [number of mazes]
+
+    Keyword Arguments:
+        seed {[int]} -- [random seed] (default: {None})
+
+    Returns:
+        [dict] -- [arrays of L and R coordinates, geodesic ratios and euclidean ratios]
+    """
+    rng = npr.RandomState(seed)
+    shelter, threat = np.array([500, 700]), np.array([500, 300])
+
+    # ? same distributions as get_random_coords, for all mazes at once
+    L = np.vstack([rng.randint(0, 400, size=n), rng.randint(300, 700, size=n)]).T
+    R = np.vstack([rng.randint(600, 1000, size=n), rng.randint(300, 700, size=n)]).T
+
+    # edges lengths: far is the edge to the shelter, close the edge to the threat
+    l_edge_far, l_edge_close = np.hypot(*(L - shelter).T), np.hypot(*(L - threat).T)
+    r_edge_far, r_edge_close = np.hypot(*(R - shelter).T), np.hypot(*(R - threat).T)
+    c = shelter[1] - threat[1]
+
+    l_eucldist = get_side_max_eucl(shelter[1], l_edge_far, l_edge_close, c)
+    r_eucldist = get_side_max_eucl(shelter[1], r_edge_far, r_edge_close, c)
+
+    return dict(L=L, R=R, 
+                ratios=(l_edge_far + l_edge_close)/(r_edge_far + r_edge_close),
+                eucl_ratios=l_eucldist/r_eucldist)
 
 G, edges, nodes = get_random_graph()
 nx.draw(G, with_labels = True, pos=nodes, with_weights=False)
 
 # %%
-# for each node get the shortest path to shelter length and euclidean distance from shelter
-ratios, eucl_ratios = [], []
-for i in tqdm(range(4000)):
-    G, edges, nodes = get_random_graph()
-    
-    l_geodist = np.sum([edge[2] for edge in edges if 'L' in edge])
-    r_geodist = np.sum([edge[2] for edge in edges if 'R' in edge])
-    ratios.append(l_geodist/r_geodist)
-
-    l_edge_close = [edge for edge in edges if 'L' in edge and 'threat' in edge][0][2]
-    l_edge_far = [edge for edge in edges if 'L' in edge and 'shelter' in edge][0][2]
-    r_edge_close = [edge for edge in edges if 'R' in edge and 'threat' in edge][0][2]
-    r_edge_far = [edge for edge in edges if 'R' in edge and 'shelter' in edge][0][2]
-    c = nodes['shelter'][1] - nodes['threat'][1]
-
-    l_eucldist = get_side_max_eucl(*nodes['L'], nodes['shelter'][1],  l_edge_far, l_edge_close, c)
-    r_eucldist = get_side_max_eucl(*nodes['R'], nodes['shelter'][1],  r_edge_far, r_edge_close, c)
-
-    eucl_ratios.append(l_eucldist/r_eucldist)
+# for each maze get the ratio of the arms' shortest path to shelter length and max euclidean distance from shelter
+simulated = simulate_mazes(1000000, seed=0)
+ratios, eucl_ratios = simulated['ratios'], simulated['eucl_ratios']
 
 _ = plt.hist(ratios, bins=20, alpha=.5, label='geod', density=True)
 _ = plt.hist(eucl_ratios, bins=20, alpha=.5, label='eucl', density=True)
 _ = plt.legend()
 # %%
 f, ax = plt.subplots()
-sns.regplot(ratios, eucl_ratios, scatter_kws={'alpha':.5}, line_kws={'lw':3, 'color':'r', 'zorder':99}, ax=ax)
+sns.regplot(ratios[:4000], eucl_ratios[:4000], scatter_kws={'alpha':.5}, line_kws={'lw':3, 'color':'r', 'zorder':99}, ax=ax)
 ax.plot([0, 3], [0, 3])
 
 # %%
 from sklearn.linear_model import LinearRegression
 
-reg = LinearRegression().fit(np.array(ratios).reshape(-1, 1), np.array(eucl_ratios).reshape(-1, 1))
+reg = LinearRegression().fit(ratios.reshape(-1, 1), eucl_ratios.reshape(-1, 1))
 
 # %%
-reg._coeff
+reg.coef_
 
 # %%
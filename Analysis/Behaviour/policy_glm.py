@@ -12,7 +12,9 @@ from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import confusion_matrix, mean_squared_error
 
 from Analysis.Behaviour.utils.experiments_analyser import ExperimentsAnalyser
+from Analysis.Behaviour.utils.trials_aggregation import get_tracking_after_leaving_T, get_values_by_arm
 from Processing.rois_toolbox.rois_stats import convert_roi_id_to_tag
+from Modelling.policy_models import PolicyGLM
 
 def save_plot(name, f):
     if sys.platform == 'darwin': 
@@ -70,16 +72,12 @@ ea.add_condition("m4", maze_design=4, lights=1, escapes_dur=True, tracking="all"
 ea.add_condition("m6", maze_design=6, lights=1, escapes_dur=True, tracking="all"); print("Got m6")
 
 # ---------------------------------- cleanup --------------------------------- #
-goodids, skipped = [], 0
 trials = ea.conditions['m1']
-for i, trial in trials.iterrows():
-    if trial.escape_arm == "left":
-        if np.max(trial.body_xy[:, 0]) > 600:
-            skipped += 1
-            continue
-    goodids.append(trial.stimulus_uid)
-
-t = ea.conditions['m1'].loc[ea.conditions['m1'].stimulus_uid.isin(goodids)]
+max_x = np.array([np.max(xy[:, 0]) for xy in trials.body_xy.values])
+bad = (trials.escape_arm.values == "left") & (max_x > 600)
+skipped = np.sum(bad)
+
+t = ea.conditions['m1'].loc[~bad]
 print(len(t.loc[t.escape_arm == "right"])/len(t), len(trials.loc[trials.escape_arm == "right"])/len(trials))
 ea.conditions['m1'] = t
 
@@ -110,13 +108,10 @@ for i, (condition, trials) in enumerate(ea.conditions.items()):
     # Get data
     if condition not in five_mazes: continue
 
-    means, maxes = {a:[] for a in ['left', 'right']}, {a:[] for a in ['left', 'right']}
-    for n, trial in trials.iterrows():
-        if trial.escape_arm == "center": continue
-
-        d = calc_distance_from_shelter(trial.body_xy[trial.out_of_t_frame-trial.stim_frame:, :], [500, 850])
-        means[trial.escape_arm].append(np.mean(d))
-        maxes[trial.escape_arm].append(np.max(d))
+    after_t = get_tracking_after_leaving_T(trials)
+    dists = [calc_distance_from_shelter(xy, [500, 850]) for xy in after_t]
+    means = get_values_by_arm(trials, [np.mean(d) for d in dists])
+    maxes = get_values_by_arm(trials, [np.max(d) for d in dists])
 
     # Take average and save it
     y = [np.mean(means['left']), np.mean(means['right'])]
@@ -137,76 +132,42 @@ for i, (condition, durations) in enumerate(path_durations.items()):
 # %%
 # ----------------------------- PREP DATA FOR GLM ---------------------------- #
 # Get all trials
-all_trials = dict(maze=[], geodist=[], eucldist=[], outcome=[], origin=[])
-summary = dict(maze=[], geodist=[], eucldist=[], n=[], k=[], m=[], pr=[])
-
+all_trials, summary = [], []
 for condition, trials in ea.conditions.items():
-    n,k = 0, 0
-    for i, trial in trials.iterrows():
-        if trial.escape_arm == "center": continue
-        elif trial.escape_arm == "right": 
-            all_trials['outcome'].append(1)
-            k +=1
-        else:
-            all_trials['outcome'].append(0)
-        n += 1
-
-        if trial.origin_arm == 'right':
-            all_trials['origin'].append(1)
-        else: 
-            all_trials['origin'].append(0)
-
-        all_trials['geodist'].append(mazes[condition]['ratio'])
-        all_trials['eucldist'].append(euclidean_dists[condition])
-        all_trials['maze'].append(condition)
-
-    summary['maze'].append(condition)
-    summary['geodist'].append(mazes[condition]['ratio'])
-    summary['eucldist'].append(euclidean_dists[condition])
-    summary['k'].append(k)
-    summary['n'].append(n)
-    summary['m'].append(n-k)
-    summary['pr'].append(k/n)
-
-
-all_trials= pd.DataFrame(all_trials)
-summary= pd.DataFrame(summary)
+    trials = trials.loc[trials.escape_arm != "center"]
+    all_trials.append(pd.DataFrame(dict(
+            maze = condition,
+            geodist = mazes[condition]['ratio'],
+            eucldist = euclidean_dists[condition],
+            outcome = (trials.escape_arm.values == "right").astype(int),
+            origin = (trials.origin_arm.values == "right").astype(int),
+    )))
+
+all_trials = pd.concat(all_trials, ignore_index=True)
+
+# k, n per maze
+summary = all_trials.groupby('maze', sort=False).agg(geodist=('geodist', 'first'), eucldist=('eucldist', 'first'),
+                                                        n=('outcome', 'size'), k=('outcome', 'sum')).reset_index()
+summary['m'] = summary.n - summary.k
+summary['pr'] = summary.k / summary.n
+summary = summary[['maze', 'geodist', 'eucldist', 'n', 'k', 'm', 'pr']]
 ntrials = len(all_trials)
 
 summary
 
 # %%
 # -------------------------------- GLM -------------------------------- #
-from statsmodels.graphics.api import abline_plot
+# ? the design matrix is built once, trials in the same maze are collapsed into a single row (k, n)
+glm = PolicyGLM(all_trials, features=['geodist', 'eucldist'])
 
 params_combinations = [['eucldist'], ['geodist'], ['geodist', 'eucldist']]
-models = []
-
-for params in params_combinations:
-
-    exog = summary[params]
-    exog = sm.add_constant(exog, prepend=False)
-    endog = summary[['k', 'm']]
-
-    glm_binom = sm.GLM(endog, exog, family=sm.families.Binomial())
-    res = glm_binom.fit()
-
-    print("\n\n\Fitting GLM with parameters: {}\n".format(params))
-    print(res.summary())
-    models.append(res)
-# print('\nParameters: \n', res.params)
-# print('\nT-values: \n', res.tvalues)
+models = glm.fit_all_subsets(params_combinations)
 
+PolicyGLM.summary(models)
 
 
 # %%
 # ------------------------------ EVALUATE MODELS ----------------------------- #
-
-def compute(params, geo=1, eucl=1):
-    x = params['const'] + params['geodist']*geo + params['eucldist']*eucl
-    return 1/(1+np.exp(-x))
-
-
 models_colors = [lightseagreen, blackboard, plum]
 markers = ['*', 'o', 'v']
 models_names = ['eucl', 'geod', 'eucl+geod']
@@ -216,9 +177,8 @@ f, ax = create_figure(subplots=False)
 
 for model, color, mk, name in zip(models, models_colors, markers, models_names):
     # Predict yhat
-    nobs = model.nobs
-    y = endog['k']/endog.sum(1)
-    yhat = model.mu
+    rows = glm.predict_rows(model)
+    y, yhat = rows.pr.values, rows.predicted_pr.values
 
     ax.scatter(yhat, y, s=350, marker = mk, color=color, zorder=99, label=name)
 
@@ -241,101 +201,62 @@ ax.scatter([mazes[condition]['ratio'] for condition in ea.conditions.keys()],
                 [euclidean_dists[condition] for condition in ea.conditions.keys()], 
                 s=250, c=[maze_colors[condition] for condition in ea.conditions.keys()], edgecolor=black,  zorder=99)
 
+# ? p(R) of the full model on a grid
+g, e, pr = PolicyGLM.prediction_grid(models[-1], geodist=(0.75, 2.3), eucldist=(0.5, 1.3))
+ax.contourf(g, e, pr, levels=20, cmap="bwr", alpha=.1, vmin=0, vmax=1)
+
 for model, color, mk, name in zip(models, models_colors, markers, models_names):
     g = np.linspace(0, 3, num=250)
-    if 'geodist' in model.params.keys() and 'eucldist' in model.params.keys():
-        e = -(model.params['eucldist']/model.params['geodist'])*g - model.params['const']/model.params['geodist']
+    e, th = PolicyGLM.decision_boundary(model, g)
+    if e is not None:
         ax.plot(g, e, color=color, lw=2, ls="--", label=name)
-    elif 'geodist' in model.params.keys():
-        ax.axvline(- model.params['const']/model.params['geodist'],  color=color, lw=2, ls="--", label=name)        
+    elif 'geodist' in model.features:
+        ax.axvline(th,  color=color, lw=2, ls="--", label=name)        
     else:
-        ax.axhline(- model.params['const']/model.params['eucldist'],  color=color, lw=2, ls="--", label=name)        
+        ax.axhline(th,  color=color, lw=2, ls="--", label=name)        
 ax.legend()
 ax.set(xlim=[0.75, 2.3], ylim=[0.5, 1.3], xlabel='geodesic distance', ylabel='euclidean distance')
 
-
-
-    # x0 = np.linspace(0.25, 3.5, num=250)
-    # y = [compute(model.params, geo=x, eucl=1) for x in x0]
-    # axarr[2].plot(x0, y, label="geodesic")
-
-    # y = [compute(model.params, eucl=x, geo=1) for x in x0]
-    # axarr[2].plot(x0, y, label="euclidean")
-
-    # axarr[2].axhline(0.5,  ls="--", lw=2, color=black, alpha=.5)
-    # axarr[2].legend()
-    # axarr[2].set(title="logistic for each variabel", xlabel="distance ratio", xlim=[0, 3], ylabel="p(R)", ylim=[0, 1])
-
-
 f.tight_layout()
 
 
 # %%
-
-# %%
-
 # ----------------------------- SINGLE TRIAL GLM ----------------------------- #
+params = ['geodist', 'eucldist']
 
-from statsmodels.graphics.api import abline_plot
-
-
-y, X = all_trials.outcome.values, all_trials[['geodist', 'eucldist']].values
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.3)
-
-xtrain = pd.DataFrame(dict(geodist=X_train[:, 0], eucldist=X_train[:, 1]))
-xtest = pd.DataFrame(dict(geodist=X_test[:, 0], eucldist=X_test[:, 1]))
-
-params_combinations = [['geodist', 'eucldist']]
-models = []
+train_idx, test_idx = train_test_split(np.arange(ntrials), test_size=0.3)
+train_glm = PolicyGLM(all_trials.iloc[train_idx], features=params)
+res = train_glm.fit(params)
+print(PolicyGLM.summary([res]))
 
-for params in params_combinations:
-
-    exog = xtrain[params]
-    exog = sm.add_constant(exog, prepend=False)
-    endog = y_train
-
-    glm_binom = sm.GLM(endog, exog, family=sm.families.Binomial())
-    res = glm_binom.fit()
-
-    print("\n\n\Fitting GLM with parameters: {}\n".format(params))
-    print(res.summary())
-    models.append(res)
+y_train, y_test = all_trials.outcome.values[train_idx], all_trials.outcome.values[test_idx]
+train_predicted_pr = train_glm.predict(res)
+test_predicted_pr = train_glm.predict(res, all_trials.iloc[test_idx])
 
+# ? binary predictions sampled from the predicted p(R), all draws at once
+n_draws = 1000
+for name, y, p in zip(['Train', 'Test'], [y_train, y_test], [train_predicted_pr, test_predicted_pr]):
+    y_hat = np.random.binomial(1, np.tile(p, (n_draws, 1)))
+    errors = np.mean((y_hat - y[None, :])**2, axis=1)
+    pcorr = np.mean(y_hat == y[None, :], axis=1)
 
+    print("{0} m.s.e. {1:.4f} +- {2:.4f}".format(name, np.mean(errors), np.std(errors)))    
+    print("{0} p corr {1:.4f} +- {2:.4f}".format(name, np.mean(pcorr), np.std(pcorr)))    
 
 
 # %%
-def get_p(res, g, e):
-    theta =  res.params['const'] + res.params['geodist']*g + res.params['eucldist']*e
-    return 1/(1+np.exp(theta))
-
-train_predicted_pr = [get_p(res, g, e) for e,g in zip(xtrain['eucldist'], xtrain['geodist'])]
-test_predicted_pr = [get_p(res, g, e) for e,g in zip(xtest['eucldist'], xtest['geodist'])]
-
-train_errors, errors = [], []
-train_pcorr, test_pcorr = [], []
-for i in range(1000):
-    y_hat = np.random.binomial(1, test_predicted_pr)
-    errors.append(mean_squared_error(y_test, y_hat))
-    test_pcorr.append(np.where(y_hat == y_test)[0].shape[0]/len(y_test))
-
-    y_hat = np.random.binomial(1, train_predicted_pr)
-    train_errors.append(mean_squared_error(y_train, y_hat))
-    train_pcorr.append(np.where(y_hat == y_train)[0].shape[0]/len(y_train))
-
-print("Train m.s.e. {0:.4f} +- {1:.4f}".format(np.mean(train_errors), np.std(train_errors)))    
-print("Test m.s.e. {0:.4f} +- {1:.4f}".format(np.mean(errors), np.std(errors)))    
+# ----------------------------- CROSS VALIDATION ----------------------------- #
+cv = glm.cross_validate(params, n_folds=10, n_processes=4)
+print(cv)
+print("CV m.s.e. {0:.4f} +- {1:.4f}".format(cv.mse.mean(), cv.mse.std()))
+print("CV p corr {0:.4f} +- {1:.4f}".format(cv.pcorr.mean(), cv.pcorr.std()))
 
-print("Train p corr {0:.4f} +- {1:.4f}".format(np.mean(train_pcorr), np.std(train_pcorr)))    
-print("Test p corr {0:.4f} +- {1:.4f}".format(np.mean(test_pcorr), np.std(test_pcorr)))    
 
 # %%
 # ------------------------------ EVALUATE MODEL ------------------------------ #
 
 # Compute p(R) for each trial in the test set
-exog = xtest[params]
-exog = sm.add_constant(exog, prepend=False)
-yhat = res.predict(exog).values
+yhat = test_predicted_pr
 
 # Plot predicted p(R) with actual trial outcome + logistic regression
 sort_idx = np.argsort(yhat)
@@ -13,7 +13,10 @@ from Modelling.bayes import Bayes
 from Modelling.maze_solvers.gradient_agent import GradientAgent
 from Modelling.maze_solvers.environment import Environment
 from Analysis.Behaviour.utils.trials_data_loader import TrialsLoader
+from Analysis.Behaviour.utils.trials_aggregation import get_tracking_after_leaving_T
+from Modelling.trials_outcomes import get_hits_ntrials_per_condition, get_binary_outcomes_per_session
 from Analysis.Behaviour.utils.path_lengths import PathLengthsEstimator
+from Analysis.Behaviour.utils.reaction_times import extract_reaction_times
 from Analysis.Behaviour.plotting.plot_trials_tracking import TrialsPlotter
 from Analysis.Behaviour.utils.plots_by_condition import PlotsByCondition
 
@@ -76,24 +79,18 @@ class ExperimentsAnalyser(Bayes, Environment, TrialsLoader, PathLengthsEstimator
 		# ? conditions should be a dict whose keys should be a list of strings with the names of the different conditions to be modelled
 		# ? the values of conditions should be a a list of dataframes, each specifying the trials for one condition (e.g. maze design) and the session they belong to
 
-		# Parse data
-		# Get trials
-		trials = {c:[] for c in conditions.keys()}
-		for condition, df in conditions.items():
-			sessions = sorted(set(df.uid.values))
-			for sess in sessions:
-				if "center" in  df.loc[df.uid==sess].escape_arm.values:
-					if not ignore_center:
-						raise NotImplementedError
-				else:
-					df = df.loc[df.escape_arm != "center"]
-				trials[condition].append([1 if "right" in arm.lower() else 0 for arm in df.loc[df.uid==sess].escape_arm.values])
-
-		# Get hits and number of trials
-		hits = {c:[np.sum(t2) for t2 in t] for c, t in trials.items()}
-		ntrials = {c:[len(t2) for t2 in t] for c,t in trials.items()}
-		p_r = {c: [h/n for h,n in zip(hits[c], ntrials[c])] for c in hits.keys()}
-		n_mice = {c:len(v) for c,v in hits.items()}
+		if not ignore_center and np.any([("center" in df.escape_arm.values) for df in conditions.values()]):
+			raise NotImplementedError
+
+		# Get hits and number of trials for each session in each condition
+		per_session = get_hits_ntrials_per_condition(conditions, ignore_center=ignore_center)
+		by_condition = {c:per_session.loc[per_session.condition == c] for c in conditions.keys()}
+
+		hits = {c:list(df.k.values) for c, df in by_condition.items()}
+		ntrials = {c:list(df.n.values) for c, df in by_condition.items()}
+		p_r = {c:list(df.p_r.values) for c, df in by_condition.items()}
+		n_mice = {c:len(df) for c, df in by_condition.items()}
+		trials = {c:get_binary_outcomes_per_session(df, ignore_center=ignore_center) for c, df in conditions.items()}
 		return hits, ntrials, p_r, n_mice, trials
 
 	def merge_conditions_trials(self, dfs):
@@ -104,26 +101,14 @@ class ExperimentsAnalyser(Bayes, Environment, TrialsLoader, PathLengthsEstimator
 		return merged
 
 	def get_hits_ntrials_maze_dataframe(self):
-		data = dict(id=[], k=[], n=[], maze=[])
-		hits, ntrials, p_r, n_mice, _ = self.get_binary_trials_per_condition(self.conditions)
-
-		for i, (k, n) in enumerate(zip(hits.values(), ntrials.values())):
-			for ii, (kk, nn) in enumerate(zip(k, n)):
-				data["id"].append(ii)
-				data["k"].append(kk)
-				data["n"].append(nn)
-				data["maze"].append(i)
-
-		data = pd.DataFrame.from_dict(data)
-		return data
+		data = get_hits_ntrials_per_condition(self.conditions)
+		data["id"] = data.groupby("condition").cumcount()
+		data["maze"] = data.condition.map({c:i for i, c in enumerate(self.conditions.keys())})
+		return data[["id", "k", "n", "maze"]]
 
 	def get_tracking_after_leaving_T_for_conditions(self):
 		for condition, trials in self.conditions.items():
-			trackings = []
-			for i, trial in trials.iterrows():
-				start_frame = trial.out_of_t_frame - trial.stim_frame
-				trackings.append(trial.body_xy[start_frame:, :])
-			trials['after_t_tracking'] = trackings
+			trials['after_t_tracking'] = get_tracking_after_leaving_T(trials)
 			
 
 	"""
@@ -133,19 +118,15 @@ class ExperimentsAnalyser(Bayes, Environment, TrialsLoader, PathLengthsEstimator
 	"""
 	def bayes_by_condition_analytical(self, conditions=None):
 		if conditions is None: conditions = self.conditions
-		results = {"condition":[], "alpha":[], "beta":[], "mean":[], "median":[], "sigmasquared":[], "prange":[]}
 		hits, ntrials, p_r, n_mice, trials = self.get_binary_trials_per_condition(conditions)
 
-		for (cond, h), n in zip(hits.items(), ntrials.values()):
-			res = self.grouped_bayes_analytical(np.sum(n), np.sum(h))
-			results['condition'].append(cond)
-			results['alpha'].append(res[0])
-			results['beta'].append(res[1])
-			results['mean'].append(res[2])
-			results['median'].append(res[3])
-			results['sigmasquared'].append(res[4])
-			results['prange'].append(res[5])
+		# ? posteriors of all conditions computed at once
+		names = list(conditions.keys())
+		a2, b2, mean, mode, sigmasquared, prange = self.grouped_bayes_analytical([np.sum(ntrials[c]) for c in names], 
+																		[np.sum(hits[c]) for c in names])
 
+		results = {"condition":names, "alpha":list(a2), "beta":list(b2), "mean":list(mean), "median":list(mode), 
+					"sigmasquared":list(sigmasquared), "prange":[type(prange)(*[v[i] for v in prange]) for i in range(len(names))]}
 		return pd.DataFrame(results)
 
 
@@ -156,9 +137,9 @@ class ExperimentsAnalyser(Bayes, Environment, TrialsLoader, PathLengthsEstimator
 			conditions = self.conditions
 
 		if not load:
-			trace = self.model_hierarchical_bayes(conditions)
+			# ? traces are also cached by the conditions' hits and trials, so fitting the same data again is free
+			trace = self.model_hierarchical_bayes(conditions, cache_folder=os.path.join(self.metadata_folder, "hb_traces"))
 			self.save_bayes_trace(trace, tracename)
-			trace = pm.trace_to_dataframe(trace)
 		else:
 			trace = self.load_trace(tracename)
 
@@ -282,27 +263,17 @@ class ExperimentsAnalyser(Bayes, Environment, TrialsLoader, PathLengthsEstimator
 	||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||
 	"""
 	def inspect_rt_metric(self, load=False, plot=True):
-		def get_first_peak(x, **kwargs):
-			peaks, _ = find_peaks(x, **kwargs)
-			if not np.any(peaks): return 0
-			return peaks[0]
-
-		def get_above_th(x, th):
-			peak = 0
-			while peak <= 0 and th>0:
-				try:
-					peak = np.where(x > th)[0][0]
-				except:
-					peak =  0
-				th -= .1
-			return peak
+		# ? th def
+		bodyth, snouth, rtth = 6, 6, 2.5
 
 		if not load:
-			# ? th def
-			bodyth, snouth, rtth = 6, 6, 2.5
-
 			data = self.merge_conditions_trials(list(self.conditions.values()))
 			data = data.loc[data.is_escape == "true"]
+
+			# Extract RT for all trials at once
+			datadf, traces, peaks = extract_reaction_times(data, bodyth=bodyth, snouth=snouth, rtth=rtth)
+			bodypeaks, snoutpeaks, rtpeaks = peaks['body'], peaks['snout'], peaks['rtmetric']
+
 			if plot:
 				f = plt.subplots(sharex=True)
 
@@ -319,68 +290,8 @@ class ExperimentsAnalyser(Bayes, Environment, TrialsLoader, PathLengthsEstimator
 				scatterax.set(xlabel="body peaks", ylabel="snout peaks", xlim=[0, 120], ylim=[0, 120])
 				histax.set(title="reaction times", xlabel="time (s)", ylabel="density")
 
-			datadict = {"trialid":[], "rt_frame":[], "fps":[], "rt_s":[], "rt_frame_originalfps":[]}
-			bodypeaks, snoutpeaks, rtpeaks = [], [], []
-			for n, (i, trial) in tqdm(enumerate(data.iterrows())):
-				# Get data
-				start, end = trial.stim_frame, int(np.ceil(trial.stim_frame + (trial.time_out_of_t * trial.fps)))
-				
-				if end-start < 5: continue
-
-				allsess_body = (TrackingData.BodyPartData & "bpname='body'" & "recording_uid='{}'".format(trial.recording_uid)).fetch("tracking_data")[0]
-				allsess_snout = (TrackingData.BodyPartData & "bpname='snout'" & "recording_uid='{}'".format(trial.recording_uid)).fetch("tracking_data")[0]
-				body, snout = allsess_body[start:end, :].copy(), allsess_snout[start:end, :].copy()
-
-				# ? remove tracking errors
-				body[:, 2][np.where(body[:, 2] > 25)] = np.nan
-				snout[:, 2][np.where(snout[:, 2] > 25)] = np.nan
-
-				# If filmed at 30fps, upsample
-				if trial.fps < 40:
-					new_n_frames = np.int(body.shape[0] / 30 * 40)
-					body = resample(body, new_n_frames)
-					snout = resample(snout, new_n_frames) 
-
-					body[:, 2], snout[:, 2] = body[:, 2]/30*40, snout[:, 2]/30*40
-
-				# Get speeds
-				bs, ss = line_smoother(body[:, 2],  window_size=11, order=3,), line_smoother(snout[:, 2],  window_size=11, order=3,)
-				rtmetric = ss-bs
-
-				# Get first peak
-				bpeak, speak, rtpeak = get_above_th(bs, bodyth), get_above_th(ss, snouth), get_above_th(rtmetric, rtth)
-
-				# Append to dictionary
-				if bpeak > 0  and speak > 0:
-					rt = rtpeak
-				elif bpeak == 0 and speak > 0:
-					rt = speak
-				elif bpeak > 0 and speak == 0:
-					rt = bpeak
-				else:
-					rt = None
-
-				#  data = {"trialid":[], "rt_frame":[], "fps":[], "rt_s":[], "rt_frame_originalfps":[]}
-				if rt is not None:
-					datadict["trialid"].append(trial.trial_id)
-					datadict["rt_frame"].append(rt)
-					datadict["fps"].append(trial.fps)
-					datadict["rt_s"].append(rt/40)
-					datadict["rt_frame_originalfps"].append(int(np.ceil(rt/40 * trial.fps)))
-				else:
-					datadict["trialid"].append(trial.trial_id)
-					datadict["rt_frame"].append(np.nan)
-					datadict["fps"].append(trial.fps)
-					datadict["rt_s"].append(np.nan)
-					datadict["rt_frame_originalfps"].append(np.nan)
-				
-				# Append to listdir
-				bodypeaks.append(bpeak)
-				snoutpeaks.append(speak)
-				rtpeaks.append(rtpeak)
-
-				# Plot
-				if plot:
+				for trace, bpeak, speak, rtpeak in zip(traces, bodypeaks, snoutpeaks, rtpeaks):
+					bs, ss, rtmetric = trace[:, 0], trace[:, 1], trace[:, 2]
 					bodyax.plot(bs, color=green, alpha=.2)
 					bodyax.scatter(bpeak, bs[bpeak], color=green, alpha=1)
 
@@ -390,16 +301,15 @@ class ExperimentsAnalyser(Bayes, Environment, TrialsLoader, PathLengthsEstimator
 					mainax.plot(rtmetric, color=magenta, alpha=.2)
 					mainax.scatter(rtpeak, rtmetric[rtpeak], color=magenta, alpha=1)
 
-					scatterax.scatter(bpeak, speak, color=white, s=100, alpha=.4)
+				scatterax.scatter(bodypeaks, snoutpeaks, color=white, s=100, alpha=.4)
 
-			if plot:
 				scatterax.plot([0, 200], [0, 200], **grey_line)
 				mainax.axhline(rtth, **grey_line)
 				snoutax.axhline(snouth, **grey_line)
 				bodyax.axhline(bodyth, **grey_line)
 
 				# Plot KDE of RTs
-				kde = sm.nonparametric.KDEUnivariate(datadict["rt_s"])
+				kde = sm.nonparametric.KDEUnivariate(datadf.rt_s.values)
 				kde.fit(bw=.1) # Estimate the densities
 				histax.fill_between(kde.support, 0, kde.density, alpha=.2, color=lightblue, lw=3,zorder=10)
 				histax.plot(kde.support, kde.density, alpha=1, color=lightblue, lw=3,zorder=10)
@@ -415,13 +325,30 @@ class ExperimentsAnalyser(Bayes, Environment, TrialsLoader, PathLengthsEstimator
 					ax.fill_between(x, z, y, alpha=.2, color=color, lw=3,zorder=10)
 					ax.plot(x, y, alpha=1, color=color, lw=3,zorder=10)
 
-			# Save to pickle
-			datadf = pd.DataFrame.from_dict(datadict)
-			datadf.to_pickle(os.path.join(self.metadata_folder, "reaction_time.pkl"))
+			# Save to database
+			self.save_reaction_times(data, datadf, bodyth, snouth, rtth)
 		else:
-			datadf = pd.read_pickle(os.path.join(self.metadata_folder, "reaction_time.pkl"))
+			datadf = pd.DataFrame((Trials * ReactionTimes).proj('fps', 'rt_frame', 'rt_s', 'rt_frame_originalfps').fetch())
+			datadf = datadf.rename(columns={"stimulus_uid":"trialid"})[["trialid", "rt_frame", "fps", "rt_s", "rt_frame_originalfps"]]
 		return datadf
 
+	def save_reaction_times(self, trials, datadf, bodyth, snouth, rtth):
+		""" Inserts the reaction times in the ReactionTimes table, replacing the ones previously computed """
+		# ? the same trial can be in more than one condition, keep one row per trial and match rows by stimulus_uid
+		keys = trials[Trials.primary_key].drop_duplicates("stimulus_uid")
+		rts = datadf[['trialid', 'rt_frame', 'rt_s', 'rt_frame_originalfps']].drop_duplicates("trialid")
+		merged = keys.merge(rts, left_on="stimulus_uid", right_on="trialid", how="inner")
+
+		entries = []
+		for i, rt in merged.iterrows():
+			entry = {k:rt[k] for k in Trials.primary_key}
+			entry.update(dict(rt_frame=rt.rt_frame, rt_s=rt.rt_s, rt_frame_originalfps=rt.rt_frame_originalfps,
+							body_th=bodyth, snout_th=snouth, rt_th=rtth))
+			for k in ['rt_frame', 'rt_s', 'rt_frame_originalfps']:
+				if np.isnan(entry[k]): entry[k] = None
+			entries.append(entry)
+		ReactionTimes.insert(entries, replace=True)
+
 
 if __name__ == "__main__":
 	ea2 = ExperimentsAnalyser(load_psychometric=False, tracking="all")
@@ -5,6 +5,9 @@ from Utilities.imports import *
 
 from Analysis.Behaviour.utils.behaviour_variables import *
 from Modelling.maze_solvers.gradient_agent import GradientAgent
+from Utilities.maths.geodesic import GeodesicFieldCache
+from database.exploration_stats import get_session_summaries, combine_summaries
+from Analysis.Behaviour.utils.trials_aggregation import get_path_lengths, get_durations_after_leaving_T, get_percentiles_by_arm, get_values_by_arm
 
 
 class PathLengthsEstimator:
@@ -16,7 +19,8 @@ class PathLengthsEstimator:
 	def get_arms_lengths_with_agent(self, load=False):
 		if not load:
 			# Get Gradiend Agent and maze arms images
-			agent = GradientAgent(grid_size=1000, start_location=[515, 208], goal_location=[515, 720])
+			grid_size = 1000
+			agent = GradientAgent(grid_size=grid_size, start_location=[515, 208], goal_location=[515, 720])
 
 			if sys.platform == "darwin":
 				maze_arms_fld = "/Users/federicoclaudi/Dropbox (UCL - SWC)/Rotation_vte/analysis_metadata/maze_solvers/good_single_arms"
@@ -25,13 +29,16 @@ class PathLengthsEstimator:
 			
 			arms = [os.path.join(maze_arms_fld, a) for a in os.listdir(maze_arms_fld) if "jpg" in a or "png" in a]
 			arms_data = dict(maze=[], n_steps=[], torosity=[], distance=[])
+
+			# ? geodesic fields are computed once per arm image and then loaded from the cache
+			geodesic_cache = GeodesicFieldCache(cache_folder=os.path.join(maze_arms_fld, "geodesic_fields"))
 			# Loop over each arm
 			for arm in arms:
 				if "centre" in arm: continue
 				print("getting geo distance for arm: ",arm)
 				# ? get maze, geodesic and walk
 				agent.maze, agent.free_states = agent.get_maze_from_image(model_path=arm)
-				agent.geodesic_distance = agent.geodist(agent.maze, agent.goal_location)
+				agent.geodesic_distance = geodesic_cache.get_field(agent.maze, agent.goal_location)
 				walk = agent.walk()
 				agent.plot_walk(walk)
 
@@ -53,26 +60,14 @@ class PathLengthsEstimator:
 			the threat platform to when they get to the shelter platform. It returns the data for left
 			and right as 5th 95th percentile and media and the ratio of these values.
 		"""
-		def do_arm(data):
-			path_lengths = []
-			for i, trial in data.iterrows():
-				path_lengths.append(np.sum(calc_distance_between_points_in_a_vector_2d(trial.after_t_tracking)))
-			try:
-				return percentile_range(path_lengths, low=10, high=90)
-			except:
-				return (0)
-				
 		res = namedtuple("res", "left right center ratio")
 		res2 = namedtuple("percentile", "low median mean high std sem")
 		self.get_tracking_after_leaving_T_for_conditions()
 
 		results = {}
 		for condition, trials in self.conditions.items():
-			left_trials = trials.loc[trials.escape_arm == 'left']
-			right_trials = trials.loc[trials.escape_arm == 'right']
-			center_trials = trials.loc[trials.escape_arm == 'center']
-
-			lres, rres, cres = do_arm(left_trials), do_arm(right_trials), do_arm(center_trials)
+			by_arm = get_percentiles_by_arm(trials, get_path_lengths(trials.after_t_tracking.values))
+			lres, rres, cres = by_arm['left'], by_arm['right'], by_arm['center']
 
 			ratio = res2(*[l/r for l,r in zip(lres, rres)])
 			results[condition] = res(lres, rres, cres, ratio)
@@ -84,19 +79,10 @@ class PathLengthsEstimator:
 			to when they step onto the shelter platform.]
 		"""
 
-		def do_arm(data):
-			durations = []
-			for i, trial in data.iterrows():
-				durations.append(trial.after_t_tracking.shape[0]/trial.fps)
-			try:
-				return percentile_range(durations, low=10, high=90)
-			except:
-				return (0)
-
 		res = namedtuple("res", "left right center ratio")
 		res2 = namedtuple("percentile", "low median mean high std sem")
 		
-		self.get_tracking_after_leaving_T_for_conditions()
+		# ? durations are computed from the trials' frames, the tracking is not needed
 
 		results = {}
 		alldata = {c:{a:[] for a in ['left', 'right', 'center']} for c in self.conditions.keys()}
@@ -105,17 +91,15 @@ class PathLengthsEstimator:
 				results[condition] = res(np.nan, np.nan, np.nan, np.nan)
 				continue
 
-			left_trials = trials.loc[trials.escape_arm == 'left']
-			right_trials = trials.loc[trials.escape_arm == 'right']
-			center_trials = trials.loc[trials.escape_arm == 'center']
-
-			lres, rres, cres = do_arm(left_trials), do_arm(right_trials), do_arm(center_trials)
+			durations = get_durations_after_leaving_T(trials)
+			by_arm = get_percentiles_by_arm(trials, durations)
+			lres, rres, cres = by_arm['left'], by_arm['right'], by_arm['center']
 
 			ratio = res2(*[l/r for l,r in zip(lres, rres)])
 			results[condition] = res(lres, rres, cres, ratio)
 
-			for i, trial in trials.iterrows():
-				alldata[condition][trial.escape_arm].append(trial.after_t_tracking.shape[0]/trial.fps)
+			for arm, arm_durations in get_values_by_arm(trials, durations).items():
+				alldata[condition][arm].extend(list(arm_durations))
 		return results, alldata
 
 	def get_exploration_per_path_from_trials(self):
@@ -132,15 +116,13 @@ class PathLengthsEstimator:
 				if exp.end_frame == -1: 
 					print("skipping no end")
 					continue
-				tracking = (TrackingData * TrackingData.BodyPartData & "bpname='body'" & "uid='{}'".format(exp.uid)).fetch("tracking_data")
-				tracking = np.vstack(tracking)[exp.start_frame:exp.end_frame, :]
-
-				on_the_left = tracking[tracking[:, 0] < 450, :]
-				on_the_right = tracking[tracking[:, 0] > 550, :]
+				# ? frames on each side from the recordings' summaries, computed from the tracking if some recordings don't have one
+				summaries = get_session_summaries("uid='{}'".format(exp.uid))
+				stats = combine_summaries(summaries, exp.start_frame, exp.end_frame)
 				fps = trials.loc[trials.uid == exp.uid].fps.values[0]
 
-				time_on_l.append(on_the_left.shape[0]/fps)
-				time_on_r.append(on_the_right.shape[0]/fps)
+				time_on_l.append(stats['left_frames']/fps)
+				time_on_r.append(stats['right_frames']/fps)
 				ratios.append(time_on_l[-1]/time_on_r[-1])
 
 			alldata[condition]['left'].extend(time_on_l)
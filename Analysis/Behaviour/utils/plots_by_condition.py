@@ -3,6 +3,8 @@ import sys
 sys.path.append("./")
 from Utilities.imports import *
 
+from Analysis.Behaviour.utils.resampling import bootstrap_pr_by_condition
+
 class PlotsByCondition:
     def __init__(self):
         return
@@ -29,7 +31,15 @@ class PlotsByCondition:
 
         return f, axarr
     
-    def plot_pr_bayes_bycond(self, prdata=None):
+    def plot_pr_bayes_bycond(self, prdata=None, bootstrap=False, n_resamples=100000, level="mouse"):
+        """[Plots the posterior p(R) of each condition, optionally next to its bootstrap confidence interval]
+
+        Keyword Arguments:
+            prdata {[pd.DataFrame]} -- [output of bayes_by_condition_analytical] (default: {None})
+            bootstrap {bool} -- [if True the bootstrap 95% interval of p(R) is plotted too] (default: {False})
+            n_resamples {int} -- [number of bootstrap resamples] (default: {100000})
+            level {str} -- [resample 'trial's or 'mouse' (sessions)] (default: {"mouse"})
+        """
         if prdata is  None:
             prdata = self.bayes_by_condition_analytical()
 
@@ -40,6 +50,13 @@ class PlotsByCondition:
                             yerr=np.array(data['mean']-data.prange.low, data.prange.high-data['mean']), 
                             marker="o",
                             label=data.condition)
+
+        if bootstrap:
+            boot = bootstrap_pr_by_condition({c:self.conditions[c] for c in prdata.condition.values}, 
+                                        level=level, n_resamples=n_resamples)
+            ax.errorbar(np.arange(len(boot)) + .2, boot.pr.values, 
+                            yerr=[boot.pr.values - boot.low.values, boot.high.values - boot.pr.values],
+                            fmt="o", color=[.2, .2, .2], label="bootstrap ({})".format(level))
             
 
         ax.legend()
@@ -0,0 +1,193 @@
+import sys
+sys.path.append('./')   # <- necessary to import packages from other directories within the project
+
+import numpy as np
+
+
+"""
+	Tracking of many trials stored as a single (total_frames, n_columns) array + the offsets at which each trial starts,
+	instead of a dataframe column of variable length arrays. Per trial reductions (path length, duration, max x...) are
+	computed for all trials at once with ufunc.reduceat and the container can be saved and loaded as a single .npz
+
+	Usage:
+		ragged = RaggedTracking.from_trials(trials, fields=['body_xy', 'body_speed'])
+		path_lengths = ragged.path_lengths()
+		max_x = ragged.max('body_xy_x')
+		ragged.save("trials_tracking.npz")
+"""
+
+
+class RaggedTracking:
+	def __init__(self, data, offsets, columns=None, trial_ids=None):
+		"""[Tracking of n trials]
+
+		Arguments:
+			data {[np.ndarray]} -- [(total_frames, n_columns) array with the tracking of all trials one after the other]
+			offsets {[np.ndarray]} -- [(n_trials + 1) array, trial i is data[offsets[i]:offsets[i+1]]]
+
+		Keyword Arguments:
+			columns {[list]} -- [names of the columns of data] (default: {None})
+			trial_ids {[np.ndarray]} -- [id of each trial, e.g. stimulus_uid] (default: {None})
+		"""
+		if data.ndim == 1: data = data[:, None]
+		self.data = data
+		self.offsets = np.asarray(offsets, dtype=np.int64)
+		if columns is None: columns = ["col{}".format(i) for i in range(data.shape[1])]
+		self.columns = list(columns)
+		self.trial_ids = np.asarray(trial_ids) if trial_ids is not None else np.arange(len(self))
+
+		if len(self.columns) != self.data.shape[1]:
+			raise ValueError("Got {} column names for {} columns".format(len(self.columns), self.data.shape[1]))
+		if self.offsets[-1] != self.data.shape[0]:
+			raise ValueError("Offsets don't match the number of frames")
+
+	# ------------------------------- Constructors ------------------------------- #
+	@classmethod
+	def from_arrays(cls, arrays, columns=None, trial_ids=None, dtype=np.float64):
+		"""[Builds the container from a list of (n_frames, n_columns) or (n_frames, ) arrays, one per trial]
+		"""
+		arrays = [np.asarray(a, dtype=dtype) for a in arrays]
+		arrays = [a[:, None] if a.ndim == 1 else a for a in arrays]
+		lengths = np.array([a.shape[0] for a in arrays], dtype=np.int64)
+		offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+		if arrays:
+			data = np.vstack(arrays)
+		else:
+			data = np.zeros((0, len(columns) if columns is not None else 1), dtype=dtype)
+		return cls(data, offsets, columns=columns, trial_ids=trial_ids)
+
+	@classmethod
+	def from_trials(cls, trials, fields=['body_xy', 'body_speed'], id_col="stimulus_uid", dtype=np.float64):
+		"""[Builds the container from the tracking columns of a trials dataframe (as returned by TrialsLoader).
+			2D fields like body_xy become two columns (body_xy_x, body_xy_y)]
+
+		Arguments:
+			trials {[pd.DataFrame]} -- [trials with tracking]
+
+		Keyword Arguments:
+			fields {list} -- [names of the tracking columns to include] (default: {['body_xy', 'body_speed']})
+			id_col {str} -- [column with the trials' ids] (default: {"stimulus_uid"})
+		"""
+		columns = []
+		for field in fields:
+			first = np.asarray(trials[field].values[0]) if len(trials) else np.zeros(0)
+			if first.ndim == 2 and first.shape[1] == 2: columns.extend([field+"_x", field+"_y"])
+			elif first.ndim == 2: columns.extend(["{}_{}".format(field, i) for i in range(first.shape[1])])
+			else: columns.append(field)
+
+		arrays = []
+		for values in zip(*[trials[field].values for field in fields]):
+			values = [np.asarray(v, dtype=dtype) for v in values]
+			arrays.append(np.hstack([v[:, None] if v.ndim == 1 else v for v in values]))
+
+		if id_col in trials.columns: trial_ids = trials[id_col].values
+		else: trial_ids = None
+		return cls.from_arrays(arrays, columns=columns, trial_ids=trial_ids, dtype=dtype)
+
+	# ---------------------------------- Access ---------------------------------- #
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def __getitem__(self, i):
+		""" Tracking of trial i (a view into data) """
+		return self.data[self.offsets[i]:self.offsets[i+1]]
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self[i]
+
+	@property
+	def lengths(self):
+		return np.diff(self.offsets)
+
+	@property
+	def trial_index(self):
+		""" For each frame in data, the index of the trial it belongs to """
+		return np.repeat(np.arange(len(self)), self.lengths)
+
+	@property
+	def frame_index(self):
+		""" For each frame in data, its frame number relative to the start of its trial """
+		return np.arange(self.data.shape[0]) - np.repeat(self.offsets[:-1], self.lengths)
+
+	def column(self, name):
+		return self.data[:, self.columns.index(name)]
+
+	def select_columns(self, names):
+		return RaggedTracking(self.data[:, [self.columns.index(n) for n in names]], self.offsets,
+							columns=names, trial_ids=self.trial_ids)
+
+	def slice_trials(self, starts=None, stops=None):
+		"""[Returns a new container with frames starts[i]:stops[i] of each trial (relative to the trial's start),
+			e.g. slice_trials(starts=out_of_t_frame - stim_frame) for the tracking after leaving the threat platform]
+		"""
+		frame_index = self.frame_index
+		keep = np.ones(len(frame_index), dtype=bool)
+		trial_index = self.trial_index
+		if starts is not None:
+			keep &= frame_index >= np.asarray(starts)[trial_index]
+		if stops is not None:
+			keep &= frame_index < np.asarray(stops)[trial_index]
+
+		lengths = np.bincount(trial_index[keep], minlength=len(self))
+		return RaggedTracking(self.data[keep], np.concatenate([[0], np.cumsum(lengths)]),
+							columns=self.columns, trial_ids=self.trial_ids)
+
+	# -------------------------------- Reductions -------------------------------- #
+	def reduce(self, ufunc, values, empty=np.nan):
+		"""[Applies ufunc.reduceat to values (one value per frame) for each trial]
+
+		Arguments:
+			ufunc {[np.ufunc]} -- [e.g. np.add, np.maximum]
+			values {[np.ndarray]} -- [array with one value per frame in data]
+
+		Keyword Arguments:
+			empty {[float]} -- [result for trials without frames] (default: {np.nan})
+		"""
+		result = np.full(len(self), empty, dtype=np.float64)
+		not_empty = self.lengths > 0
+		if np.any(not_empty):
+			result[not_empty] = ufunc.reduceat(values, self.offsets[:-1][not_empty])
+		return result
+
+	def sum(self, name):
+		return self.reduce(np.add, self.column(name), empty=0)
+
+	def max(self, name):
+		return self.reduce(np.maximum, self.column(name))
+
+	def min(self, name):
+		return self.reduce(np.minimum, self.column(name))
+
+	def mean(self, name):
+		return self.sum(name) / self.lengths
+
+	def durations(self, fps):
+		""" Duration in seconds of each trial, fps can be a scalar or an array with one value per trial """
+		return self.lengths / np.asarray(fps)
+
+	def step_lengths(self, x="body_xy_x", y="body_xy_y"):
+		""" Distance travelled between each frame and the previous one, 0 at the first frame of each trial """
+		steps = np.zeros(self.data.shape[0])
+		if self.data.shape[0] > 1:
+			xy = np.vstack([self.column(x), self.column(y)]).T.astype(np.float64)
+			steps[1:] = np.sqrt(np.sum(np.diff(xy, axis=0)**2, axis=1))
+		steps[self.offsets[:-1][self.lengths > 0]] = 0
+		return steps
+
+	def path_lengths(self, x="body_xy_x", y="body_xy_y"):
+		return self.reduce(np.add, self.step_lengths(x=x, y=y), empty=0)
+
+	# ------------------------------------ IO ------------------------------------ #
+	def save(self, filepath):
+		trial_ids = self.trial_ids
+		if trial_ids.dtype == object: trial_ids = trial_ids.astype(str) # ? so that it can be loaded without pickle
+		np.savez(filepath, data=self.data, offsets=self.offsets, columns=np.array(self.columns),
+						trial_ids=trial_ids)
+
+	@classmethod
+	def load(cls, filepath):
+		with np.load(filepath, allow_pickle=False) as loaded:
+			return cls(loaded['data'], loaded['offsets'], columns=list(loaded['columns']),
+						trial_ids=loaded['trial_ids'])
@@ -0,0 +1,141 @@
+import sys
+sys.path.append('./')   # <- necessary to import packages from other directories within the project
+
+import numpy as np
+import pandas as pd
+from scipy.signal import resample
+
+from Utilities.maths.filtering import line_smoother_ragged
+from Analysis.Behaviour.utils.ragged_tracking import RaggedTracking
+
+
+"""
+	Reaction time of escapes, computed for all trials at once:
+		- the body and snout speed between the stimulus and leaving the threat platform are sliced from the
+			tracking of each recording, fetched once for all the trials in that recording
+		- speeds of trials recorded at 30fps are upsampled to 40fps
+		- speeds are smoothed and thresholded for all trials together on a RaggedTracking
+	The reaction time is the first frame at which snout speed - body speed crosses rt_th, or when body
+	or snout cross their own threshold if only one of them does.
+"""
+
+rt_fps = 40 # ? all speeds are upsampled to this frame rate
+max_speed = 25 # ? speeds above this are tracking errors
+
+
+def get_trials_frames(trials):
+	""" First and last frame (relative to the recording) used to compute the RT of each trial """
+	starts = trials.stim_frame.values.astype(int)
+	ends = np.ceil(trials.stim_frame.values + (trials.time_out_of_t.values * trials.fps.values)).astype(int)
+	return starts, ends
+
+def get_trials_speeds(trials, bodyparts=['body', 'snout']):
+	"""[Speed of each bodypart for each trial, between the stimulus and leaving the threat platform]
+
+	Returns:
+		[dict] -- [bodypart:list of 1d arrays, one per trial]
+	"""
+	from database.TablesDefinitionsV4 import TrackingData
+
+	starts, ends = get_trials_frames(trials)
+	speeds = {bp:[None]*len(trials) for bp in bodyparts}
+	recordings = trials.recording_uid.values
+
+	for recording_uid in sorted(set(recordings)):
+		query = TrackingData.BodyPartData & "recording_uid='{}'".format(recording_uid) & \
+					"bpname in ({})".format(", ".join(["'{}'".format(bp) for bp in bodyparts]))
+		tracking = {bp:td for bp, td in zip(*query.fetch('bpname', 'tracking_data'))}
+
+		for i in np.where(recordings == recording_uid)[0]:
+			for bp in bodyparts:
+				speed = np.array(tracking[bp][starts[i]:ends[i], 2], dtype=np.float64)
+				speed[speed > max_speed] = np.nan  # ? remove tracking errors
+				speeds[bp][i] = speed
+	return speeds
+
+def upsample_speeds(speeds, fps):
+	"""[Upsamples to rt_fps the speeds recorded at lower frame rates, trials with the same length are resampled together]
+	"""
+	speeds = list(speeds)
+	to_upsample = np.where(np.asarray(fps) < rt_fps)[0]
+	lengths = np.array([len(speeds[i]) for i in to_upsample])
+
+	for length in set(lengths):
+		same_length = to_upsample[lengths == length]
+		for f in set(np.asarray(fps)[same_length]):
+			idx = same_length[np.asarray(fps)[same_length] == f]
+			new_n_frames = int(length / f * rt_fps)
+			upsampled = resample(np.vstack([speeds[i] for i in idx]), new_n_frames, axis=1) / f * rt_fps
+			for n, i in enumerate(idx): speeds[i] = upsampled[n]
+	return speeds
+
+def get_first_above_threshold(ragged, name, th, step=.1):
+	"""[For each trial the first frame at which the values in a column of a RaggedTracking are above threshold.
+		If they never are the threshold is lowered in steps until they are (or it reaches 0), 0 if they never cross it]
+	"""
+	ladder, t = [], th
+	while t > 0:
+		ladder.append(t)
+		t -= step
+	if not ladder: return np.zeros(len(ragged), dtype=int)
+	ladder = np.array(ladder)
+
+	values = ragged.column(name).copy()
+	values[np.isnan(values)] = -np.inf
+	maxes = ragged.reduce(np.maximum, values, empty=-np.inf)
+
+	# ? the highest threshold in the ladder that the trace crosses
+	above = ladder[None, :] < maxes[:, None]
+	found = np.any(above, axis=1)
+	thresholds = ladder[np.argmax(above, axis=1)]
+
+	trial_index = ragged.trial_index
+	crossing = values > thresholds[trial_index]
+	first = np.full(len(ragged), np.iinfo(np.int64).max)
+	np.minimum.at(first, trial_index[crossing], ragged.frame_index[crossing])
+	return np.where(found, first, 0).astype(int)
+
+def extract_reaction_times(trials, bodyth=6, snouth=6, rtth=2.5):
+	"""[Computes the reaction time of each trial]
+
+	Arguments:
+		trials {[pd.DataFrame]} -- [escape trials]
+
+	Keyword Arguments:
+		bodyth {float} -- [threshold on body speed] (default: {6})
+		snouth {float} -- [threshold on snout speed] (default: {6})
+		rtth {float} -- [threshold on snout speed - body speed] (default: {2.5})
+
+	Returns:
+		rts {[pd.DataFrame]} -- [trialid, rt_frame, fps, rt_s, rt_frame_originalfps for each trial with at least 5 frames]
+		traces {[RaggedTracking]} -- [smoothed body, snout speed and rt metric of each trial]
+		peaks {[dict]} -- [frame at which body, snout and rt metric cross their threshold]
+	"""
+	starts, ends = get_trials_frames(trials)
+	trials = trials.loc[(ends - starts) >= 5]
+
+	speeds = get_trials_speeds(trials)
+	fps = trials.fps.values
+	body = RaggedTracking.from_arrays(upsample_speeds(speeds['body'], fps), columns=['speed'])
+	snout = RaggedTracking.from_arrays(upsample_speeds(speeds['snout'], fps), columns=['speed'])
+
+	# Smooth speeds and compute RT metric
+	bs, offsets = line_smoother_ragged(body.column('speed'), body.offsets, window_size=11, order=3)
+	ss, _ = line_smoother_ragged(snout.column('speed'), snout.offsets, window_size=11, order=3)
+	traces = RaggedTracking(np.vstack([bs, ss, ss-bs]).T, offsets, columns=['body', 'snout', 'rtmetric'],
+						trial_ids=trials.stimulus_uid.values)
+
+	# Get first peaks
+	peaks = dict(body=get_first_above_threshold(traces, 'body', bodyth),
+				snout=get_first_above_threshold(traces, 'snout', snouth),
+				rtmetric=get_first_above_threshold(traces, 'rtmetric', rtth))
+	bpeak, speak, rtpeak = peaks['body'], peaks['snout'], peaks['rtmetric']
+
+	rt = np.full(len(trials), np.nan)
+	rt[(bpeak > 0) & (speak > 0)] = rtpeak[(bpeak > 0) & (speak > 0)]
+	rt[(bpeak == 0) & (speak > 0)] = speak[(bpeak == 0) & (speak > 0)]
+	rt[(bpeak > 0) & (speak == 0)] = bpeak[(bpeak > 0) & (speak == 0)]
+
+	rts = pd.DataFrame(dict(trialid=trials.stimulus_uid.values, rt_frame=rt, fps=fps, rt_s=rt/rt_fps,
+						rt_frame_originalfps=np.ceil(rt/rt_fps * fps)))
+	return rts, traces, peaks
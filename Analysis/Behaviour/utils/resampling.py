@@ -0,0 +1,230 @@
+import sys
+sys.path.append('./')   # <- necessary to import packages from other directories within the project
+
+import numpy as np
+import pandas as pd
+from itertools import combinations
+from multiprocessing import Pool
+
+from Modelling.trials_outcomes import get_hits_ntrials_per_session
+
+
+"""
+	Bootstrap and permutation tests for p(R), with all the resamples of a comparison drawn as index matrices.
+
+	Data are given as units with k hits out of n trials: at the trial level each unit is a trial (k is 0 or 1 and
+	n is 1), at the mouse level each unit is a session (k and n are the session's number of right escapes and of trials).
+	Each resample is a row of a (n_resamples, n_units) index matrix and p(R) = sum(k[idx]) / sum(n[idx]) is computed
+	for all rows with a matrix reduction. The resamples are drawn in chunks (so that the index matrix fits in memory)
+	and the chunks can be sharded across a process pool.
+
+	Usage:
+		k, n = get_resampling_units(trials, level="mouse")
+		samples = bootstrap_pr(k, n, n_resamples=100000)
+		observed, null, pvalue = permutation_test_pr(k_m1, n_m1, k_m2, n_m2)
+"""
+
+max_chunk_size = int(2e7) # ? max number of elements in the index matrix of a chunk
+
+
+# ---------------------------------------------------------------------------- #
+#                                     UNITS                                    #
+# ---------------------------------------------------------------------------- #
+def get_resampling_units(trials, level="trial", ignore_center=True, session_col="uid"):
+	"""[Hits and number of trials of the units to resample from a trials dataframe]
+
+	Arguments:
+		trials {[pd.DataFrame]} -- [trials with escape_arm and session_col]
+
+	Keyword Arguments:
+		level {str} -- ['trial' to resample trials, 'mouse' to resample sessions] (default: {"trial"})
+		ignore_center {bool} -- [if True center escapes are discarded, otherwise they count as misses] (default: {True})
+		session_col {str} -- [column identifying the session] (default: {"uid"})
+
+	Returns:
+		k {[np.ndarray]} -- [number of hits of each unit]
+		n {[np.ndarray]} -- [number of trials of each unit]
+	"""
+	if level == "trial":
+		if ignore_center: trials = trials.loc[trials.escape_arm != "center"]
+		k = (trials.escape_arm.values == "right").astype(np.int64)
+		return k, np.ones(len(k), dtype=np.int64)
+	elif level == "mouse":
+		per_session = get_hits_ntrials_per_session(trials, ignore_center=ignore_center, session_col=session_col)
+		return per_session.k.values.astype(np.int64), per_session.n.values.astype(np.int64)
+	else:
+		raise ValueError("Invalid resampling level: {}".format(level))
+
+def _as_units(k, n):
+	k = np.asarray(k, dtype=np.float64)
+	if n is None: n = np.ones(len(k))
+	return k, np.asarray(n, dtype=np.float64)
+
+
+# ---------------------------------------------------------------------------- #
+#                                    ENGINE                                    #
+# ---------------------------------------------------------------------------- #
+def _resample_chunk(args):
+	""" Computes the statistic for a chunk of resamples, top level function so that it can run in a process pool """
+	kind, k, n, size, n_resamples, seed, split = args
+	rng = np.random.RandomState(seed)
+
+	if kind == "bootstrap":
+		# ? sampling with replacement: each row of the index matrix is a resample
+		idx = rng.randint(0, len(k), size=(n_resamples, size))
+		return np.sum(k[idx], axis=1) / np.sum(n[idx], axis=1)
+
+	elif kind == "permutation":
+		# ? each row is a random permutation of the units, the first split units go to the first condition
+		idx = np.argsort(rng.random_sample((n_resamples, len(k))), axis=1)[:, :split]
+		ka, na = np.sum(k[idx], axis=1), np.sum(n[idx], axis=1)
+		return ka / na - (np.sum(k) - ka) / (np.sum(n) - na)
+
+	else:
+		raise ValueError("Invalid resampling kind: {}".format(kind))
+
+def _run_resampling(kind, k, n, size, n_resamples, seed, split=None, n_processes=1):
+	""" Splits the resamples in chunks of at most max_chunk_size elements and runs them, in a process pool if n_processes > 1 """
+	row_size = size if kind == "bootstrap" else len(k)
+	chunk_rows = max(1, int(max_chunk_size // max(row_size, 1)))
+	if n_processes > 1: chunk_rows = min(chunk_rows, int(np.ceil(n_resamples / n_processes)))
+
+	rows = [chunk_rows]*(n_resamples // chunk_rows)
+	if n_resamples % chunk_rows: rows.append(n_resamples % chunk_rows)
+	tasks = [(kind, k, n, size, r, seed*10000 + i, split) for i, r in enumerate(rows)]
+
+	if n_processes > 1 and len(tasks) > 1:
+		pool = Pool(min(n_processes, len(tasks)))
+		try:
+			results = pool.map(_resample_chunk, tasks)
+		finally:
+			pool.close()
+	else:
+		results = [_resample_chunk(t) for t in tasks]
+
+	if not results: return np.zeros(0)
+	return np.concatenate(results)
+
+
+# ---------------------------------------------------------------------------- #
+#                                   BOOTSTRAP                                  #
+# ---------------------------------------------------------------------------- #
+def bootstrap_pr(k, n=None, n_resamples=100000, size=None, seed=0, n_processes=1):
+	"""[Bootstrap distribution of p(R)]
+
+	Arguments:
+		k {[np.ndarray]} -- [number of hits of each unit (binary outcomes for trial level resampling)]
+
+	Keyword Arguments:
+		n {[np.ndarray]} -- [number of trials of each unit, if None each unit is a trial] (default: {None})
+		n_resamples {int} -- [number of resamples] (default: {100000})
+		size {[int]} -- [number of units in each resample, if None the number of units] (default: {None})
+		seed {int} -- [random seed] (default: {0})
+		n_processes {int} -- [size of the process pool] (default: {1})
+
+	Returns:
+		[np.ndarray] -- [p(R) of each resample]
+	"""
+	k, n = _as_units(k, n)
+	if not len(k): raise ValueError("Can't bootstrap without data")
+	if size is None: size = len(k)
+	return _run_resampling("bootstrap", k, n, int(size), int(n_resamples), seed, n_processes=n_processes)
+
+def bootstrap_pr_difference(k_a, n_a, k_b, n_b, n_resamples=100000, seed=0, n_processes=1):
+	"""[Bootstrap distribution of p(R|a) - p(R|b), the two conditions are resampled independently]
+
+	Returns:
+		[np.ndarray] -- [difference in p(R) for each resample]
+	"""
+	a = bootstrap_pr(k_a, n_a, n_resamples=n_resamples, seed=seed, n_processes=n_processes)
+	b = bootstrap_pr(k_b, n_b, n_resamples=n_resamples, seed=seed+1, n_processes=n_processes)
+	return a - b
+
+
+# ---------------------------------------------------------------------------- #
+#                                  PERMUTATION                                 #
+# ---------------------------------------------------------------------------- #
+def permutation_test_pr(k_a, n_a, k_b, n_b, n_resamples=100000, seed=0, n_processes=1):
+	"""[Permutation test for the difference in p(R) between two conditions: the units' condition labels are shuffled]
+
+	Arguments:
+		k_a, n_a {[np.ndarray]} -- [hits and number of trials of the units of condition a (n_a can be None for trials)]
+		k_b, n_b {[np.ndarray]} -- [same for condition b]
+
+	Returns:
+		observed {[float]} -- [p(R|a) - p(R|b)]
+		null {[np.ndarray]} -- [difference for each permutation]
+		pvalue {[float]} -- [two sided p value]
+	"""
+	k_a, n_a = _as_units(k_a, n_a)
+	k_b, n_b = _as_units(k_b, n_b)
+	if not len(k_a) or not len(k_b): raise ValueError("Can't run a permutation test without data for both conditions")
+
+	observed = np.sum(k_a) / np.sum(n_a) - np.sum(k_b) / np.sum(n_b)
+	null = _run_resampling("permutation", np.concatenate([k_a, k_b]), np.concatenate([n_a, n_b]), None,
+						int(n_resamples), seed, split=len(k_a), n_processes=n_processes)
+
+	# ? + 1 so that the p value is never 0
+	pvalue = (np.sum(np.abs(null) >= np.abs(observed) - 1e-12) + 1) / (len(null) + 1)
+	return observed, null, pvalue
+
+
+# ---------------------------------------------------------------------------- #
+#                                  CONDITIONS                                  #
+# ---------------------------------------------------------------------------- #
+def compare_conditions_pr(conditions, level="mouse", n_resamples=100000, low=2.5, high=97.5, seed=0, n_processes=1,
+							ignore_center=True, pairs=None):
+	"""[Bootstrap confidence interval and permutation test of the difference in p(R) between pairs of conditions]
+
+	Arguments:
+		conditions {[dict]} -- [condition:trials dataframe]
+
+	Keyword Arguments:
+		level {str} -- [resample 'trial's or 'mouse' (sessions)] (default: {"mouse"})
+		n_resamples {int} -- [resamples for each comparison] (default: {100000})
+		low, high {float} -- [percentiles of the confidence interval] (default: {2.5, 97.5})
+		pairs {[list]} -- [list of (condition a, condition b), if None all pairs] (default: {None})
+
+	Returns:
+		[pd.DataFrame] -- [condition_a, condition_b, pr_a, pr_b, delta, low, high, pvalue]
+	"""
+	units = {c:get_resampling_units(t, level=level, ignore_center=ignore_center) for c, t in conditions.items()}
+	if pairs is None: pairs = list(combinations(conditions.keys(), 2))
+
+	results = dict(condition_a=[], condition_b=[], pr_a=[], pr_b=[], delta=[], low=[], high=[], pvalue=[])
+	for i, (a, b) in enumerate(pairs):
+		(k_a, n_a), (k_b, n_b) = units[a], units[b]
+		observed, null, pvalue = permutation_test_pr(k_a, n_a, k_b, n_b, n_resamples=n_resamples,
+													seed=seed+2*i, n_processes=n_processes)
+		delta = bootstrap_pr_difference(k_a, n_a, k_b, n_b, n_resamples=n_resamples,
+													seed=seed+2*i, n_processes=n_processes)
+
+		results['condition_a'].append(a)
+		results['condition_b'].append(b)
+		results['pr_a'].append(np.sum(k_a) / np.sum(n_a))
+		results['pr_b'].append(np.sum(k_b) / np.sum(n_b))
+		results['delta'].append(observed)
+		results['low'].append(np.percentile(delta, low))
+		results['high'].append(np.percentile(delta, high))
+		results['pvalue'].append(pvalue)
+	return pd.DataFrame(results)
+
+def bootstrap_pr_by_condition(conditions, level="mouse", n_resamples=100000, low=2.5, high=97.5, seed=0, n_processes=1,
+							ignore_center=True):
+	"""[Bootstrap confidence interval of p(R) for each condition]
+
+	Returns:
+		[pd.DataFrame] -- [condition, pr, mean, std, low, high]
+	"""
+	results = dict(condition=[], pr=[], mean=[], std=[], low=[], high=[])
+	for i, (condition, trials) in enumerate(conditions.items()):
+		k, n = get_resampling_units(trials, level=level, ignore_center=ignore_center)
+		samples = bootstrap_pr(k, n, n_resamples=n_resamples, seed=seed+i, n_processes=n_processes)
+
+		results['condition'].append(condition)
+		results['pr'].append(np.sum(k) / np.sum(n))
+		results['mean'].append(np.mean(samples))
+		results['std'].append(np.std(samples))
+		results['low'].append(np.percentile(samples, low))
+		results['high'].append(np.percentile(samples, high))
+	return pd.DataFrame(results)
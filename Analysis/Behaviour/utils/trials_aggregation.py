@@ -0,0 +1,71 @@
+import sys
+sys.path.append('./')   # <- necessary to import packages from other directories within the project
+
+import numpy as np
+import pandas as pd
+
+from Utilities.maths.math_utils import percentile_range
+from Analysis.Behaviour.utils.ragged_tracking import RaggedTracking
+
+
+"""
+	Aggregations of trials dataframes (as returned by TrialsLoader) computed with groupby and numpy
+	instead of looping over sessions and rows: tracking after leaving the threat platform, path lengths 
+	and durations by escape arm. Hits and number of trials per session are in Modelling.trials_outcomes.
+"""
+
+arms = ['left', 'right', 'center']
+
+
+# ---------------------------------------------------------------------------- #
+#                              TRACKING AFTER T                                #
+# ---------------------------------------------------------------------------- #
+def get_tracking_after_leaving_T(trials):
+	"""[For each trial the body tracking from when the mouse leaves the threat platform to the end of the trial]
+	"""
+	starts = (trials.out_of_t_frame.values - trials.stim_frame.values).astype(int)
+	return [xy[start:, :] for xy, start in zip(trials.body_xy.values, starts)]
+
+def get_durations_after_leaving_T(trials):
+	"""[Time (s) from leaving the threat platform to reaching the shelter, from the trials' frames only
+		(same as the length of the tracking after T divided by the fps)]
+	"""
+	nframes = np.clip(trials.at_shelter_frame.values - trials.out_of_t_frame.values, 0, None)
+	return nframes / trials.fps.values
+
+def get_path_lengths(tracks):
+	"""[Length of the path in each of a list of XY tracks, all the tracks are processed at once]
+
+	Arguments:
+		tracks {[list]} -- [list of (n_frames, 2) arrays]
+	"""
+	ragged = RaggedTracking.from_arrays([np.asarray(t)[:, :2] for t in tracks], columns=['x', 'y'])
+	return ragged.path_lengths(x='x', y='y')
+
+def get_path_lengths_after_leaving_T(trials):
+	return get_path_lengths(get_tracking_after_leaving_T(trials))
+
+
+# ---------------------------------------------------------------------------- #
+#                                    BY ARM                                    #
+# ---------------------------------------------------------------------------- #
+def get_values_by_arm(trials, values):
+	"""[Splits an array with one value per trial by escape arm]
+
+	Returns:
+		[dict] -- [arm:array of values]
+	"""
+	values = np.asarray(values)
+	escape_arms = trials.escape_arm.values
+	return {arm:values[escape_arms == arm] for arm in arms}
+
+def get_percentiles_by_arm(trials, values, low=10, high=90):
+	"""[percentile_range of the values of the trials for each escape arm, 0 if an arm has no trials]
+	"""
+	by_arm = {}
+	for arm, arm_values in get_values_by_arm(trials, values).items():
+		if not len(arm_values):
+			by_arm[arm] = (0)
+		else:
+			by_arm[arm] = percentile_range(arm_values, low=low, high=high)
+	return by_arm
@@ -4,10 +4,107 @@ sys.path.append('./')   # <- necessary to import packages from other directories
 from Utilities.imports import *
 
 from Analysis.Behaviour.utils.behaviour_variables import *
+from database.trial_tracking import get_trial_tracking_accessor, trial_tracking_fields
+from database.compact_tracking import expand_columns, trial_blobs
+
+
+class TrialsDataset(pd.DataFrame):
+	"""[Dataframe of trials whose tracking columns (body_xy, body_speed...) are only fetched when they are first used.
+		The scalar attributes (uid, escape_arm, escape_duration...) are loaded eagerly, the tracking of all the trials
+		in the dataset is fetched in bulk the first time a tracking column is accessed or the rows are iterated over.
+		Slices (e.g. the trials of a session) keep a reference to the dataset they come from: the first time their 
+		tracking is used the whole dataset's tracking is loaded (once) and they take their rows from it]
+	"""
+	_metadata = ['_loader', '_tracking', '_root']
+	_loader, _tracking = None, None # ? TrialsLoader used to fetch the tracking and which tracking ("all" or "threat")
+	_root = None # ? dataset this one was sliced from, None if it was loaded by TrialsLoader
+
+	tracking_columns = list(trial_tracking_fields.keys())
+
+	@property
+	def _constructor(self):
+		return TrialsDataset
+
+	def __finalize__(self, other, method=None, **kwargs):
+		if method == "concat" and hasattr(other, "objs"): 
+			# ? rows can come from different datasets, the concatenated one loads its own tracking
+			other = other.objs[0]
+			root = None
+		elif isinstance(other, TrialsDataset):
+			root = other._root if other._root is not None else other
+		else:
+			root = None
+
+		object.__setattr__(self, '_loader', getattr(other, '_loader', None))
+		object.__setattr__(self, '_tracking', getattr(other, '_tracking', None))
+		object.__setattr__(self, '_root', root if root is not self else None)
+		return self
+
+	@property
+	def tracking_loaded(self):
+		return self._loader is None or self._tracking is None or all([c in self.columns for c in self.tracking_columns])
+
+	def load_tracking(self):
+		"""[Fetches the tracking for all the trials in the dataset and adds it as columns, in place]
+		"""
+		if self.tracking_loaded: return self
+		
+		if not len(self):
+			loaded = pd.DataFrame(columns=self.tracking_columns)
+		elif self._root is not None:
+			# ? load the tracking of the whole dataset once and take this slice's rows from it
+			root = self._root.load_tracking()
+			loaded = pd.DataFrame(root[self.tracking_columns])
+			if 'stimulus_uid' in self.columns and 'stimulus_uid' in root.columns:
+				loaded.index = root.stimulus_uid.values
+				loaded = loaded.loc[~loaded.index.duplicated()].reindex(self.stimulus_uid.values)
+				loaded.index = self.index
+		else:
+			loaded = self._loader.add_trials_tracking(pd.DataFrame(self), tracking=self._tracking)
+
+		with pd.option_context('mode.chained_assignment', None):
+			for col in self.tracking_columns:
+				self[col] = loaded[col].reindex(self.index) # ? NaN for trials without tracking
+		return self
+
+	def __getattr__(self, name):
+		if name in self.tracking_columns and not self.tracking_loaded:
+			self.load_tracking()
+			return self[name]
+		return super().__getattr__(name)
+
+	def __getitem__(self, key):
+		if not self.tracking_loaded:
+			if isinstance(key, str): requested = [key]
+			elif isinstance(key, list): requested = key
+			else: requested = []
+			if [k for k in requested if k in self.tracking_columns]: self.load_tracking()
+		return super().__getitem__(key)
+
+	def to_ragged(self, fields=['body_xy', 'body_speed']):
+		"""[Returns the trials' tracking as a RaggedTracking, for vectorized computations across trials]
+		"""
+		from Analysis.Behaviour.utils.ragged_tracking import RaggedTracking
+		self.load_tracking()
+		return RaggedTracking.from_trials(self, fields=fields)
+
+	def iterrows(self):
+		self.load_tracking()
+		return super().iterrows()
+
+	def itertuples(self, *args, **kwargs):
+		self.load_tracking()
+		return super().itertuples(*args, **kwargs)
+
 
 class TrialsLoader:
 	max_duration_th = 19 # ? only trials in which the mice reach the shelter within this number of seconds are considered escapes (if using escapes == True)
 
+	use_trials_cache = True # ? keep a local copy of the trials' tracking, see get_tracking_cache
+	_trials_cache = {} # ? in memory copy of the trials' tracking, shared by all loaders in this process
+	lazy_tracking = True # ? if True the trials' tracking is fetched when it's first used, see TrialsDataset
+	upcast_tracking = False # ? if True compact (float32) tracking is returned as float64, see database.compact_tracking
+
 	# look up dictionaries
 	naive_lookup = {0: "experienced", 1:"naive", -1:"nan"}
 	lights_lookup = {0: "off", 1:"on", 2:"on_trials", 3:"on_exploration", -1:"nan"}
@@ -52,39 +149,154 @@ class TrialsLoader:
 		if escapes_dur is None: escapes_dur = self.escapes_dur
 		if shelter is None: shelter = self.shelter
 
-		# Get all trials from the AllTrials Table
-		if tracking is not None:
-			if tracking == "all":
-				if experiment_name is None:
-					all_trials = pd.DataFrame((Session * Trials * Trials.TrialTracking * Trials.TrialSessionMetadata.proj(ename='experiment_name') & "escape_duration > 0").fetch())
-				else:
-					all_trials = pd.DataFrame((Session * Trials * Trials.TrialTracking * Trials.TrialSessionMetadata.proj(ename='experiment_name')\
-						& "escape_duration > 0" & "experiment_name='{}'".format(experiment_name)).fetch())
-			elif tracking == "threat":
-				if experiment_name is None:
-					all_trials = pd.DataFrame((Session * Trials * Trials.ThreatTracking * Trials.TrialSessionMetadata.proj(ename='experiment_name') & "escape_duration > 0").fetch())
-				else:
-					all_trials = pd.DataFrame((Session * Trials * Trials.ThreatTracking * Trials.TrialSessionMetadata.proj(ename='experiment_name')\
-						& "escape_duration > 0" & "experiment_name='{}'".format(experiment_name)).fetch())
-			
-			else:
-				raise ValueError("tracking parameter not valid")
-		else:
-			all_trials = pd.DataFrame(Trials.fetch())
+		if tracking is not None and tracking not in ["all", "threat"]:
+			raise ValueError("tracking parameter not valid")
+
+		# Get the trials that match the criteria, all the restrictions are applied by the database
+		query = self.get_trials_query(maze_design=maze_design, naive=naive, lights=lights, shelter=shelter,
+							escapes_dur=escapes_dur, experiment_name=experiment_name)
+		trials = TrialsDataset(query.fetch())
+		trials._loader, trials._tracking = self, tracking
+
+		# Get the tracking only for the selected trials
+		if not self.lazy_tracking:
+			trials.load_tracking()
+		return trials
+
+
+	def get_trials_query(self, maze_design=None, naive=None, lights=None, shelter=None, escapes_dur=False, experiment_name=None):
+		""" DJ query for the trials' scalar attributes restricted to the sessions that match the conditions """
+		sessions = self.get_sessions_by_condition(maze_design=maze_design, naive=naive, lights=lights, shelter=shelter, df=False)
+
+		# ? Remove trials with negative escape duration [placeholders]
+		query = (Session & sessions.proj()) * Trials * Trials.TrialSessionMetadata.proj(ename='experiment_name') & "escape_duration > 0"
 
 		if escapes_dur:
-			all_trials = all_trials.loc[all_trials.escape_duration <= self.max_duration_th]
+			query = query & "escape_duration <= {}".format(self.max_duration_th)
+		if experiment_name is not None:
+			query = query & "experiment_name='{}'".format(experiment_name)
+		return query
 
-		# Remove trials with negative escape duration [placeholders]
-		all_trials = all_trials.loc[all_trials.escape_duration > 0]
+	def add_trials_tracking(self, trials, tracking="all"):
+		"""[Adds the tracking columns to a dataframe of trials. Tracking is fetched (in a single query) only for the 
+			trials not already in the local cache]
+		
+		Arguments:
+			trials {[pd.DataFrame]} -- [trials' scalar attributes, with the Trials primary key]
+		
+		Keyword Arguments:
+			tracking {[str]} -- ["all" for Trials.TrialTracking, "threat" for Trials.ThreatTracking] (default: {"all"})
+		"""
+		if not Trials.store_tracking: # ? tracking is sliced from the sessions' tracking
+			accessor = get_trial_tracking_accessor()
+			accessor.upcast = self.upcast_tracking
+			return accessor.add_trial_tracking(trials, threat=tracking=="threat")
 
-		# Get the sessions that match the criteria and use them to discard other trials
-		sessions = self.get_sessions_by_condition(maze_design=maze_design, naive=naive, lights=lights,shelter=shelter, df=True)
-		ss = set(sorted(sessions.uid.values))
-		trials = all_trials.loc[all_trials.uid.isin(ss)]
+		tracking_table = self.get_tracking_table(tracking)
+		columns = tracking_table.heading.secondary_attributes
 
-		return trials
+		cached = self.get_tracking_cache(tracking)
+		missing = trials.loc[~trials.stimulus_uid.isin(cached.index)]
+		if len(missing):
+			keys = missing[tracking_table.primary_key].to_dict('records')
+			fetched = pd.DataFrame((tracking_table & keys).fetch())
+			fetched.index = fetched.stimulus_uid.values
+			cached = self.save_tracking_cache(tracking, fetched[columns])
+
+		trials = trials.loc[trials.stimulus_uid.isin(cached.index)].copy()
+		selected = cached.loc[trials.stimulus_uid.values]
+		for col in columns:
+			trials[col] = selected[col].values
+		return expand_columns(trials, trial_blobs, fields=columns, upcast=self.upcast_tracking) # ? the cache keeps the compact tracking
+
+	# ? Cache of the trials' tracking
+	@staticmethod
+	def get_tracking_table(tracking="all"):
+		if tracking == "all": return Trials.TrialTracking
+		else: return Trials.ThreatTracking
+
+	def get_trials_checksum(self, tracking="all", refresh=False):
+		"""[Fingerprint of the trials' tracking table: the time of its last update, number of entries and last key.
+			It changes when trials are added, deleted or re-populated and it's computed once per loader 
+			(use refresh=True to compute it again)]
+		"""
+		if not hasattr(self, "_trials_checksums"): self._trials_checksums = {}
+		if tracking in self._trials_checksums and not refresh:
+			return self._trials_checksums[tracking]
+
+		table = self.get_tracking_table(tracking)()
+		update_time = table.connection.query("SELECT update_time FROM information_schema.tables WHERE table_schema=%s AND table_name=%s",
+								args=(table.database, table.table_name)).fetchall()
+		last_key = table.fetch("stimulus_uid", order_by="stimulus_uid DESC", limit=1)
+		last_key = last_key[0] if len(last_key) else None
+
+		self._trials_checksums[tracking] = str((update_time, len(table), last_key))
+		return self._trials_checksums[tracking]
+
+	def get_trials_cache_folder(self, tracking="all"):
+		folder = getattr(self, "metadata_folder", None)
+		if folder is None or not os.path.isdir(folder): return None
+		return os.path.join(folder, "trials_tracking_cache_{}".format(tracking))
+
+	def get_tracking_cache(self, tracking="all"):
+		"""[Returns a dataframe indexed by stimulus_uid with the tracking of the trials fetched so far.
+			It's kept in memory and in the metadata folder (a file for each batch of trials fetched) and 
+			discarded when the tracking table changes]
+		"""
+		if not self.use_trials_cache:
+			return pd.DataFrame()
+
+		checksum = self.get_trials_checksum(tracking)
+		if tracking in self._trials_cache and self._trials_cache[tracking]['checksum'] == checksum:
+			return self._trials_cache[tracking]['tracking']
+
+		cached = pd.DataFrame()
+		folder = self.get_trials_cache_folder(tracking)
+		if folder is not None and os.path.isdir(folder):
+			checksum_file = os.path.join(folder, "checksum.txt")
+			if os.path.isfile(checksum_file) and open(checksum_file).read() == checksum:
+				batches = sorted([f for f in os.listdir(folder) if f.startswith("batch_") and f.endswith(".pkl")])
+				try:
+					cached = pd.concat([pd.read_pickle(os.path.join(folder, f)) for f in batches]) if batches else cached
+					cached = cached.loc[~cached.index.duplicated(keep='last')]
+				except Exception as e:
+					print("Could not load trials cache {}: {}".format(folder, e))
+					cached = pd.DataFrame()
+			else: # ? the tracking table changed
+				import shutil
+				shutil.rmtree(folder)
+
+		self._trials_cache[tracking] = dict(checksum=checksum, tracking=cached)
+		return cached
+
+	def save_tracking_cache(self, tracking, fetched):
+		"""[Adds a batch of fetched tracking to the cache, only the new batch is written to disk. Returns the whole cache]
+		"""
+		if not self.use_trials_cache: return fetched
+		cached = pd.concat([self._trials_cache[tracking]['tracking'], fetched])
+		self._trials_cache[tracking]['tracking'] = cached
+
+		folder = self.get_trials_cache_folder(tracking)
+		if folder is None: return cached
+		if not os.path.isdir(folder): os.makedirs(folder)
+		checksum_file = os.path.join(folder, "checksum.txt")
+		if not os.path.isfile(checksum_file):
+			with open(checksum_file, "w") as f: f.write(self._trials_cache[tracking]['checksum'])
+
+		# ? write to a temporary file and rename it, so that other processes never read a partial batch
+		name = "batch_{}_{}".format(int(time.time()*1e6), os.getpid())
+		pd.to_pickle(fetched, os.path.join(folder, name + ".tmp"))
+		os.replace(os.path.join(folder, name + ".tmp"), os.path.join(folder, name + ".pkl"))
+		return cached
+
+	def clear_trials_cache(self, tracking=None):
+		import shutil
 
+		for t in (["all", "threat"] if tracking is None else [tracking]):
+			folder = self.get_trials_cache_folder(t)
+			if folder is not None and os.path.isdir(folder): shutil.rmtree(folder)
+			TrialsLoader._trials_cache.pop(t, None)
+			getattr(self, "_trials_checksums", {}).pop(t, None)
 
 	def get_sessions_by_condition(self, maze_design=None, naive=None, lights=None,  shelter=None, df=False):
 		""" Query the DJ database table AllTrials for the trials that match the conditions """
@@ -123,6 +335,7 @@ class TrialsLoader:
 	def save_trials_to_pickle(self, save_psychometric=False, save_path=None):
 		if save_psychometric:
 			for k, df in self.conditions.items():
+				if isinstance(df, TrialsDataset): df = pd.DataFrame(df.load_tracking())
 				save_df(df, os.path.join(self.metadata_folder, k+".pkl"))
 		elif save_path is not None:
 			save_df(save_path)
\ No newline at end of file
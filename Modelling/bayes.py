@@ -3,13 +3,20 @@ sys.path.append('./')
 
 from Utilities.imports import *
 
-import pymc3 as pm
+try: 
+    import pymc3 as pm
+except ImportError: # ? only needed for the logistic regressions, the hierarchical model doesn't use it
+    pm = None
 from math import factorial as fact
 from scipy.special import binom
 import pickle
 # import pymc3 as pm
 import pydot
 
+from Modelling.trials_outcomes import get_hits_ntrials_per_session
+from Modelling.hierarchical_bayes import HierarchicalBetaBinomial
+from Modelling.beta_posteriors import beta_posteriors, credible_interval
+
 class Bayes:
     # Bayes hyper params
     hyper_mode = (1, 1)  # a,b of hyper beta distribution (modes)
@@ -52,46 +59,24 @@ class Bayes:
             n {[int]} -- [tot number of trials]
             k {[int]} -- [tot number of hits]
         """
-        # Compute posterior function
-        fact = binom(n, k)
-        a2 = self.a + k - 1
-        b2 = self.b + n -k -1
-
-        # Plot mean and mode of posterior
-        mean =  a2 / (a2 + b2)
-        mode = (a2 -1)/(a2 + b2 -2)
-        sigmasquared = (a2 * b2)/((a2+b2)**2 * (a2 + b2 + 1)) # https://math.stackexchange.com/questions/497577/mean-and-variance-of-beta-distributions
-        prange = percentile_range(get_parametric_distribution("beta", a2, b2)[1])
-
-        return (a2, b2, mean, mode, sigmasquared, prange)
+        # ? posterior is Beta(self.a + k - 1, self.b + n - k - 1), n and k can be arrays
+        post = beta_posteriors(k, n, a=self.a - 1, b=self.b - 1)
+        return (post.a, post.b, post.mean, post.mode, post.sigmasquared, post.prange)
      
         
 
-    def model_hierarchical_bayes(self, conditions): # ? using PyMC3
+    def model_hierarchical_bayes(self, conditions, n_samples=4000, n_chains=4, n_processes=4, cache_folder=None):
+        """[Fits the hierarchical beta-binomial model of p(R) to each condition, see Modelling.hierarchical_bayes]
+
+        Returns:
+            [pd.DataFrame] -- [trace, with the same columns as PyMC3's trace_to_dataframe]
+        """
         hits, ntrials, p_r, n_mice, _ = self.get_binary_trials_per_condition(conditions)
 
-        # Create model and fit
-        n_conditions = len(list(conditions.keys()))
         print("Fitting bayes to conditions:", list(conditions.keys()))
-        with pm.Model() as model:
-            # Define hyperparams
-            modes_hyper = pm.Beta("mode_hyper", alpha=self.hyper_mode[0], beta=self.hyper_mode[1], shape=n_conditions)
-            concentrations_hyper = pm.Gamma("concentration_hyper", alpha=self.k_hyper_shape, beta=self.k_hyper_rate, shape=n_conditions)
-
-            # Define priors
-            for i, condition in enumerate(conditions.keys()):
-                prior_a, prior_b = beta_distribution_params(omega=modes_hyper[i], kappa=concentrations_hyper[i])
-                prior = pm.Beta("{}_prior".format(condition), alpha=prior_a, beta=prior_b, shape=len(ntrials[condition]))
-                likelihood = pm.Binomial("{}_likelihood".format(condition), n=ntrials[condition], p=prior, observed=hits[condition])
-
-            # Fit
-            print("Got all the variables, starting NUTS sampler")
-            self.save_model_image(model, os.path.join("D:\\Dropbox (UCL - SWC)\\Rotation_vte\\plots\\00_Psychometric", "hb"))
-            # trace = pm.sample(6000, tune=500, cores=2, nuts_kwargs={'target_accept': 0.99}, progressbar=True)
-
-            # pm.traceplot(trace)
-            plt.show()
-        return trace
+        model = HierarchicalBetaBinomial(hyper_mode=self.hyper_mode, k_hyper_shape=self.k_hyper_shape,
+                                    k_hyper_rate=self.k_hyper_rate, cache_folder=cache_folder)
+        return model.fit(hits, ntrials, n_samples=n_samples, n_chains=n_chains, n_processes=n_processes)
 
     def analytical_bayes_individuals(self, conditions=None, data=None, mode="individuals", plot=True):
         """
@@ -107,26 +92,14 @@ class Bayes:
             hits, ntrials, p_r, n_mice, _ = self.get_binary_trials_per_condition(conditions)
             # for (cond, H), (c, N) in zip(hits.items(), ntrials.items())
             
-            # compute likelihood function
+            # compute the posteriors of all conditions at once
+            names = list(conditions.keys())
+            post = beta_posteriors([np.sum(hits[c]) for c in names], [np.sum(ntrials[c]) for c in names], a=a, b=b)
+
             modes, means, params, sigmas, pranges = {}, {}, {},{}, {}
-            for condition in conditions.keys():
-                fact, kk, dnk = 1, 1, 1
-                for k,n in zip(hits[condition], ntrials[condition]):
-                    fact *= binom(n, k)
-                    kk += k
-                    dnk += n-k
-            
-                # Now compute the posterior
-                a2 = a - 1 + kk
-                b2 = b - 1 + dnk
-
-                # Plot mean and mode of posterior
-                mean =  a2 / (a2 + b2)
-                _mode = (a2 -1)/(a2 + b2 -2)
-                sigmasquared = (a2 * b2)/((a2+b2)**2 * (a2 + b2 + 1)) # https://math.stackexchange.com/questions/497577/mean-and-variance-of-beta-distributions
-                prange = percentile_range(get_parametric_distribution("beta", a2, b2)[1])
-                
-                modes[condition], means[condition], params[condition], sigmas[condition], pranges[condition] = _mode, mean, ptuple(a2, b2), sigmasquared, prange
+            for i, condition in enumerate(names):
+                modes[condition], means[condition], params[condition], sigmas[condition] = post.mode[i], post.mean[i], ptuple(post.a[i], post.b[i]), post.sigmasquared[i]
+                pranges[condition] = credible_interval(*[v[i] for v in post.prange])
             return modes, means, params, sigmas, pranges
 
 
@@ -136,12 +109,8 @@ class Bayes:
             modes, means, params, sigmas, pranges = {}, {}, {},{}, {}
             for expn, (exp, trials) in enumerate(data.items()):
                 # Get number of tirals ad hits per session
-                N, K = [], []
-                sessions = sorted(set(trials.session_uid.values))
-                for uid in sessions:
-                    sess_trials = trials.loc[trials.session_uid == uid]
-                    N.append(len(sess_trials))
-                    K.append(len([i for i,t in sess_trials.iterrows() if "right" in t.escape_arm.lower()]))
+                per_session = get_hits_ntrials_per_session(trials, ignore_center=False, session_col="session_uid")
+                N, K = list(per_session.n.values), list(per_session.k.values)
 
                 if mode == "individuals":
                     # Each mouse outcome is modelled as a binomial given the number of hits k and trials n
@@ -173,11 +142,8 @@ class Bayes:
                     # time theta to the product of K times (1-theta) to the product of n-k.
 
                     # compute likelihood function
-                    fact, kk, dnk = 1, 1, 1
-                    for k,n in zip(K, N):
-                        fact *= binom(n, k)
-                        kk += k
-                        dnk += n-k
+                    kk = 1 + np.sum(K)
+                    dnk = 1 + np.sum(np.array(N) - np.array(K))
                     
                     # Now compute the posterior
                     a2 = a - 1 + kk
@@ -199,12 +165,8 @@ class Bayes:
 
 
                     # Plot mean and mode of posterior
-                    try:
-                        mean =  a2 / (a2 + b2)
-                        _mode = (a2 -1)/(a2 + b2 -2)
-                        sigmasquared = (a2 * b2)/((a2+b2)**2 * (a2 + b2 + 1)) # https://math.stackexchange.com/questions/497577/mean-and-variance-of-beta-distributions
-                        prange = percentile_range(get_parametric_distribution("beta", a2, b2)[1])
-                    except: continue
+                    post = beta_posteriors(np.sum(K), np.sum(N), a=a, b=b)
+                    mean, _mode, sigmasquared, prange = post.mean, post.mode, post.sigmasquared, post.prange
                     modes[exp], means[exp], params[exp], sigmas[exp], pranges[exp] = _mode, mean, ptuple(a2, b2), sigmasquared, prange
                     if plot: ax.axvline(_mode, color=self.colors[expn+1], lw=2, ls="--", alpha=.8)
                     
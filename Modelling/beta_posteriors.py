@@ -0,0 +1,76 @@
+import sys
+sys.path.append('./')
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+from collections import namedtuple
+
+
+"""
+    Analytical posteriors of p(R) for binomial data with a beta prior, computed for arrays of (k, n) at once.
+    The posterior of k hits in n trials with a Beta(a, b) prior is Beta(a + k, b + n - k): means, modes and
+    variances are closed form and the credible intervals are computed exactly with beta.ppf, so thousands
+    of mice x conditions (or of bootstrap resamples) are summarised with a few array operations.
+"""
+
+posterior = namedtuple("posterior", "a b mean mode sigmasquared median prange")
+credible_interval = namedtuple("percentile", "low median mean high std sem")
+
+
+def beta_posteriors(k, n, a=1, b=1, low=5, high=95):
+    """[Posterior Beta(a + k, b + n - k) summaries, k and n can be scalars or arrays of any shape]
+
+    Arguments:
+        k {[int, np.ndarray]} -- [number of hits]
+        n {[int, np.ndarray]} -- [number of trials]
+
+    Keyword Arguments:
+        a {float} -- [a of the beta prior] (default: {1})
+        b {float} -- [b of the beta prior] (default: {1})
+        low {float} -- [low percentile of the credible interval] (default: {5})
+        high {float} -- [high percentile of the credible interval] (default: {95})
+
+    Returns:
+        [posterior] -- [namedtuple with a, b, mean, mode, sigmasquared, median of the posteriors and
+                        prange: a namedtuple like percentile_range's with the exact percentiles (sem is nan)]
+    """
+    k, n = np.asarray(k, dtype=np.float64), np.asarray(n, dtype=np.float64)
+    a2 = a + k
+    b2 = b + n - k
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = a2 / (a2 + b2)
+        mode = (a2 - 1) / (a2 + b2 - 2)
+        sigmasquared = (a2 * b2) / ((a2 + b2)**2 * (a2 + b2 + 1))
+
+    # ? one ppf call for all posteriors and the three quantiles
+    q = np.array([low/100, .5, high/100]).reshape((3,) + (1,)*a2.ndim)
+    quantiles = stats.beta.ppf(q, a2, b2)
+    prange = credible_interval(quantiles[0], quantiles[1], mean, quantiles[2], np.sqrt(sigmasquared), np.full(a2.shape, np.nan))
+
+    return posterior(a2, b2, mean, mode, sigmasquared, quantiles[1], prange)
+
+
+def beta_posteriors_by_condition(hits, ntrials, a=1, b=1, low=5, high=95):
+    """[Posterior summaries for each mouse in each condition and for each condition's pooled data]
+
+    Arguments:
+        hits {[dict]} -- [condition:list of number of hits of each mouse]
+        ntrials {[dict]} -- [condition:list of number of trials of each mouse]
+
+    Returns:
+        [pd.DataFrame] -- [condition, mouse (-1 for the pooled data), k, n, a, b, mean, mode, sigmasquared, median, low, high]
+    """
+    conditions, mice, K, N = [], [], [], []
+    for condition in hits.keys():
+        k, n = list(hits[condition]), list(ntrials[condition])
+        conditions.extend([condition]*(len(k) + 1))
+        mice.extend([-1] + list(range(len(k))))
+        K.extend([np.sum(k)] + k)
+        N.extend([np.sum(n)] + n)
+
+    post = beta_posteriors(K, N, a=a, b=b, low=low, high=high)
+    return pd.DataFrame(dict(condition=conditions, mouse=mice, k=K, n=N, a=post.a, b=post.b, mean=post.mean,
+                            mode=post.mode, sigmasquared=post.sigmasquared, median=post.median,
+                            low=post.prange.low, high=post.prange.high))
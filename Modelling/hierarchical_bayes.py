@@ -0,0 +1,171 @@
+import sys
+sys.path.append('./')
+
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from scipy import stats
+from scipy.special import betaln
+from multiprocessing import Pool
+
+
+"""
+    Hierarchical beta-binomial model for p(R), fitted without MCMC libraries.
+
+    Model (as in Bayes.model_hierarchical_bayes, Kruschke's 'Doing Bayesian Data Analysis' ch. 9):
+        for each condition c:
+            omega_c ~ Beta(*hyper_mode)                           # mode of the mice's p(R)
+            kappa_c - 2 ~ Gamma(k_hyper_shape, k_hyper_rate)      # concentration
+            theta_ci ~ Beta(omega_c*(kappa_c-2)+1, (1-omega_c)*(kappa_c-2)+1)   for each mouse i
+            k_ci ~ Binomial(n_ci, theta_ci)
+
+    Because the beta prior is conjugate to the binomial, the thetas can be integrated out: the posterior of
+    (omega_c, kappa_c) is evaluated exactly on a grid using the beta-binomial likelihood, samples of
+    (omega_c, kappa_c) are drawn from the grid and the thetas are then drawn from their beta posteriors.
+    Each sample is independent, there's no burn in or autocorrelation. Conditions are independent of
+    each other, so conditions and chains are sampled in parallel in a process pool.
+
+    The trace is a dataframe with the same columns as PyMC3's trace_to_dataframe for model_hierarchical_bayes:
+        mode_hyper__c, concentration_hyper__c, {condition}_prior__i
+"""
+
+
+def _sample_condition(args):
+    """ Draws n_samples from the posterior of one condition, top level function so that it can run in a process pool """
+    k, n, n_samples, seed, params = args
+    k, n = np.asarray(k, dtype=np.float64), np.asarray(n, dtype=np.float64)
+    rng = np.random.RandomState(seed)
+
+    # grid over omega and log(kappa - 2)
+    omega_edges = np.linspace(0, 1, params['n_omega'] + 1)
+    omega = (omega_edges[1:] + omega_edges[:-1]) / 2
+    logk_edges = np.linspace(np.log(params['kappa_range'][0]), np.log(params['kappa_range'][1]), params['n_kappa'] + 1)
+    logk = (logk_edges[1:] + logk_edges[:-1]) / 2
+    kappa = np.exp(logk)  # ? kappa - 2
+
+    # log prior, including the jacobian of the log transform of kappa - 2
+    log_prior = stats.beta.logpdf(omega, *params['hyper_mode'])[:, None] + \
+                (stats.gamma.logpdf(kappa, params['k_hyper_shape'], scale=1/params['k_hyper_rate']) + logk)[None, :]
+
+    # log likelihood, thetas integrated out
+    a = omega[:, None] * kappa[None, :] + 1
+    b = (1 - omega[:, None]) * kappa[None, :] + 1
+    log_like = np.sum(betaln(a[:, :, None] + k, b[:, :, None] + n - k) - betaln(a, b)[:, :, None], axis=2)
+
+    log_post = log_prior + log_like
+    post = np.exp(log_post - np.max(log_post)).ravel()
+    post /= np.sum(post)
+
+    # sample grid cells and jitter within each cell
+    cells = rng.choice(len(post), size=n_samples, p=post)
+    oi, ki = np.unravel_index(cells, (len(omega), len(kappa)))
+    omega_s = rng.uniform(omega_edges[oi], omega_edges[oi + 1])
+    kappa_s = np.exp(rng.uniform(logk_edges[ki], logk_edges[ki + 1]))
+
+    # sample thetas from their conjugate posteriors
+    a_s = omega_s * kappa_s + 1
+    b_s = (1 - omega_s) * kappa_s + 1
+    theta = rng.beta(a_s[:, None] + k[None, :], b_s[:, None] + (n - k)[None, :])
+    return omega_s, kappa_s + 2, theta
+
+
+class HierarchicalBetaBinomial:
+    def __init__(self, hyper_mode=(1, 1), k_hyper_shape=0.01, k_hyper_rate=0.01,
+                    n_omega=200, n_kappa=200, kappa_range=(1e-2, 1e4), cache_folder=None):
+        """[Hierarchical beta-binomial model of p(R) for each mouse in each condition]
+
+        Keyword Arguments:
+            hyper_mode {tuple} -- [a, b of the beta prior on the modes] (default: {(1, 1)})
+            k_hyper_shape {float} -- [shape of the gamma prior on the concentrations] (default: {0.01})
+            k_hyper_rate {float} -- [rate of the gamma prior on the concentrations] (default: {0.01})
+            n_omega {int} -- [grid points for the mode] (default: {200})
+            n_kappa {int} -- [grid points for the concentration (log spaced)] (default: {200})
+            kappa_range {tuple} -- [range of kappa - 2 in the grid] (default: {(1e-2, 1e4)})
+            cache_folder {[str]} -- [if not None traces are cached here, keyed by data and parameters] (default: {None})
+        """
+        self.params = dict(hyper_mode=tuple(hyper_mode), k_hyper_shape=k_hyper_shape, k_hyper_rate=k_hyper_rate,
+                            n_omega=n_omega, n_kappa=n_kappa, kappa_range=tuple(kappa_range))
+        self.cache_folder = cache_folder
+
+    def get_cache_path(self, hits, ntrials, n_samples, n_chains, seed):
+        data = dict(hits={c:[int(h) for h in v] for c, v in hits.items()},
+                    ntrials={c:[int(n) for n in v] for c, v in ntrials.items()},
+                    params=self.params, n_samples=n_samples, n_chains=n_chains, seed=seed)
+        key = hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
+        return os.path.join(self.cache_folder, "hb_trace_{}.pkl".format(key))
+
+    def fit(self, hits, ntrials, n_samples=4000, n_chains=4, n_processes=4, seed=0):
+        """[Draws samples from the posterior]
+
+        Arguments:
+            hits {[dict]} -- [condition:list of number of right escapes of each mouse]
+            ntrials {[dict]} -- [condition:list of number of trials of each mouse]
+
+        Keyword Arguments:
+            n_samples {int} -- [samples per chain] (default: {4000})
+            n_chains {int} -- [number of independent chains] (default: {4})
+            n_processes {int} -- [size of the process pool, if 1 everything runs in this process] (default: {4})
+            seed {int} -- [random seed] (default: {0})
+
+        Returns:
+            [pd.DataFrame] -- [trace, n_chains * n_samples rows]
+        """
+        if self.cache_folder is not None:
+            cache_path = self.get_cache_path(hits, ntrials, n_samples, n_chains, seed)
+            if os.path.isfile(cache_path): return pd.read_pickle(cache_path)
+
+        conditions = list(hits.keys())
+        tasks = [(hits[c], ntrials[c], n_samples, seed*10000 + ci*100 + chain, self.params)
+                        for ci, c in enumerate(conditions) for chain in range(n_chains)]
+
+        if n_processes > 1 and len(tasks) > 1:
+            pool = Pool(min(n_processes, len(tasks)))
+            try:
+                results = pool.map(_sample_condition, tasks)
+            finally:
+                pool.close()
+        else:
+            results = [_sample_condition(t) for t in tasks]
+
+        trace = {}
+        for ci, condition in enumerate(conditions):
+            chains = results[ci*n_chains:(ci+1)*n_chains]
+            trace["mode_hyper__{}".format(ci)] = np.concatenate([r[0] for r in chains])
+            trace["concentration_hyper__{}".format(ci)] = np.concatenate([r[1] for r in chains])
+            theta = np.vstack([r[2] for r in chains])
+            for i in range(theta.shape[1]):
+                trace["{}_prior__{}".format(condition, i)] = theta[:, i]
+        trace = pd.DataFrame(trace)
+        trace['chain'] = np.repeat(np.arange(n_chains), n_samples)
+
+        if self.cache_folder is not None:
+            if not os.path.isdir(self.cache_folder): os.makedirs(self.cache_folder)
+            trace.to_pickle(cache_path)
+        return trace
+
+    @staticmethod
+    def summarise(trace, conditions, low=2.5, high=97.5):
+        """[Posterior summaries of p(R) for each mouse and for each condition's mode]
+
+        Arguments:
+            trace {[pd.DataFrame]} -- [as returned by fit]
+            conditions {[list]} -- [names of the conditions, in the order used to fit]
+
+        Returns:
+            [pd.DataFrame] -- [condition, mouse (-1 for the condition's mode), mean, median, low, high]
+        """
+        summary = dict(condition=[], mouse=[], mean=[], median=[], low=[], high=[])
+        for ci, condition in enumerate(conditions):
+            columns = [("mode_hyper__{}".format(ci), -1)]
+            columns += [(col, int(col.split("__")[-1])) for col in trace.columns if col.startswith(condition+"_prior__")]
+            for col, mouse in columns:
+                samples = trace[col].values
+                summary['condition'].append(condition)
+                summary['mouse'].append(mouse)
+                summary['mean'].append(np.mean(samples))
+                summary['median'].append(np.median(samples))
+                summary['low'].append(np.percentile(samples, low))
+                summary['high'].append(np.percentile(samples, high))
+        return pd.DataFrame(summary)
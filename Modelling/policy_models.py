@@ -0,0 +1,283 @@
+import sys
+sys.path.append('./')
+
+import numpy as np
+import pandas as pd
+from itertools import combinations
+from collections import namedtuple
+from multiprocessing import Pool
+from scipy.special import expit, xlogy
+
+
+"""
+    Binomial GLMs (logistic regressions) of escape choice as a function of maze features (e.g. the ratio of the
+    geodesic and euclidean distances of the two arms), as in Analysis/Behaviour/policy_glm.py.
+
+    The design matrix is built once per trial set and trials with identical features (e.g. all trials in a maze)
+    are collapsed into a single row with k hits out of n trials: fitting single trial logistic regressions on tens
+    of thousands of trials costs the same as fitting the grouped (k, m per maze) model. Models are fitted with
+    Newton's method (IRLS) in numpy, all feature subsets are fitted in one go and cross validation folds can run in
+    a process pool.
+
+    Usage:
+        glm = PolicyGLM(all_trials, features=['geodist', 'eucldist'])
+        fits = glm.fit_all_subsets()
+        cv = glm.cross_validate(['geodist', 'eucldist'], n_folds=10, n_processes=4)
+        g, e, pr = glm.prediction_grid(fits[-1], geodist=(0, 3), eucldist=(0, 3))
+"""
+
+glm_fit = namedtuple("glm_fit", "features params bse loglike deviance aic nobs converged n_iter")
+
+
+# ---------------------------------------------------------------------------- #
+#                                    FITTING                                   #
+# ---------------------------------------------------------------------------- #
+def fit_binomial_glm(X, k, n, max_iter=100, tol=1e-8):
+    """[Fits a binomial GLM with logit link with Newton's method]
+
+    Arguments:
+        X {[np.ndarray]} -- [(n_rows, n_params) design matrix, including the constant]
+        k {[np.ndarray]} -- [number of hits for each row]
+        n {[np.ndarray]} -- [number of trials for each row]
+
+    Keyword Arguments:
+        max_iter {int} -- [max number of iterations] (default: {100})
+        tol {float} -- [convergence threshold on the change in deviance] (default: {1e-8})
+
+    Returns:
+        beta {[np.ndarray]} -- [fitted parameters]
+        cov {[np.ndarray]} -- [covariance of the parameters]
+        converged {[bool]}
+        n_iter {[int]}
+    """
+    X = np.asarray(X, dtype=np.float64)
+    k, n = np.asarray(k, dtype=np.float64), np.asarray(n, dtype=np.float64)
+
+    beta = np.zeros(X.shape[1])
+    deviance, converged = np.inf, False
+    for n_iter in range(1, max_iter+1):
+        mu = np.clip(expit(X @ beta), 1e-12, 1 - 1e-12)
+        w = n * mu * (1 - mu)
+        hessian = X.T @ (w[:, None] * X)
+        beta = beta + np.linalg.lstsq(hessian, X.T @ (k - n*mu), rcond=None)[0]
+
+        new_deviance = _binomial_deviance(k, n, np.clip(expit(X @ beta), 1e-12, 1 - 1e-12))
+        if np.abs(deviance - new_deviance) < tol * (np.abs(new_deviance) + .1):
+            converged = True
+            break
+        deviance = new_deviance
+
+    mu = np.clip(expit(X @ beta), 1e-12, 1 - 1e-12)
+    cov = np.linalg.pinv(X.T @ ((n * mu * (1 - mu))[:, None] * X))
+    return beta, cov, converged, n_iter
+
+def _binomial_deviance(k, n, mu):
+    return 2 * np.sum(xlogy(k, k / np.where(n > 0, n, 1)) - xlogy(k, mu) +
+                        xlogy(n - k, (n - k) / np.where(n > 0, n, 1)) - xlogy(n - k, 1 - mu))
+
+def _binomial_loglike(k, n, mu):
+    # ? without the binomial coefficient, so it is the same for grouped and single trial data
+    return np.sum(xlogy(k, mu) + xlogy(n - k, 1 - mu))
+
+def predict_pr(params, features, values):
+    """[p(R) predicted by a fitted model]
+
+    Arguments:
+        params {[pd.Series]} -- [fitted parameters, with a 'const' entry]
+        features {[list]} -- [names of the features used by the model]
+        values {[dict, pd.DataFrame]} -- [feature:array of values, arrays are broadcast together]
+    """
+    theta = params['const']
+    for feature in features:
+        theta = theta + params[feature] * np.asarray(values[feature], dtype=np.float64)
+    return expit(theta)
+
+def _fit_fold(args):
+    """ Fits a model on the train rows and evaluates it on the test rows, top level function so that it can run in a process pool """
+    X, y, train, test, columns = args
+    rows, index = np.unique(X[train], axis=0, return_inverse=True)
+    index = index.ravel()
+    k = np.bincount(index, weights=y[train], minlength=len(rows))
+    n = np.bincount(index, minlength=len(rows)).astype(np.float64)
+    beta, _, converged, _ = fit_binomial_glm(rows, k, n)
+
+    p = expit(X[test] @ beta)
+    y_test = y[test]
+    return dict(params=pd.Series(beta, index=columns), converged=converged,
+                loglike=_binomial_loglike(y_test, np.ones(len(y_test)), np.clip(p, 1e-12, 1 - 1e-12)) / len(y_test),
+                mse=np.mean((y_test - p)**2),
+                # ? expected accuracy of sampling binary predictions with p(R) = p, without drawing them
+                pcorr=np.mean(y_test * p + (1 - y_test) * (1 - p)),
+                accuracy=np.mean((p > .5) == (y_test == 1)))
+
+
+# ---------------------------------------------------------------------------- #
+#                                  POLICY GLM                                  #
+# ---------------------------------------------------------------------------- #
+class PolicyGLM:
+    def __init__(self, trials, features=['geodist', 'eucldist'], outcome='outcome'):
+        """[Logistic regressions of the trials' outcome on a set of features]
+
+        Arguments:
+            trials {[pd.DataFrame]} -- [one row per trial with the features and the binary outcome (1 for right)]
+
+        Keyword Arguments:
+            features {list} -- [columns with the features] (default: {['geodist', 'eucldist']})
+            outcome {str} -- [column with the outcome] (default: {'outcome'})
+        """
+        self.features = list(features)
+        self.columns = self.features + ['const']
+
+        # ? design matrix, built once
+        self.X = np.hstack([trials[self.features].values.astype(np.float64), np.ones((len(trials), 1))])
+        self.y = trials[outcome].values.astype(np.float64)
+
+        # ? unique rows of the design matrix with number of hits and of trials
+        self.rows, index = np.unique(self.X, axis=0, return_inverse=True)
+        self.row_index = index.ravel()
+        self.k = np.bincount(self.row_index, weights=self.y, minlength=len(self.rows))
+        self.n = np.bincount(self.row_index, minlength=len(self.rows)).astype(np.float64)
+
+    def __len__(self):
+        return len(self.y)
+
+    def _columns_index(self, features):
+        return [self.columns.index(f) for f in list(features) + ['const']]
+
+    def fit(self, features=None):
+        """[Fits the model with a subset of the features (and a constant)]
+
+        Keyword Arguments:
+            features {[list]} -- [features to use, if None all of them] (default: {None})
+
+        Returns:
+            [glm_fit] -- [namedtuple with features, params and bse (pd.Series), loglike, deviance, aic, nobs, converged, n_iter]
+        """
+        if features is None: features = self.features
+        cols = self._columns_index(features)
+        beta, cov, converged, n_iter = fit_binomial_glm(self.rows[:, cols], self.k, self.n)
+
+        mu = np.clip(expit(self.rows[:, cols] @ beta), 1e-12, 1 - 1e-12)
+        loglike = _binomial_loglike(self.k, self.n, mu)
+        index = list(features) + ['const']
+        return glm_fit(list(features), pd.Series(beta, index=index), pd.Series(np.sqrt(np.diag(cov)), index=index),
+                        loglike, _binomial_deviance(self.k, self.n, mu), 2*len(beta) - 2*loglike, len(self), converged, n_iter)
+
+    def fit_all_subsets(self, subsets=None):
+        """[Fits a model for each subset of the features]
+
+        Keyword Arguments:
+            subsets {[list]} -- [list of lists of features, if None all the non empty subsets] (default: {None})
+
+        Returns:
+            [list] -- [glm_fit for each subset]
+        """
+        if subsets is None:
+            subsets = [list(c) for r in range(1, len(self.features)+1) for c in combinations(self.features, r)]
+        return [self.fit(s) for s in subsets]
+
+    @staticmethod
+    def summary(fits):
+        """[One row per fitted model with its parameters, standard errors and goodness of fit]
+        """
+        rows = []
+        for fit in fits:
+            row = dict(features="+".join(fit.features), loglike=fit.loglike, deviance=fit.deviance,
+                        aic=fit.aic, nobs=fit.nobs, converged=fit.converged)
+            row.update({p:v for p, v in fit.params.items()})
+            row.update({p+"_bse":v for p, v in fit.bse.items()})
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    # --------------------------------- PREDICTION -------------------------------- #
+    def predict(self, fit, trials=None):
+        """[Predicted p(R) for each trial in the data used to build the model or in a new trials dataframe]
+        """
+        if trials is None:
+            return expit(self.X[:, self._columns_index(fit.features)] @ fit.params.values)
+        return predict_pr(fit.params, fit.features, trials)
+
+    def predict_rows(self, fit):
+        """[Predicted and observed p(R) for each unique row of the design matrix (e.g. for each maze)]
+
+        Returns:
+            [pd.DataFrame] -- [features, k, n, pr and predicted pr for each row]
+        """
+        rows = pd.DataFrame(self.rows[:, :-1], columns=self.features)
+        rows['k'], rows['n'] = self.k, self.n
+        rows['pr'] = self.k / self.n
+        rows['predicted_pr'] = expit(self.rows[:, self._columns_index(fit.features)] @ fit.params.values)
+        return rows
+
+    @staticmethod
+    def prediction_grid(fit, num=250, **ranges):
+        """[p(R) predicted on a grid of feature values, e.g. for decision boundary plots]
+
+        Arguments:
+            fit {[glm_fit]} -- [fitted model]
+
+        Keyword Arguments:
+            num {int} -- [number of points along each feature] (default: {250})
+            ranges -- [feature=(min, max) for each feature of the model]
+
+        Returns:
+            [tuple] -- [meshgrid of each feature (in the order of fit.features) and the predicted p(R) on the grid]
+        """
+        axes = [np.linspace(*ranges[f], num=num) for f in fit.features]
+        grids = np.meshgrid(*axes, indexing='xy')
+        pr = predict_pr(fit.params, fit.features, {f:g for f, g in zip(fit.features, grids)})
+        return tuple(grids) + (pr, )
+
+    @staticmethod
+    def decision_boundary(fit, x, xfeature='geodist', yfeature='eucldist'):
+        """[Values of yfeature for which the predicted p(R) is .5 given values x of xfeature, None if the boundary
+            doesn't depend on x (then it's a vertical or horizontal line at the returned threshold)]
+
+        Returns:
+            [tuple] -- [(y values or None, threshold on the feature used by the model if it uses only one)]
+        """
+        params = fit.params
+        if xfeature in fit.features and yfeature in fit.features:
+            return -(params[xfeature]/params[yfeature])*np.asarray(x) - params['const']/params[yfeature], None
+        elif xfeature in fit.features:
+            return None, -params['const']/params[xfeature]
+        else:
+            return None, -params['const']/params[yfeature]
+
+    # ----------------------------- CROSS VALIDATION ----------------------------- #
+    def cross_validate(self, features=None, n_folds=5, n_processes=1, seed=0):
+        """[K-fold cross validation of the single trial model]
+
+        Keyword Arguments:
+            features {[list]} -- [features to use, if None all of them] (default: {None})
+            n_folds {int} -- [number of folds] (default: {5})
+            n_processes {int} -- [size of the process pool, folds are fitted in parallel] (default: {1})
+            seed {int} -- [random seed for the folds] (default: {0})
+
+        Returns:
+            [pd.DataFrame] -- [for each fold: parameters, test log likelihood per trial, m.s.e., expected p correct and accuracy]
+        """
+        if features is None: features = self.features
+        cols = self._columns_index(features)
+        X = self.X[:, cols]
+        columns = list(features) + ['const']
+
+        folds = np.array_split(np.random.RandomState(seed).permutation(len(self)), n_folds)
+        tasks = [(X, self.y, np.concatenate(folds[:i] + folds[i+1:]), test, columns) for i, test in enumerate(folds)]
+
+        if n_processes > 1 and len(tasks) > 1:
+            pool = Pool(min(n_processes, len(tasks)))
+            try:
+                results = pool.map(_fit_fold, tasks)
+            finally:
+                pool.close()
+        else:
+            results = [_fit_fold(t) for t in tasks]
+
+        cv = []
+        for fold, res in enumerate(results):
+            row = dict(fold=fold, converged=res['converged'], loglike=res['loglike'], mse=res['mse'],
+                        pcorr=res['pcorr'], accuracy=res['accuracy'])
+            row.update({p:v for p, v in res['params'].items()})
+            cv.append(row)
+        return pd.DataFrame(cv)
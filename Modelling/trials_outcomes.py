@@ -0,0 +1,60 @@
+import sys
+sys.path.append('./')
+
+import numpy as np
+import pandas as pd
+
+
+"""
+    Binomial data from trials dataframes (as returned by TrialsLoader): number of right escapes (hits, k)
+    and of trials (n) for each session and condition, as used by the models of p(R).
+"""
+
+
+def get_hits_ntrials_per_session(trials, ignore_center=True, session_col="uid"):
+    """[Number of right escapes (hits, k) and of trials (n) for each session]
+
+    Arguments:
+        trials {[pd.DataFrame]} -- [trials dataframe with escape_arm and session_col]
+
+    Keyword Arguments:
+        ignore_center {bool} -- [if True center escapes are discarded, otherwise they count as misses] (default: {True})
+        session_col {str} -- [column identifying the session] (default: {"uid"})
+
+    Returns:
+        [pd.DataFrame] -- [one row per session (sorted), with columns k, n and p_r]
+    """
+    if ignore_center: trials = trials.loc[trials.escape_arm != "center"]
+
+    outcomes = pd.DataFrame({session_col:trials[session_col].values,
+                            "k":(trials.escape_arm.values == "right").astype(int)})
+    per_session = outcomes.groupby(session_col, sort=True).k.agg(['sum', 'count'])
+    per_session.columns = ['k', 'n']
+    per_session['p_r'] = per_session.k / per_session.n
+    return per_session
+
+def get_hits_ntrials_per_condition(conditions, ignore_center=True, session_col="uid"):
+    """[Same as get_hits_ntrials_per_session, for a dictionary of condition:trials dataframe]
+
+    Returns:
+        [pd.DataFrame] -- [long format dataframe with columns condition, session_col, k, n, p_r]
+    """
+    per_condition = []
+    for condition, trials in conditions.items():
+        per_session = get_hits_ntrials_per_session(trials, ignore_center=ignore_center, session_col=session_col).reset_index()
+        per_session.insert(0, "condition", condition)
+        per_condition.append(per_session)
+
+    if not per_condition: return pd.DataFrame(columns=["condition", session_col, "k", "n", "p_r"])
+    return pd.concat(per_condition, ignore_index=True)
+
+def get_binary_outcomes_per_session(trials, ignore_center=True, session_col="uid"):
+    """[List with the binary outcomes (1 for right escapes) of each session's trials, sessions are sorted]
+    """
+    if ignore_center: trials = trials.loc[trials.escape_arm != "center"]
+    order = np.argsort(trials[session_col].values, kind='stable')
+    sessions = trials[session_col].values[order]
+    outcomes = (trials.escape_arm.values[order] == "right").astype(int)
+
+    splits = np.where(sessions[1:] != sessions[:-1])[0] + 1
+    return [list(o) for o in np.split(outcomes, splits)] if len(outcomes) else []
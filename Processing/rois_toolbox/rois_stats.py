@@ -25,6 +25,10 @@ import os
         bp_tracking = data(tracking.bp.x.values, tracking.bp.y.values, tracking.bp.Velocity.values)
         res = get_timeinrois_stats(bp_tracking, roi, fps=30)
         results[bp] = res
+
+    or, for many recordings at once with the ROI ids already in the tracking:
+
+    stats = get_timeinrois_stats_batch([t[:, -1] for t in tracking_data], velocities=[t[:, 2] for t in tracking_data], fps=40)
     
 """
 
@@ -90,7 +94,7 @@ def load_rois(display=False):
     
     return rois
 
-def get_roi_at_each_frame(experiment, session_name, bp_data, rois=None):
+def get_roi_at_each_frame(experiment, session_name, bp_data, rois=None, plot=True):
     """
     Given position data for a bodypart and the position of a list of rois, this function calculates which roi is
     the closest to the bodypart at each frame
@@ -164,11 +168,83 @@ def get_roi_at_each_frame(experiment, session_name, bp_data, rois=None):
     roi_at_each_frame = tuple([roi_names[x] for x in sel_rois])
 
     # Check we got cetners correctly
-    check_roi_tracking_plot(session_name, rois, centers, roi_names, bp_data, roi_at_each_frame)
+    if plot: check_roi_tracking_plot(session_name, rois, centers, roi_names, bp_data, roi_at_each_frame)
     return roi_at_each_frame
 
 
-def get_timeinrois_stats(data, rois, fps=None):
+def get_rois_runs(data_rois, breaks=None):
+    """
+    Run length encoding of the ROI at each frame
+
+    :param data_rois: 1d integer array with the ROI id at each frame
+    :param breaks: optional boolean array, True at frames where a new run starts anyway (e.g. first frame of a recording)
+    :return: roi id, first frame and length of each run
+    """
+    data_rois = np.asarray(data_rois)
+    if not len(data_rois):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    new_run = np.ones(len(data_rois), dtype=bool)
+    new_run[1:] = data_rois[1:] != data_rois[:-1]
+    if breaks is not None: new_run |= np.asarray(breaks, dtype=bool)
+
+    starts = np.where(new_run)[0]
+    lengths = np.diff(np.append(starts, len(data_rois)))
+    return data_rois[starts], starts, lengths
+
+def get_timeinrois_stats_batch(data_rois, velocities=None, n_rois=None, fps=None):
+    """
+    Time in each roi, number of entries, average stay and average velocity for many recordings at once.
+
+    :param data_rois: list of 1d integer arrays with the ROI id at each frame of each recording (e.g. the last column
+                of TrackingData.BodyPartData.tracking_data), frames with negative or nan ids are ignored
+    :param velocities: optional list of 1d arrays with the velocity at each frame of each recording
+    :param n_rois: number of rois, if None max id + 1
+    :param fps: framerate, scalar or one per recording. If None the times in seconds are not computed
+    :return: dictionary of (n_recordings, n_rois) arrays
+    """
+    lengths = np.array([len(r) for r in data_rois], dtype=np.int64)
+    rois = np.concatenate([np.asarray(r, dtype=np.float64).ravel() for r in data_rois]) if len(data_rois) else np.zeros(0)
+    rois = np.where(np.isnan(rois), -1, rois).astype(np.int64)  # ? frames without a roi
+    recording = np.repeat(np.arange(len(data_rois)), lengths)
+    if n_rois is None: n_rois = int(np.max(rois)) + 1 if np.any(rois >= 0) else 0
+    n_recs = len(data_rois)
+
+    valid = rois >= 0
+    index = recording[valid] * n_rois + rois[valid]
+    size = n_recs * n_rois
+    frames = np.bincount(index, minlength=size).reshape(n_recs, n_rois)
+
+    # number of enters in each roi: runs of frames in the same roi, a new run starts with each recording
+    breaks = np.zeros(len(rois), dtype=bool)
+    first_frames = np.cumsum(lengths) - lengths
+    breaks[first_frames[lengths > 0]] = True
+    run_rois, run_starts, _ = get_rois_runs(rois, breaks=breaks)
+    run_valid = run_rois >= 0
+    entries = np.bincount(recording[run_starts][run_valid] * n_rois + run_rois[run_valid], minlength=size).reshape(n_recs, n_rois)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_time = np.where(entries > 0, frames / entries, np.nan)
+
+    results = dict(transitions_per_roi=entries, comulative_time_in_roi=frames, avg_time_in_roi=avg_time,
+                    comulative_time_in_roi_sec=None, avg_time_in_roi_sec=None, avg_vel_in_roi=None)
+
+    if fps is not None:
+        fps = np.broadcast_to(np.asarray(fps, dtype=np.float64), (n_recs, ))[:, None]
+        results['comulative_time_in_roi_sec'] = frames / fps
+        results['avg_time_in_roi_sec'] = avg_time / fps
+
+    # get avg velocity in each roi, ignoring frames without velocity
+    if velocities is not None:
+        vel = np.concatenate([np.asarray(v, dtype=np.float64).ravel() for v in velocities])[valid]
+        has_vel = ~np.isnan(vel)
+        vel_sum = np.bincount(index[has_vel], weights=vel[has_vel], minlength=size).reshape(n_recs, n_rois)
+        vel_count = np.bincount(index[has_vel], minlength=size).reshape(n_recs, n_rois)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            results['avg_vel_in_roi'] = np.where(vel_count > 0, vel_sum / vel_count, np.nan)
+    return results
+
+def get_timeinrois_stats(data, rois=None, fps=None, data_rois=None):
     """
     Quantify number of times the animal enters a roi, comulative number of frames spend there, comulative time in seconds
     spent in the roi and average velocity while in the roi.
@@ -181,46 +257,23 @@ def get_timeinrois_stats(data, rois, fps=None):
     :param rois: dictionary with the position of each roi. The position is stored in a named tuple with the location of
                 two points defyining the roi: topleft(X,Y) and bottomright(X,Y).
     :param fps: framerate at which video was acquired
+    :param data_rois: optional roi at each frame (names or integer ids, e.g. from tracking_data), if given rois is not used
     :return: dictionary
     """
-
-    def get_indexes(lst, match):
-        return np.asarray([i for i, x in enumerate(lst) if x == match])
-
     # get roi at each frame of data
-    data_rois = get_roi_at_each_frame(data, rois)
-    data_time_inrois = {name: data_rois.count(name) for name in set(data_rois)}  # total time (frames) in each roi
-
-    # number of enters in each roi
-    transitions = [n for i, n in enumerate(list(data_rois)) if i == 0 or n != list(data_rois)[i - 1]]
-    transitions_count = {name: transitions.count(name) for name in transitions}
+    if data_rois is None:
+        data_rois = get_roi_at_each_frame(None, None, data, rois, plot=False)
 
-    # avg time spend in each roi (frames)
-    avg_time_in_roi = {transits[0]: time / transits[1]
-                       for transits, time in zip(transitions_count.items(), data_time_inrois.values())}
+    # ? rois as integer ids
+    names, ids = np.unique(np.asarray(data_rois), return_inverse=True)
+    stats = get_timeinrois_stats_batch([ids.ravel()], velocities=[data.velocity] if data is not None else None,
+                                        n_rois=len(names), fps=fps)
 
-    # avg time spend in each roi (seconds)
-    if fps is not None:
-        data_time_inrois_sec = {name: t / fps for name, t in data_time_inrois.items()}
-        avg_time_in_roi_sec = {name: t / fps for name, t in avg_time_in_roi.items()}
-    else:
-        data_time_inrois_sec, avg_time_in_roi_sec = None, None
-
-    # get avg velocity in each roi
-    avg_vel_per_roi = {}
-    for name in set(data_rois):
-        indexes = get_indexes(data_rois, name)
-        vels = [data.velocity[x] for x in indexes]
-        avg_vel_per_roi[name] = np.average(np.asarray(vels))
-
-    results = dict(transitions_per_roi=transitions_count,
-                   comulative_time_in_roi=data_time_inrois,
-                   comulative_time_in_roi_sec=data_time_inrois_sec,
-                   avg_time_in_roi=avg_time_in_roi,
-                   avg_time_in_roi_sec=avg_time_in_roi_sec,
-                   avg_vel_in_roi=avg_vel_per_roi)
+    def to_dict(values):
+        if values is None: return None
+        return {name.item() if hasattr(name, 'item') else name: v for name, v in zip(names, values[0])}
 
-    return results
+    return {k: to_dict(v) for k, v in stats.items()}
 
 
 
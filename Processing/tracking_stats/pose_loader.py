@@ -0,0 +1,129 @@
+import sys
+sys.path.append("./")
+
+import os
+import numpy as np
+import pandas as pd
+from multiprocessing.dummy import Pool as ThreadPool
+
+
+"""
+	Loads DeepLabCut pose files as a compact float32 array with shape (n_frames, n_bodyparts, 3) [x, y, likelihood]
+	instead of a MultiIndex DataFrame with all the bodyparts.
+	DLC saves the pose as a PyTables table with all the coordinates in a single values block: only the
+	columns of the selected bodyparts are copied out of it, a chunk of rows at a time.
+	The parsed array is cached next to the pose file (<pose_file>.parsed.npz) together with the pose file's
+	modification time, so loading the same file again after it was parsed once doesn't touch the HDF5.
+"""
+
+coords = ['x', 'y', 'likelihood']
+
+
+def get_pose_cache_path(pose_file):
+	return os.path.splitext(pose_file)[0] + '.parsed.npz'
+
+
+def load_pose_from_cache(pose_file, bodyparts):
+	cache = get_pose_cache_path(pose_file)
+	if not os.path.isfile(cache): return None
+
+	try:
+		with np.load(cache, allow_pickle=False) as cached:
+			if float(cached['mtime']) != os.path.getmtime(pose_file): return None # ? pose file changed since it was cached
+			cached_bps, requested = list(cached['bodyparts']), list(cached['requested'])
+			if not all([bp in requested for bp in bodyparts]): return None
+			found = [bp for bp in bodyparts if bp in cached_bps]  # ? the ones requested that are in the pose file
+			return cached['pose'][:, [cached_bps.index(bp) for bp in found], :], found
+	except Exception as e:
+		print("Could not load cached pose {}: {}".format(cache, e))
+		return None
+
+
+def save_pose_to_cache(pose_file, pose, bodyparts, requested):
+	try:
+		np.savez(get_pose_cache_path(pose_file), pose=pose, bodyparts=np.array(bodyparts), 
+						requested=np.array(requested), mtime=os.path.getmtime(pose_file))
+	except Exception as e:
+		print("Could not cache pose {}: {}".format(pose_file, e))
+
+
+def read_pose_columns(pose_file, bodyparts, chunk_size=100000):
+	"""[Reads x, y, likelihood for the selected bodyparts from a DLC .h5 file]
+
+	Arguments:
+		pose_file {[str]} -- [path to .h5 file]
+		bodyparts {[list]} -- [names of bodyparts to load, the ones missing from the file are ignored]
+
+	Returns:
+		pose {[np.ndarray]} -- [float32 (n_frames, n_bodyparts, 3) array]
+		bodyparts {[list]} -- [names of the bodyparts loaded, in the order of pose's second axis]
+	"""
+	with pd.HDFStore(pose_file, mode='r') as store:
+		storer = store.get_storer(store.keys()[0])
+
+		if not storer.is_table or len(storer.values_axes) != 1:
+			# ? fixed format or mixed dtypes, need to load everything with pandas
+			posedata = store.select(store.keys()[0])
+			columns = list(posedata.columns)
+		else:
+			columns = list(storer.non_index_axes[0][1])
+			posedata = None
+
+		# get the index of each selected column in the stored values
+		found = [bp for bp in bodyparts if (columns[0][0], bp, 'x') in columns]
+		scorer = columns[0][0]
+		col_idx = np.array([[columns.index((scorer, bp, c)) for c in coords] for bp in found]).ravel()
+
+		if posedata is not None:
+			pose = posedata.values[:, col_idx].astype(np.float32)
+		else:
+			table = storer.table
+			n_frames = table.nrows
+			pose = np.zeros((n_frames, len(col_idx)), dtype=np.float32)
+			for start in range(0, n_frames, chunk_size):
+				stop = min(start+chunk_size, n_frames)
+				pose[start:stop] = table.read(start=start, stop=stop, field='values_block_0')[:, col_idx]
+
+	return pose.reshape(pose.shape[0], len(found), len(coords)), found
+
+
+def load_pose(pose_file, bodyparts, use_cache=True):
+	"""[Loads the pose for the selected bodyparts, from the cache if the pose file hasn't changed since it was parsed]
+
+	Arguments:
+		pose_file {[str]} -- [path to DLC .h5 file]
+		bodyparts {[list]} -- [names of bodyparts to load]
+
+	Returns:
+		pose {[np.ndarray]} -- [float32 (n_frames, n_bodyparts, 3) array with x, y, likelihood]
+		bodyparts {[list]} -- [names of the bodyparts loaded]
+	"""
+	if use_cache:
+		cached = load_pose_from_cache(pose_file, bodyparts)
+		if cached is not None: return cached
+
+	pose, found = read_pose_columns(pose_file, bodyparts)
+	if use_cache: save_pose_to_cache(pose_file, pose, found, bodyparts)
+	return pose, found
+
+
+def cache_poses(pose_files, bodyparts, n_processes=4):
+	"""[Parses in parallel all the pose files that don't have an up to date cache, so that populating
+		the tracking tables only reads the cached arrays]
+
+	Arguments:
+		pose_files {[list]} -- [list of paths to DLC .h5 files]
+		bodyparts {[list]} -- [names of bodyparts to load]
+	"""
+	def parse(pose_file):
+		if load_pose_from_cache(pose_file, bodyparts) is not None: return
+		try:
+			load_pose(pose_file, bodyparts)
+		except Exception as e:
+			print("Could not parse {}: {}".format(pose_file, e))
+
+	pool = ThreadPool(n_processes)
+	try:
+		pool.map(parse, pose_files)
+	finally:
+		pool.close()
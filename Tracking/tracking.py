@@ -13,6 +13,8 @@ import pandas as pd
 import cv2
 import warnings
 import os
+import threading
+from queue import Queue
 
 
 computer = "desk"
@@ -26,13 +28,20 @@ warnings.warn("\n\n\nCOMPUTER IS: {}\n\n\n".format(computer))
 class SetUpTracking:
     dlc_proj_name = "DecisionMaze-Federico-2019-10-15\\config.yaml"
     
-    def __init__(self, video_folder, pose_folder):
+    def __init__(self, video_folder, pose_folder, n_prefetch=2, videos=None):
         """[For each video in video folder check if there is a corresponding pose file, if there isn't analyse it with the correct
         dlc model [info about dlc models is in database.dlcmodels]]
+
+        Videos are processed as a staged pipeline: while DLC analyses one video, the next n_prefetch videos are copied to 
+        the local temp folder and the outputs of the videos already analysed are moved to the pose folder in the background.
         
         Arguments:
             video_folder {[str]} -- [path to video folder]
             pose_folder {[str]} -- [path to pose folder]
+
+        Keyword Arguments:
+            n_prefetch {int} -- [number of videos to copy to local disk ahead of the one being analysed] (default: {2})
+            videos {[list]} -- [list of video names to analyse, if None all videos without a pose file are analysed] (default: {None})
         """
 
         if computer == "desk":
@@ -42,114 +51,179 @@ class SetUpTracking:
             self.temp_fld = "D:\\Fede"
             self.nets_folder = "W:\\branco\\Federico\\raw_behaviour\\maze\\DLC_nets"
         self.move_video = True
+        self.n_prefetch = n_prefetch
 
         self.video_folder = video_folder
         self.pose_folder = pose_folder
 
-        self.video_to_process = self.get_videos_to_process()
+        if videos is None:
+            self.video_to_process = self.get_videos_to_process()
+        else:
+            self.video_to_process = videos
         self.process()
 
 
 
     def get_videos_to_process(self):
         # Get all the pose files and then returns a list of video files that don't have a corresponding pose file
-        # pose_files = [f.split('.')[0][:-5] for f in os.listdir(self.pose_folder) if '.h5' in f]
-        # return [f for f in os.listdir(self.video_folder) if 'tdms' not in f and f.split('.')[0] not in pose_files
-        #         and os.path.getsize(os.path.join(self.video_folder, f)) > 2000]
-        return load_yaml("Utilities/file_io/files_to_track.yml")
-        # return [os.path.join(self.video_folder, tt) for tt in to_track]
-
+        pose_files = [f.split('_pose')[0] for f in os.listdir(self.pose_folder) if '.h5' in f]
+        return sorted([f for f in os.listdir(self.video_folder) 
+                    if 'tdms' not in f and "." in f and f.split('.')[0] not in pose_files
+                    and os.path.getsize(os.path.join(self.video_folder, f)) > 2000])
 
-    def process(self):
+    # --------------------------------- Staging ---------------------------------- #
+    def stage_video(self, video):
         """
-            dlc analyze_video for each video file with the correct dlc model
-            rename and move .h5 and .pickle file to the pose_file folder
+            Copy the video to local HD: otherwise analysis breaks if internet connection is unstable.
+            Returns the path to the video to analyse or None if the video can't be analysed.
         """
-        def move_video(complete_path, move_video_path):
-            print('Moving video over')
-            try:
-                shutil.copy(complete_path, move_video_path)
-            except:
-                raise FileNotFoundError('Could not move {} to {}'.format(complete_path, move_video_path))
-            else:
-                print('     file moved correctly')
-
-
-        for i, video in enumerate(self.video_to_process):
-            print('Processing video {} of {}'.format(i+1, len(self.video_to_process)))
-
-            # Get the DLC model config path
-            config_path = os.path.join(self.nets_folder, self.dlc_proj_name)
-                
-            # Move video to local HD: otherwise analysis breaks if internet connection is unstable
-            complete_path = os.path.join(self.video_folder, video)
-
-            if not os.path.isfile(complete_path): 
-                print("!!! could not find file: ", complete_path)
-                continue
-            
-            if os.path.getsize(complete_path) < 2000: continue # Check that video has frames
-            
-            if self.move_video:
-                move_video_path = os.path.join(self.temp_fld, video)
-                if os.path.isfile(move_video_path):
-                    # Video already there, but is it complete
-                    if not os.path.getsize(move_video_path) == os.path.getsize(complete_path):
-                        # Nope, move it 
-                        os.remove(move_video_path)
-                        move_video(complete_path, move_video_path)
-                else:
-                    move_video(complete_path, move_video_path)
-                
-                # Check that moving video worked correctly
-                if not os.path.getsize(complete_path) == os.path.getsize(move_video_path): raise ValueError('Smth went wrong while moving the video')
-
-                # store the path on the moved video so that we can delete it at the end of the processing
-                self.move_video_path = move_video_path
-            try:
-                cap = cv2.VideoCapture(move_video_path)
-                if not cap.isOpened(): raise ValueError
-            except: 
-                print("The video was not moved, analysing the orignal on winstore")
-                cap = cv2.VideoCapture(complete_path)
-                if not cap.isOpened(): 
-                    raise ValueError('Original video file might be corrupted', complete_path)
-                move_video_path = complete_path # copy variable to be used below
-
-            # Run DLC analysis
-            print("""
-            Video:  {}
-            Config: {}
-            
-            """.format(move_video_path, config_path))
+        complete_path = os.path.join(self.video_folder, video)
 
+        if not os.path.isfile(complete_path): 
+            print("!!! could not find file: ", complete_path)
+            return None
+        
+        if os.path.getsize(complete_path) < 2000: return None # Check that video has frames
+        
+        if not self.move_video: return complete_path
 
-            analyze_videos(config_path, [move_video_path], gputouse=0, save_as_csv=False)
-            filterpredictions(config_path, [move_video_path], videotype="mp4", save_as_csv=False, filtertype='median')
+        move_video_path = os.path.join(self.temp_fld, video)
+        try:
+            # Video already there, but is it complete?
+            if not os.path.isfile(move_video_path) or not os.path.getsize(move_video_path) == os.path.getsize(complete_path):
+                print('Moving video over: ', video)
+                shutil.copy(complete_path, move_video_path)
 
-            # Rename and move .h5 and .pickle
-            analysis_output = [f for f in os.listdir(self.temp_fld) if 'filtered.h5' in f]
+            # Check that moving video worked correctly
+            if not os.path.getsize(complete_path) == os.path.getsize(move_video_path): raise ValueError('Smth went wrong while moving the video')
+        except Exception as e:
+            print("The video was not moved, analysing the orignal on winstore: ", e)
+            return complete_path
+        return move_video_path
 
+    def prefetch(self, staged):
+        """
+            Runs on a background thread: stages the videos to process and puts them on the staged queue.
+            The queue is bounded so at most n_prefetch videos are waiting on local disk.
+        """
+        for video in self.video_to_process:
+            if self.stop_prefetch.is_set(): break
+            staged.put((video, self.stage_video(video)))
+        staged.put(None)
+
+    # --------------------------------- Analysis --------------------------------- #
+    def analyse(self, video_path, config_path):
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened(): 
+            raise ValueError('Video file might be corrupted', video_path)
+        cap.release()
+
+        # Run DLC analysis
+        print("""
+        Video:  {}
+        Config: {}
+        
+        """.format(video_path, config_path))
 
-            for f in analysis_output:
-                origin = os.path.join(self.temp_fld, f)
-                name, ext = f.split('.')
-                correct_name = f.split('DLC')[0]+'_pose'
-                dest = os.path.join(self.pose_folder, correct_name+'.'+ext)
-                try:
-                    shutil.move(origin, dest)
-                except:
-                    raise FileExistsError('Could not move pose file from {} to {}'.format(origin, dest))
+        analyze_videos(config_path, [video_path], gputouse=0, save_as_csv=False)
+        filterpredictions(config_path, [video_path], videotype="mp4", save_as_csv=False, filtertype='median')
 
-            # Remove video file moved to local harddrive
-            # os.remove(move_video_path)
+    # ------------------------------- Finalisation ------------------------------- #
+    def finalise(self, video_path):
+        """
+            Rename and move the .h5 files produced for video_path to the pose folder and
+            remove the local copy of the video
+        """
+        fld, videoname = os.path.split(video_path)
+        videoname = videoname.split('.')[0]
+        analysis_output = [f for f in os.listdir(fld) if f.startswith(videoname+'DLC') and 'filtered.h5' in f]
+
+        for f in analysis_output:
+            origin = os.path.join(fld, f)
+            name, ext = f.split('.')
+            correct_name = f.split('DLC')[0]+'_pose'
+            dest = os.path.join(self.pose_folder, correct_name+'.'+ext)
+            try:
+                shutil.move(origin, dest)
+            except:
+                raise FileExistsError('Could not move pose file from {} to {}'.format(origin, dest))
 
-            # All done, on to the next
+        # ? only remove the video if it's the local copy
+        if os.path.normpath(fld) != os.path.normpath(self.video_folder): self.cleanup(video_path)
 
+    def finaliser(self, to_finalise):
+        # Runs on a background thread, moves outputs of analysed videos while the next one is analysed
+        while True:
+            video_path = to_finalise.get()
+            if video_path is None: break
+            try:
+                self.finalise(video_path)
+            except Exception as e:
+                self.finalise_errors.append((video_path, e))
+                print("!!! could not finalise {}: {}".format(video_path, e))
+                self.discard(video_path)
 
-    def cleanup(self):
+    def process(self):
+        """
+            dlc analyze_video for each video file with the correct dlc model
+            rename and move .h5 and .pickle file to the pose_file folder
+        """
+        # Get the DLC model config path
+        config_path = os.path.join(self.nets_folder, self.dlc_proj_name)
+
+        staged, to_finalise = Queue(maxsize=self.n_prefetch), Queue()
+        self.stop_prefetch = threading.Event()
+        self.finalise_errors = []
+
+        prefetcher = threading.Thread(target=self.prefetch, args=(staged,), daemon=True)
+        finaliser = threading.Thread(target=self.finaliser, args=(to_finalise,), daemon=True)
+        prefetcher.start()
+        finaliser.start()
+
+        i, video_path = 0, None
+        try:
+            while True:
+                item = staged.get()
+                if item is None: break
+                video, video_path = item
+                i += 1
+                print('Processing video {} of {}'.format(i, len(self.video_to_process)))
+                if video_path is None: continue
+
+                self.analyse(video_path, config_path)
+                to_finalise.put(video_path)
+                video_path = None
+                # All done, on to the next
+        finally:
+            # stop prefetching, remove the local copies that won't be analysed and wait for the outputs to be moved
+            self.stop_prefetch.set()
+            not_analysed = []
+            while prefetcher.is_alive() or not staged.empty():
+                while not staged.empty(): not_analysed.append(staged.get())
+                prefetcher.join(timeout=.1)
+            for item in not_analysed:
+                if item is not None: self.discard(item[1])
+            self.discard(video_path)
+
+            to_finalise.put(None)
+            finaliser.join()
+
+        if self.finalise_errors:
+            raise FileExistsError('Could not finalise {} videos: {}'.format(len(self.finalise_errors), self.finalise_errors))
+
+    def cleanup(self, move_video_path):
         # Remove the video we moved over to clean up disk
-        os.remove(self.move_video_path)
+        os.remove(move_video_path)
+
+    def discard(self, video_path):
+        # Remove a staged video if it's a local copy in temp_fld, never the original
+        if video_path is None or not os.path.isfile(video_path): return
+        fld = os.path.normpath(os.path.split(video_path)[0])
+        if fld != os.path.normpath(self.temp_fld) or fld == os.path.normpath(self.video_folder): return
+        try:
+            self.cleanup(video_path)
+        except Exception as e:
+            print("!!! could not remove local copy {}: {}".format(video_path, e))
 
 if __name__ == "__main__":
     if computer != "desk":
@@ -19,6 +19,7 @@ except:
 import time
 
 from Utilities.video_and_plotting.video_editing import VideoConverter, Editor
+from Utilities.video_and_plotting.video_metadata import get_video_metadata_index
 from Utilities.file_io.sort_behaviour_files import sort_mantis_files
 from database.database_toolbox import ToolBox
 from Utilities.file_io.files_load_save import *
@@ -85,6 +86,12 @@ class FilesAutomationToolbox:
                 # raise ValueError('Could not insert: ', key)
         print(table)
 
+    def index_videos_metadata(self, n_processes=8, count_keyframes=False):
+        """[Store the metadata of all converted videos in the video metadata index, so that 
+            Editor.get_video_params doesn't need to open them]
+        """
+        return get_video_metadata_index().scan(self.videos_fld, n_processes=n_processes, count_keyframes=count_keyframes)
+
     def convert_tdms_to_mp4(self, n_processes=1):
         """
             Keeps calling video conversion tool, regardless of what happens
@@ -182,6 +189,7 @@ class FilesAutomationToolbox:
 
         tdmss = [f for f in os.listdir(self.videos_fld) if '.tdms' in f]
         editor = Editor()
+        self.index_videos_metadata()
 
         for t in tdmss:
             print('\n\nChecking: ', t)
@@ -192,8 +200,7 @@ class FilesAutomationToolbox:
                 mp4s = [v for v in os.listdir(self.videos_fld) if name in v and '.mp4' in v]
                 for mp4 in mp4s:
                     if [f for f in ['top', 'side', 'catwalk'] if f in mp4]: continue # ignore cropped videos
-                    cap = cv2.VideoCapture(os.path.join(self.videos_fld, mp4))
-                    nframes, width, height, fps = editor.get_video_params(cap)
+                    nframes, width, height, fps = editor.get_video_params(os.path.join(self.videos_fld, mp4))
                     number_of_frames.append(nframes)
                 if not number_of_frames or number_of_frames[0] == 0:
                     continue 
@@ -228,6 +235,7 @@ if __name__ == "__main__":
 
     automation.get_list_uncoverted_tdms_videos()
     automation.get_list_not_tracked_videos()
+    # automation.index_videos_metadata()
 
     # Checks 
     # automation.extract_videotdms_metadata()
@@ -0,0 +1,62 @@
+import sys
+sys.path.append('./')
+
+import numpy as np
+
+
+"""
+	Euclidean distances between the points of trajectories, computed as row-wise norms in O(n) memory:
+		- rowwise_distances: distance between v1[i] and v2[i], v2 can also be a single point (broadcast)
+		- step_distances: distance between each point of a trajectory and the previous one
+	Long arrays are processed in chunks of chunk_size rows so that temporaries stay small.
+"""
+
+chunk_size = 1000000 # ? rows processed at once
+
+
+def _as_points(v):
+	v = np.asarray(v, dtype=np.float64)
+	if v.ndim == 1: v = v[None, :]
+	if v.ndim != 2: raise ValueError("Points should be a (n, n_dims) array or a single point")
+	return v
+
+def rowwise_distances(v1, v2, chunk=None):
+	"""[Euclidean distance between each row of v1 and the corresponding row of v2]
+
+	Arguments:
+		v1 {[np.ndarray]} -- [(n, n_dims) array]
+		v2 {[np.ndarray]} -- [(n, n_dims) array or a single point (n_dims, ) to compute the distance from]
+
+	Keyword Arguments:
+		chunk {[int]} -- [rows processed at once, if None chunk_size] (default: {None})
+
+	Returns:
+		[np.ndarray] -- [(n, ) array of distances]
+	"""
+	v1, v2 = _as_points(v1), _as_points(v2)
+	if v1.shape[1] != v2.shape[1]:
+		raise ValueError("Points should have the same number of dimensions")
+	if v2.shape[0] not in (1, v1.shape[0]):
+		raise ValueError("v2 should be a single point or have the same length as v1")
+	if chunk is None: chunk = chunk_size
+
+	dist = np.empty(v1.shape[0])
+	for start in range(0, v1.shape[0], chunk):
+		stop = start + chunk
+		other = v2 if v2.shape[0] == 1 else v2[start:stop]
+		dist[start:stop] = np.sqrt(np.sum((v1[start:stop] - other)**2, axis=1))
+	return dist
+
+def point_distances(v, point, chunk=None):
+	"""[Euclidean distance of each point of a trajectory from a point (e.g. the shelter)]
+	"""
+	return rowwise_distances(v, np.asarray(point, dtype=np.float64).ravel(), chunk=chunk)
+
+def step_distances(v, chunk=None):
+	"""[Distance between each point of a trajectory and the previous one, 0 for the first point]
+	"""
+	v = _as_points(v)
+	dist = np.zeros(v.shape[0])
+	if v.shape[0] > 1:
+		dist[1:] = rowwise_distances(v[1:], v[:-1], chunk=chunk)
+	return dist
@@ -35,6 +35,62 @@ def line_smoother(y, window_size=31, order=5, deriv=0, rate=1):
 		y = np.concatenate((firstvals, y, lastvals))
 		return np.convolve(m[::-1], y, mode='valid')
 
+def _ragged_local_index(counts):
+	# for each element of a ragged array with the given segment lengths, its index within its segment
+	counts = np.asarray(counts, dtype=np.int64)
+	return np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+def line_smoother_ragged(y, offsets, window_size=31, order=5, deriv=0, rate=1):
+	"""[Same as line_smoother applied to each segment y[offsets[i]:offsets[i+1]] of a ragged array, but all the
+		segments are padded as in line_smoother and smoothed with a single convolution]
+
+	Arguments:
+		y {[np.ndarray]} -- [1d array with all the segments one after the other]
+		offsets {[np.ndarray]} -- [(n_segments + 1) array with the start of each segment]
+
+	Returns:
+		smoothed {[np.ndarray]} -- [smoothed segments one after the other]
+		offsets {[np.ndarray]} -- [offsets of the smoothed segments (same as the input for segments longer than window_size/2)]
+	"""
+	order_range = range(order + 1)
+	half_window = (window_size - 1) // 2
+	b = np.mat([[k ** i for i in order_range] for k in range(-half_window, half_window + 1)])
+	m = np.linalg.pinv(b).A[deriv] * rate ** deriv * factorial(deriv)
+
+	y = np.asarray(y, dtype=np.float64)
+	offsets = np.asarray(offsets, dtype=np.int64)
+	starts, lengths = offsets[:-1], np.diff(offsets)
+	n_out = np.zeros(len(lengths), dtype=np.int64)
+
+	valid = lengths > 0
+	s, L = starts[valid], lengths[valid]
+	pads = np.clip(L - 1, 0, half_window) # ? as in line_smoother short segments get shorter pads
+	padded_lengths = L + 2*pads
+	padded_starts = np.cumsum(padded_lengths) - padded_lengths
+	padded = np.zeros(np.sum(padded_lengths))
+
+	# pad the start of each segment
+	local = _ragged_local_index(pads)
+	first = np.repeat(y[s], pads)
+	padded[np.repeat(padded_starts, pads) + local] = first - np.abs(y[np.repeat(s + pads, pads) - local] - first)
+
+	# copy each segment
+	local = _ragged_local_index(L)
+	padded[np.repeat(padded_starts + pads, L) + local] = y[np.repeat(s, L) + local]
+
+	# pad the end of each segment
+	local = _ragged_local_index(pads)
+	last = np.repeat(y[s + L - 1], pads)
+	padded[np.repeat(padded_starts + pads + L, pads) + local] = last + np.abs(y[np.repeat(s + L - 2, pads) - local] - last)
+
+	# convolve and keep for each segment only the values computed from that segment
+	convolved = np.convolve(m[::-1], padded, mode='valid')
+	seg_out = np.clip(padded_lengths - window_size + 1, 0, None)
+	smoothed = convolved[np.repeat(padded_starts, seg_out) + _ragged_local_index(seg_out)]
+
+	n_out[valid] = seg_out
+	return smoothed, np.concatenate([[0], np.cumsum(n_out)])
+
 def line_smoother_convolve(y, window_size=31):
 	box = np.ones(window_size)/window_size
 	y_smooth = np.convolve(y, box, mode='same')
@@ -0,0 +1,163 @@
+import sys
+sys.path.append('./')
+
+import os
+import hashlib
+import numpy as np
+from collections import OrderedDict
+
+
+"""
+	Cache of geodesic distance fields (as computed by math_utils.geodist with skfmm).
+	A field only depends on the maze image (at the resolution it's given) and the shelter (goal) location, so it is
+	computed once for each of them:
+		- fields are kept in memory (the last max_fields used)
+		- if a cache_folder is given they are saved there as float32 .npy and memory mapped when loaded again
+
+	Distances at arbitrary (e.g. tracking) coordinates are computed with bilinear interpolation on the field.
+
+	Usage:
+		cache = get_geodesic_cache()
+		field = cache.get_field(maze, shelter)
+		distances = cache.get_distance(maze, shelter, tracking[:, :2])
+"""
+
+geodesic_cache_folder = None # ? folder used by get_geodesic_cache, fields are only kept in memory if None
+
+
+def get_maze_hash(maze, shelter):
+	"""[Key of a geodesic field: hash of the maze's free locations, shape and shelter location]
+	"""
+	maze = np.ascontiguousarray(np.asarray(maze) != 0)
+
+	h = hashlib.md5(np.packbits(maze).tobytes())
+	h.update("{}_{}_{}".format(maze.shape, int(shelter[0]), int(shelter[1])).encode())
+	return h.hexdigest()
+
+def bilinear_lookup(field, x, y):
+	"""[Values of a 2d field at arbitrary coordinates with bilinear interpolation. Locations outside of
+		the field are nan and nan values in the field (e.g. walls) are ignored when interpolating]
+
+	Arguments:
+		field {[np.ndarray]} -- [2d array indexed as field[y, x]]
+		x {[np.ndarray]} -- [x coordinates]
+		y {[np.ndarray]} -- [y coordinates]
+
+	Returns:
+		[np.ndarray] -- [interpolated values, same shape as x]
+	"""
+	x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+	shape = x.shape
+	x, y = x.ravel(), y.ravel()
+	result = np.full(x.shape, np.nan)
+
+	inside = (x >= 0) & (y >= 0) & (x <= field.shape[1] - 1) & (y <= field.shape[0] - 1)
+	if not np.any(inside): return result.reshape(shape)
+	xi, yi = x[inside], y[inside]
+
+	x0 = np.minimum(np.floor(xi).astype(np.int64), field.shape[1] - 2) if field.shape[1] > 1 else np.zeros(len(xi), dtype=np.int64)
+	y0 = np.minimum(np.floor(yi).astype(np.int64), field.shape[0] - 2) if field.shape[0] > 1 else np.zeros(len(yi), dtype=np.int64)
+	x1, y1 = np.minimum(x0 + 1, field.shape[1] - 1), np.minimum(y0 + 1, field.shape[0] - 1)
+	dx, dy = xi - x0, yi - y0
+
+	values = np.stack([field[y0, x0], field[y0, x1], field[y1, x0], field[y1, x1]]).astype(np.float64)
+	weights = np.stack([(1-dx)*(1-dy), dx*(1-dy), (1-dx)*dy, dx*dy])
+
+	# ? renormalise the weights of the neighbours that are not nan
+	valid = ~np.isnan(values)
+	weights = np.where(valid, weights, 0)
+	total = np.sum(weights, axis=0)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		result[inside] = np.where(total > 0, np.sum(np.where(valid, values, 0) * weights, axis=0) / total, np.nan)
+	return result.reshape(shape)
+
+
+class GeodesicFieldCache:
+	def __init__(self, cache_folder=None, max_fields=8):
+		"""[Computes geodesic distance fields once per maze image and shelter location]
+
+		Keyword Arguments:
+			cache_folder {[str]} -- [if not None fields are saved here and memory mapped] (default: {None})
+			max_fields {int} -- [number of fields kept in memory] (default: {8})
+		"""
+		self.cache_folder = cache_folder
+		if self.cache_folder is not None and not os.path.isdir(self.cache_folder):
+			os.makedirs(self.cache_folder)
+
+		self.max_fields = max_fields
+		self.fields = OrderedDict()
+
+	def get_cache_path(self, key):
+		return os.path.join(self.cache_folder, "geodesic_{}.npy".format(key))
+
+	def get_field(self, maze, shelter):
+		"""[Geodesic distance from the shelter at each location of the maze, as math_utils.geodist but cached.
+			The field has the maze's resolution, resize the maze to compute it on a different grid]
+
+		Arguments:
+			maze {[np.ndarray]} -- [maze as 2d array, 0 for walls]
+			shelter {[list]} -- [x, y coordinates of the shelter]
+
+		Returns:
+			[np.ndarray] -- [float32 field, read only]
+		"""
+		key = get_maze_hash(maze, shelter)
+		if key in self.fields:
+			self.fields.move_to_end(key)
+			return self.fields[key]
+
+		if self.cache_folder is not None and os.path.isfile(self.get_cache_path(key)):
+			field = np.load(self.get_cache_path(key), mmap_mode='r')
+		else:
+			from Utilities.maths.math_utils import geodist
+			field = np.asarray(geodist(maze, shelter), dtype=np.float32)
+
+			if self.cache_folder is not None:
+				np.save(self.get_cache_path(key), field)
+				field = np.load(self.get_cache_path(key), mmap_mode='r')
+			else:
+				field.setflags(write=False)
+
+		self.fields[key] = field
+		while len(self.fields) > self.max_fields:
+			self.fields.popitem(last=False)
+		return field
+
+	def get_distance(self, maze, shelter, xy, scale=1):
+		"""[Geodesic distance from the shelter at arbitrary coordinates]
+
+		Arguments:
+			maze {[np.ndarray]} -- [maze as 2d array, 0 for walls]
+			shelter {[list]} -- [x, y coordinates of the shelter, in the maze's coordinates]
+			xy {[np.ndarray]} -- [(n, 2) array of x, y coordinates]
+
+		Keyword Arguments:
+			scale {float} -- [factor to convert xy to the maze's coordinates, e.g. maze size / arena size] (default: {1})
+		"""
+		field = self.get_field(maze, shelter)
+		xy = np.asarray(xy, dtype=np.float64) * scale
+		return bilinear_lookup(field, xy[..., 0], xy[..., 1]) / scale
+
+	def clear(self, key=None):
+		""" Removes a field (or all of them if key is None) from memory and from the cache folder """
+		keys = list(self.fields.keys()) if key is None else [key]
+		for k in keys: self.fields.pop(k, None)
+
+		if self.cache_folder is not None:
+			if key is None:
+				files = [f for f in os.listdir(self.cache_folder) if f.startswith("geodesic_") and f.endswith(".npy")]
+			else:
+				files = [os.path.split(self.get_cache_path(key))[1]]
+			for f in files:
+				path = os.path.join(self.cache_folder, f)
+				if os.path.isfile(path): os.remove(path)
+
+
+# ? Caches shared by all the callers in this process, one per cache folder
+_caches = {}
+
+def get_geodesic_cache(cache_folder=None):
+	if cache_folder is None: cache_folder = geodesic_cache_folder
+	if cache_folder not in _caches:
+		_caches[cache_folder] = GeodesicFieldCache(cache_folder=cache_folder)
+	return _caches[cache_folder]
@@ -19,6 +19,8 @@ try:
 	from sklearn import preprocessing
 except: pass
 
+from Utilities.maths.distances import rowwise_distances, point_distances, step_distances
+
 try:
 	import skfmm
 except:
@@ -139,34 +141,46 @@ def get_roi_enters_exits(roi_tracking, roi_id):
 def turning_points(array):
 	''' turning_points(array) -> min_indices, max_indices
 	Finds the turning points within an 1D array and returns the indices of the minimum and 
-	maximum turning points in two separate lists.
+	maximum turning points in two separate lists. For plateaus the index of the middle of the plateau is returned.
 	'''
-	idx_max, idx_min = [], []
-	if (len(array) < 3):
-		return idx_min, idx_max
-
-	NEUTRAL, RISING, FALLING = range(3)
-
-	def get_state(a, b):
-		if a < b:
-			return RISING
-		if a > b:
-			return FALLING
-		return NEUTRAL
-
-	ps = get_state(array[0], array[1])
-	begin = 1
-	for i in range(2, len(array)):
-		s = get_state(array[i - 1], array[i])
-		if s != NEUTRAL:
-			if ps != NEUTRAL and ps != s:
-				if s == FALLING:
-					idx_max.append((begin + i - 1) // 2)
-				else:
-					idx_min.append((begin + i - 1) // 2)
-			begin = i
-			ps = s
-	return idx_min, idx_max
+	trial_min, idx_min, trial_max, idx_max = turning_points_batch([array])
+	return list(idx_min), list(idx_max)
+
+def turning_points_batch(arrays):
+	"""[Turning points of many 1D arrays at once (e.g. the x position of all trials)]
+
+	Arguments:
+		arrays {[list, np.ndarray]} -- [list of 1d arrays (can have different lengths) or 2d array with one array per row]
+
+	Returns:
+		trial_min, idx_min {[np.ndarray]} -- [for each minimum the index of its array and its index in that array]
+		trial_max, idx_max {[np.ndarray]} -- [same for the maxima]
+	"""
+	arrays = [np.asarray(a, dtype=np.float64).ravel() for a in arrays]
+	lengths = np.array([len(a) for a in arrays], dtype=np.int64)
+	empty = np.zeros(0, dtype=np.int64)
+	if not len(arrays) or np.sum(lengths) < 3: return empty, empty, empty, empty
+
+	values = np.concatenate(arrays)
+	offsets = np.concatenate([[0], np.cumsum(lengths)])
+	trial = np.repeat(np.arange(len(arrays)), lengths)
+
+	# ? direction of each step, steps between two arrays and steps with nans are neutral
+	steps = np.sign(np.diff(values))
+	steps[np.isnan(steps)] = 0
+	steps[trial[:-1] != trial[1:]] = 0
+
+	# turning points are where the direction changes between consecutive non neutral steps of the same array
+	moving = np.where(steps != 0)[0]
+	prev, cur = moving[:-1], moving[1:]
+	turning = (steps[prev] != steps[cur]) & (trial[prev] == trial[cur])
+	prev, cur = prev[turning], cur[turning]
+
+	# ? middle of the plateau between the two steps, as index within each array
+	idx = (prev + cur + 1) // 2
+	is_max = steps[cur] < 0
+	local = idx - offsets[trial[idx]]
+	return trial[idx][~is_max], local[~is_max], trial[idx][is_max], local[is_max]
 
 
 # ! PROBABILITIES
@@ -256,14 +270,28 @@ def calc_distance_between_point_and_line(line_points, p3):
 	return np.cross(p2-p1,p3-p1)/np.linalg.norm(p2-p1)
 	
 def cals_distance_between_vector_and_line(line_points, v):
-    dist = []
-    if v.shape[1] > v.shape[0]:
-        raise ValueError("This function expects and NxM array with N being the number of frames and N>M, ideally M=2")
+	"""[Signed perpendicular distance between each point of a trajectory and a line, as calc_distance_between_point_and_line
+		but with one cross product for all points]
 
-    for i in range(v.shape[0]):
-        p = [v[i, 0], v[i, 1]]
-        dist.append(calc_distance_between_point_and_line(line_points, p))
-    return dist
+	Arguments:
+		line_points {[list]} -- [list of two 2-by-1 np arrays with the two points that define the line]
+		v {[np.ndarray, list]} -- [(n_frames, 2) array, (n_trials, n_frames, 2) array or list of (n_frames, 2) arrays]
+
+	Returns:
+		[np.ndarray, list] -- [distance of each point, same shape as v without the last dimension (a list for a list of arrays)]
+	"""
+	if isinstance(v, (list, tuple)):
+		lengths = np.cumsum([len(x) for x in v])[:-1]
+		if not len(v): return []
+		return np.split(cals_distance_between_vector_and_line(line_points, np.vstack(v)), lengths)
+
+	v = np.asarray(v, dtype=np.float64)
+	if v.ndim == 2 and v.shape[1] > v.shape[0]:
+		raise ValueError("This function expects and NxM array with N being the number of frames and N>M, ideally M=2")
+
+	p1, p2 = np.asarray(line_points[0], dtype=np.float64).ravel(), np.asarray(line_points[1], dtype=np.float64).ravel()
+	d = p2 - p1
+	return (d[0] * (v[..., 1] - p1[1]) - d[1] * (v[..., 0] - p1[0])) / np.linalg.norm(d)
 
 
 
@@ -306,23 +334,10 @@ def calc_distance_between_points_in_a_vector_2d(v1):
 				'Feature not implemented: cant handle with data format passed to this function')
 
 
-	# loop over each pair of points and extract distances
-	dist = []
-	for n, pos in enumerate(v1):
-		# Get a pair of points
-		if n == 0:  # get the position at time 0, velocity is 0
-			p0 = pos
-			dist.append(0)
-		else:
-			p1 = pos  # get position at current frame
-
-			# Calc distance
-			dist.append(np.abs(distance.euclidean(p0, p1)))
-
-			# Prepare for next iteration, current position becomes the old one and repeat
-			p0 = p1
-
-	return np.array(dist)
+	# distance between each point and the previous one, at time 0 velocity is 0
+	v1 = np.asarray(v1)
+	if v1.ndim == 1: v1 = v1[:, None] # ? 1d positions
+	return step_distances(v1)
 
 def calc_distance_between_points_two_vectors_2d(v1, v2):
 	'''calc_distance_between_points_two_vectors_2d [pairwise distance between vectors points]
@@ -353,14 +368,8 @@ def calc_distance_between_points_two_vectors_2d(v1, v2):
 	if not v1.shape[0] == v2.shape[0]:
 		raise ValueError('Error: input arrays should have the same length')
 
-	# Calculate distance
-	if v1.shape[1]<20000 and v1.shape[0]<20000: 
-		# For short vectors use cdist
-		dist = distance.cdist(v1, v2, 'euclidean')
-		dist = dist[:, 0]  
-	else:
-		dist = [calc_distance_between_points_2d(p1, p2) for p1, p2 in zip(v1, v2)]
-	return dist
+	# Calculate distance between corresponding points, without building the n x n cdist matrix
+	return rowwise_distances(v1, v2)
 
 def calc_distance_from_shelter(v, shelter):
 	"""[Calculates the euclidean distance from the shelter at each timepoint]
@@ -372,9 +381,7 @@ def calc_distance_from_shelter(v, shelter):
 	assert isinstance(v, np.ndarray), 'Input data needs to be a numpy array'
 	assert v.shape[1] == 2, 'Input array must be a 2d array with two columns'
 
-	shelter_vector = np.array(shelter)
-	shelter_vector = np.tile(shelter_vector, (v.shape[0], 1))
-	return calc_distance_between_points_two_vectors_2d(v, shelter_vector)
+	return point_distances(v, shelter)
 
 def angle_between_points_2d_clockwise(p1, p2):
 	'''angle_between_points_2d_clockwise [Determines the angle of a straight line drawn between point one and two. 
@@ -505,14 +512,21 @@ def calc_ang_velocity(angles):
 	ang_vel_rads = np.insert(np.diff(np.unwrap(angles_radis)), 0, 0)
 	return np.degrees(ang_vel_rads)
 
-def geodist(maze, shelter):
+def geodist(maze, shelter, use_cache=False):
 	"""[Calculates the geodesic distance from the shelter at each location of the maze]
 	
 	Arguments:
 		maze {[np.ndarray]} -- [maze as 2d array]
 		shelter {[np.ndarray]} -- [coordinates of the shelter]
 
+	Keyword Arguments:
+		use_cache {bool} -- [if True the field is computed once per maze and shelter and returned 
+							as a read only float32 array, see Utilities.maths.geodesic] (default: {False})
 	"""
+	if use_cache:
+		from Utilities.maths.geodesic import get_geodesic_cache
+		return get_geodesic_cache().get_field(maze, shelter)
+
 	phi = np.ones_like(maze)
 	mask = (maze == 0)
 	masked_maze = np.ma.MaskedArray(phi, mask)
@@ -7,6 +7,8 @@ import os
 import glob
 import cv2
 
+from Utilities.video_and_plotting.video_threads import ThreadedVideoReader, ThreadedVideoWriter
+
 # TODO give credit to philip
 
 class FisheyeCorrection:
@@ -258,15 +260,10 @@ class FisheyeCorrection:
         fps = int(video.get(5))
 
         fourcc = cv2.VideoWriter_fourcc(*'MP4V')
-        videowriter = cv2.VideoWriter(save_path, fourcc, fps, (width, height), False)
-
-        while True:
-            ret, frame = video.read()
-
-            if not ret: break
-
-            gray = cv2.cvtColor(frame.astype(np.uint8), cv2.COLOR_BGR2GRAY)
+        videowriter = ThreadedVideoWriter(cv2.VideoWriter(save_path, fourcc, fps, (width, height), False))
 
+        reader = ThreadedVideoReader(video, grayscale=True)
+        for gray in reader:
             undistorted = cv2.remap(gray, self.maps[:, :, 0:2], self.maps[:, :, 2],
                                     interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
 
@@ -276,6 +273,7 @@ class FisheyeCorrection:
                 break
 
             videowriter.write(undistorted)
+        reader.release()
         videowriter.release()
         print('Done')
             
@@ -11,6 +11,7 @@ from functools import partial
 
 from Utilities.file_io.files_load_save import *
 from Utilities.video_and_plotting.video_editing import Editor
+from Utilities.video_and_plotting.video_threads import ThreadedVideoReader, ThreadedVideoWriter
 
 from Plotting.utils.plotting_utils import *
 # from Utilities.video_and_plotting.video_plotting_toolbox import *
@@ -181,8 +182,8 @@ class TrialClipsMaker(Editor):
 
         # overview video params
         overview_video_path = self.rec_paths.overview_video.values[0]
+        self.overview_params = vparams(*self.get_video_params(overview_video_path))
         self.overview_cap = cv2.VideoCapture(overview_video_path)
-        self.overview_params = vparams(*self.get_video_params(self.overview_cap))
 
         if self.overview_params.nframes == 0: return False
 
@@ -194,8 +195,8 @@ class TrialClipsMaker(Editor):
                 self.add_threat_video = False
                 self.frame_shape = [int(self.overview_params.height), int(self.overview_params.width)]
             else:
+                self.threat_params = vparams(*self.get_video_params(threat_video_path))
                 self.threat_cap = cv2.VideoCapture(threat_video_path)
-                self.threat_params = vparams(*self.get_video_params(self.threat_cap))
 
                 if self.threat_params.fps < 1:    # ? smth went wrong when opening the threat cap - likely video has no frames
                     self.add_threat_video = False
@@ -211,10 +212,10 @@ class TrialClipsMaker(Editor):
             self.frame_shape = [int(self.overview_params.height), int(self.overview_params.width)]
 
         # open the opencv writer
-        self.writer = self.open_cvwriter(self.video_savepath, 
+        self.writer = ThreadedVideoWriter(self.open_cvwriter(self.video_savepath, 
                                         w=self.frame_shape[1]+self.video_decoration_params['border_size']*2,
                                         h=self.frame_shape[0]+self.video_decoration_params['border_size']*2,
-                                        framerate = int(self.overview_params.fps), iscolor=True)
+                                        framerate = int(self.overview_params.fps), iscolor=True))
 
         return True
 
@@ -278,13 +279,11 @@ class TrialClipsMaker(Editor):
             clip_end = int(stim.overview_frame + (stim.duration*self.overview_params.fps) + self.video_decoration_params['post_stim_interval']*self.overview_params.fps)
             clip_number_of_frames = int(clip_end - clip_start)
 
-            # move overview cap to the frame at the start of this clip
-            _ = self.get_selected_frame(self.overview_cap, clip_start-1)
+            # read the overview frames for this clip on a separate thread
+            reader = ThreadedVideoReader(self.overview_cap, start_frame=clip_start, stop_frame=clip_end)
 
             # Keep reading frames until within post stim
-            for frame_counter in range(clip_number_of_frames):
-                ret, frame = self.overview_cap.read()
-                if not ret: break
+            for frame_counter, frame in enumerate(reader):
                 frame_number = clip_start + frame_counter  # 
 
                 # Get the threat video frame
@@ -346,6 +345,8 @@ class TrialClipsMaker(Editor):
                 # Save to file
                 self.writer.write(frame)
 
+        self.writer.release()
+
 
 
 if __name__ == "__main__":
@@ -19,6 +19,10 @@ import matplotlib.pyplot as plt
 import time
 
 from Utilities.file_io.files_load_save import *
+from Utilities.video_and_plotting.video_pipeline import VideoPipeline, Crop, Rotate, Resize, Brighten, Fisheye, FrameRange
+from Utilities.video_and_plotting.video_threads import ThreadedVideoReader, ThreadedVideoWriter
+from Utilities.video_and_plotting.video_tiling import VideoTiler
+from Utilities.video_and_plotting.video_metadata import get_video_metadata_index
 
 
 paths_file = 'paths.yml'
@@ -81,18 +85,13 @@ class VideoConverter:
         width, height = int(cap.get(3)), int(cap.get(4))
         fourcc = cv2.VideoWriter_fourcc(*'mp4v')
 
-        videowriter = cv2.VideoWriter(savepath, fourcc, fps, (width , height ), False)
+        videowriter = ThreadedVideoWriter(cv2.VideoWriter(savepath, fourcc, fps, (width , height ), False))
         print('Converting video: ', videopath)
-        framen = 0
-        while True:
+        for framen, gray in enumerate(ThreadedVideoReader(cap, grayscale=True)):
             if framen % 1000 == 0: print('Frame: ', framen)
-            framen += 1
-            ret, frame = cap.read()
-            if not ret:
-                break
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
             videowriter.write(gray)
         videowriter.release()
+        cap.release()
 
     @staticmethod
     def extract_framesize_from_metadata(videotdms):
@@ -152,8 +151,8 @@ class VideoConverter:
             else:
                 vidname = '{}__{}.mp4'.format(vidname, limits[0])
             fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            videowriter = cv2.VideoWriter(os.path.join(self.folder, vidname), fourcc,
-                                            framerate, (w, h), iscolor)
+            videowriter = ThreadedVideoWriter(cv2.VideoWriter(os.path.join(self.folder, vidname), fourcc,
+                                            framerate, (w, h), iscolor))
 
             for framen in tqdm(range(limits[0], limits[1]+1)):
                 videowriter.write(data[framen])
@@ -279,42 +278,25 @@ class Editor:
             start_frame {[type]} -- [video frame to stat at ] (default: {None})
             end_frame {[type]} -- [videoframe to stop at ] (default: {None})
             selfpd {[int]}(default, None) -- [specify the fps of the output]
-            lighten --> make the video a bit brighter
+            lighten --> has no effect, kept so that existing calls still work
         """
 
-        # Open reader and writer
-        cap = cv2.VideoCapture(videopath)
-        nframes, width, height, fps  = self.get_video_params(cap)
-    
+        nframes, width, height, fps  = self.get_video_params(videopath)
         if sel_fps is not None:
             fps = sel_fps
-        writer = self.open_cvwriter(savepath, w=width, h=height, framerate=int(fps), format='.mp4', iscolor=False)
 
         # if in proportion mode get start and stop mode
         if not frame_mode:
             start_frame = int(round(nframes*start))
             stop_frame = int(round(nframes*stop))
-        
-        # Loop over frames and save the ones that matter
-        print('Processing: ', videopath)
-        cur_frame = 0
-        cap.set(1,start_frame)
-        while True:
-            cur_frame += 1
-            if cur_frame % 100 == 0: print('Current frame: ', cur_frame)
-            if cur_frame <= start_frame: continue
-            elif cur_frame >= stop_frame: break
-            else:
-                
-                ret, frame = cap.read()
-                if not ret: break
-                else:
-                    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 
-                    if lighten:
-                        a = 1
-                    writer.write(frame)
-        writer.release()
+        # ? lighten was never applied to the saved frames, use brighten_video to make a clip brighter
+        transforms = [FrameRange(start_frame, stop_frame)]
+
+        print('Processing: ', videopath)
+        pipeline = VideoPipeline(videopath)
+        pipeline.add_sink(savepath, *transforms, framerate=int(fps))
+        pipeline.run()
 
 
     def split_clip(self, clip, number_of_clips=4, dest_fld=None):
@@ -332,58 +314,37 @@ class Editor:
         name, ext = name.split('.')
         if dest_fld is None: dest_fld = fld
 
-        cap = cv2.VideoCapture(clip)
-        nframes, width, height, fps  = self.get_video_params(cap)
+        nframes, width, height, fps  = self.get_video_params(clip)
 
         frames_array = np.linspace(0, nframes, nframes+1)
         clips_frames = np.array_split(frames_array, number_of_clips)
 
-        for i, clip in enumerate(clips_frames):
-            
-            start, end = clip[0], clip[-1]
+        # ? all the subclips are written from a single pass over the video
+        pipeline = VideoPipeline(clip)
+        for i, clip_frames in enumerate(clips_frames):
+            start, end = clip_frames[0], clip_frames[-1]
             print('Clip {} of {}, frame range: {}-{}'.format(i, number_of_clips, start, end))
             if i == 0: 
                 print(' ... skipping the first clip')
                 continue
-            cap.set(1,start)
-            
+
             savename = os.path.join(dest_fld, name+'_clip{}.'.format(i)+ext)
-            writer = self.open_cvwriter(savename, w=width, h=height, framerate=fps, iscolor=False)
-
-            counter = start
-            while counter <= end:
-                counter += 1
-                ret, frame = cap.read()
-                if not ret: 
-                    writer.release()
-                    return
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                writer.write(gray)
-            writer.release()
-        cap.release()
+            pipeline.add_sink(savename, FrameRange(start, end+1))
+        pipeline.run()
 
-    def tile_clips(self, clips_l, savepath):
-        """[Tiles multiple videos horizzontally. It assumes that all videos have the same width and height]
+    def tile_clips(self, clips_l, savepath, nrows=1, ncols=None):
+        """[Tiles multiple videos in a grid, by default horizzontally. Videos with a different size from
+            the first one are resized to match it. Stops at the end of the shortest video]
         
         Arguments:
             clips_l {[list]} -- [list of paths to the videos to be tiled]
             savepath {[type]} -- [complete filepath of the video to be saved]
-        """
-        caps = [ cv2.VideoCapture(videofilepath) for videofilepath in clips_l]
 
-        nframes, width, height, fps = self.get_video_params(caps[0])
-        width *= len(caps)
-        writer = self.open_cvwriter(savepath, w=width, h=height, framerate=fps, iscolor=True)
-
-        while True:
-            try:
-                frames = [cap.read()[1] for cap in caps]
-            except:
-                break
-            else:
-                tot_frame = np.hstack(frames)
-                writer.write(tot_frame)
-        writer.release()
+        Keyword Arguments:
+            nrows {int} -- [number of rows of the grid] (default: {1})
+            ncols {[int]} -- [number of columns of the grid, if None all videos are fitted in nrows] (default: {None})
+        """
+        return VideoTiler(clips_l, nrows=nrows, ncols=ncols).run(savepath)
 
     @staticmethod
     def opencv_write_clip(videopath, frames_data, w=None, h=None, framerate=None, start=None, stop=None,
@@ -400,7 +361,7 @@ class Editor:
         if framerate is None: raise ValueError('No frame rate parameter was given as an input')
 
         fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        videowriter = cv2.VideoWriter(videopath, fourcc, framerate, (w, h), iscolor)
+        videowriter = ThreadedVideoWriter(cv2.VideoWriter(videopath, fourcc, framerate, (w, h), iscolor))
 
         for framen in tqdm(range(start, stop)):
             frame = np.array(frames_data[:, :, framen], dtype=np.uint8).T
@@ -424,8 +385,9 @@ class Editor:
 
     @staticmethod
     def get_video_params(cap):
+        # ? if given a path, look up the video in the metadata index instead of opening it
         if isinstance(cap, str):
-            cap = cv2.VideoCapture(cap)
+            return get_video_metadata_index().get_video_params(cap)
             
         nframes = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
@@ -447,14 +409,9 @@ class Editor:
                 cap = cv2.VideoCapture(os.path.join(fld, vid))
                 nframes, width, height, fps = self.get_video_params(cap)
                 all_frames_count += nframes
-                framecounter = 0
-                while True:
-                    framecounter += 1
-                    ret, frame = cap.read()
-                    if not ret: break
-                    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                for gray in ThreadedVideoReader(cap, grayscale=True):
                     writer.write(gray)
-            cap.release()
+                cap.release()
             writer.release()
 
             # Re open joined clip and check if total number of frames is correct
@@ -495,7 +452,7 @@ class Editor:
             cap = cv2.VideoCapture(os.path.join(fld, matches[0]))
             nframes, width, height, fps = self.get_video_params(cap)
             dest = os.path.join(fld, tdmsname+'__joined.mp4')
-            writer = self.open_cvwriter(dest, w=width, h=height, framerate=int(fps), format='.mp4', iscolor=False)
+            writer = ThreadedVideoWriter(self.open_cvwriter(dest, w=width, h=height, framerate=int(fps), format='.mp4', iscolor=False))
 
             # Add to writers store
             writers_store[tdmsname] = (dest, matches, writer)
@@ -527,34 +484,16 @@ class Editor:
         '''
             takes the path to a video, opens it as opecv Cap and resizes to compress factor [0-1] and saves it
         '''
-        cap = cv2.VideoCapture(videopath)
-        nframes, width, height, fps = self.get_video_params(cap)
-
-        resized_width = int(np.ceil(width*compress_factor))
-        resized_height = int(np.ceil(height*compress_factor))
-
         if save_path is None:
             save_name = os.path.split(videopath)[-1].split('.')[0] + '_compressed' + '.mp4'
-            save_path = os.path.split(videopath)
-            save_path = os.path.join(list(save_path))
+            save_path = os.path.join(os.path.split(videopath)[0], save_name)
 
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        videowriter = self.open_cvwriter(save_path, w=resized_width, h=resized_height, framerate=fps, format='.mp4', iscolor=False)
-        framen = 0
-        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
-        while True:       
-            ret, frame = cap.read()
-            if not ret: break
-
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            resized = cv2.resize(gray, (resized_width, resized_height)) 
-            videowriter.write(resized)
-            framen += 1
+        # ? stop_frame is the number of frames to write after start_frame
+        if stop_frame is not None: stop_frame = start_frame + stop_frame
 
-            if stop_frame is not None:
-                if framen >= stop_frame: break
-
-        videowriter.release()
+        pipeline = VideoPipeline(videopath)
+        pipeline.add_sink(save_path, FrameRange(start_frame, stop_frame), Resize(compress_factor))
+        pipeline.run()
     
     def mirros_cropper(self, v, fld):
         """mirros_cropper [takes a video and saves 3 cropped versions of it with different views]
@@ -579,47 +518,20 @@ class Editor:
         finfld = os.listdir(fld)
         names = [os.path.split(main_name)[-1], os.path.split(side_name)[-1], os.path.split(top_name)[-1]]
         matched = [n for n in names if n in finfld]
-        if not matched:
-            # Open opencv reader and writers
-            cap = cv2.VideoCapture(v)
-            main_writer = self.open_cvwriter(filepath=main_name, w=main.x1, h=main.y1, framerate=30)
-            side_writer = self.open_cvwriter(filepath=side_name, h=side.x1, w=side.y1, framerate=30)
-            top_writer = self.open_cvwriter(filepath=top_name, w=top.x1, h=top.y1, framerate=30)
-            writers = [main_writer, side_writer, top_writer]
-        elif len(matched) != len(names):
-            raise FileNotFoundError('Found these videos in destination folder which would be overwritten: ', matched)
-        else:
+        if len(matched) == len(names):
             # all videos already exist in destination folder, no need to do anything
             print('  cropped videos alrady exist in destination folder: ', names)
             return main_name, side_name, top_name
+        elif matched:
+            raise FileNotFoundError('Found these videos in destination folder which would be overwritten: ', matched)
 
-        while True:
-            ret, frame = cap.read()
-            if not ret: break
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-            main_frame = frame[main.y0:main.y0+main.y1, main.x0:main.x0+main.x1]
-            side_frame = frame[side.y0:side.y0+side.y1, side.x0:side.x0+side.x1]
-
-            print(side_frame.shape)
-            side_frame = np.rot90(side_frame, 1)
-            print(side_frame.shape)
-
-            top_frame = frame[top.y0:top.y0+top.y1, top.x0:top.x0+top.x1]
-
-            cv2.imshow('main', main_frame)
-            cv2.imshow('side', side_frame)
-            cv2.imshow('top', top_frame)
-
-            main_writer.write(main_frame)
-            side_writer.write(side_frame)
-            top_writer.write(top_frame)
+        # Decode the video once and write the three views
+        pipeline = VideoPipeline(v)
+        pipeline.add_sink(main_name, Crop(main.x0, main.y0, main.x1, main.y1), framerate=30)
+        pipeline.add_sink(side_name, Crop(side.x0, side.y0, side.x1, side.y1), Rotate(1), framerate=30)
+        pipeline.add_sink(top_name, Crop(top.x0, top.y0, top.x1, top.y1), framerate=30)
+        pipeline.run()
 
-            cv2.waitKey(1)
-        
-        for wr in writers:
-            wr.release()
-        
         return main_name, side_name, top_name
 
     @staticmethod
@@ -720,27 +632,13 @@ class Editor:
                         raise ValueError('Could not display frame ', show_frame)
 
     def crop_video(self, videopath, x, y):
-        cap = cv2.VideoCapture(videopath)
-        nframes, width, height, fps = self.get_video_params(cap)
-
         path, name = os.path.split(videopath)
         name, ext = name.split(".")
         savename = os.path.join(path, name +"_cropped.mp4")
 
-        writer = self.open_cvwriter(savename, w=x, h=y, framerate=fps, format='.mp4', iscolor=True)
-
-
-        while True:
-            ret, frame = cap.read()
-            if not ret: break
-
-            cropped = frame[:y, :x, :]
-
-            # cv2.imshow("frame", cropped)
-            # cv2.waitKey(1)
-
-            writer.write(cropped)
-        writer.release()
+        pipeline = VideoPipeline(videopath)
+        pipeline.add_sink(savename, Crop(0, 0, x, y), iscolor=True)
+        pipeline.run()
 
     def concatenate_videos(self, videos):
         """[takes a list of paths as argument]
@@ -755,34 +653,30 @@ class Editor:
         name, ext = name.split(".")
         savename = os.path.join(path, name +"_concatenated.mp4")
 
-        writer = self.open_cvwriter(savename, w=width, h=height, framerate=fps, format='.mp4', iscolor=True)
+        writer = ThreadedVideoWriter(self.open_cvwriter(savename, w=width, h=height, framerate=fps, format='.mp4', iscolor=True))
 
         for video in videos:
-            cap = cv2.VideoCapture(video)
-            while True:
-                ret, frame = cap.read()
-                if not ret: break
-
+            for frame in ThreadedVideoReader(video):
                 writer.write(frame)
         writer.release()
 
     def brighten_video(self, videopath, save_path, add_value=100):
-        cap = cv2.VideoCapture(videopath)
-        nframes, width, height, fps = self.get_video_params(cap)
-
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        videowriter = self.open_cvwriter(save_path, w=width, h=height, framerate=fps, format='.mp4', iscolor=False)
-
-        while True:       
-            ret, frame = cap.read()
-            if not ret: break
-
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        pipeline = VideoPipeline(videopath)
+        pipeline.add_sink(save_path, Brighten(add_value))
+        pipeline.run()
 
-            gray = np.add(gray, add_value)
-            gray[gray>255] + 255
-            videowriter.write(gray)
-        videowriter.release()
+    @staticmethod
+    def make_derivatives(videopath, sinks):
+        """[Decodes videopath once and writes several derived videos from it]
+        
+        Arguments:
+            videopath {[str]} -- [video to process]
+            sinks {[dict]} -- [dictionary of savepath:list of transforms, e.g. {'compressed.mp4':[Resize(.5)]}]
+        """
+        pipeline = VideoPipeline(videopath)
+        for savepath, transforms in sinks.items():
+            pipeline.add_sink(savepath, *transforms)
+        return pipeline.run()
 
     @staticmethod
     def get_selected_frame(cap, show_frame):
@@ -0,0 +1,201 @@
+import sys
+sys.path.append('./')
+
+try: import cv2
+except: pass
+import os
+import atexit
+import subprocess
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+from multiprocessing.dummy import Pool as ThreadPool
+from functools import partial
+
+from Utilities.file_io.files_load_save import load_yaml, save_df, load_df
+
+
+"""
+    Persistent index of the metadata of converted videos (number of frames, size, fps...).
+    Opening a cv2.VideoCapture on a video on winstor just to read its parameters is slow, so the
+    parameters are stored in a dataframe saved at paths.yml['video_metadata_index'] and keyed by
+    path + modification time + size: if a video is overwritten its entry is recomputed.
+    Videos that are missing or that can't be read get a zero entry (as Editor.get_video_params) that isn't indexed.
+
+    New entries are only written to disk by scan() and save() (the shared index is also saved when the process exits).
+    Saving merges the entries with the ones other processes saved in the meantime and replaces the file atomically.
+
+    Usage:
+        index = VideoMetadataIndex()
+        index.scan(list_of_videos, n_processes=8) # populate in bulk
+        nframes, width, height, fps = index.get_video_params(videopath)
+        index.save() # write the entries added by get_video_params
+"""
+
+video_params = namedtuple("video_params", "nframes width height fps")
+
+paths_file = 'paths.yml'
+
+
+class VideoMetadataIndex:
+    columns = ['videopath', 'mtime', 'size', 'nframes', 'width', 'height', 'fps', 'codec', 'duration', 'n_keyframes']
+
+    def __init__(self, index_file=None):
+        """[Loads the index from index_file, if None the path in paths.yml is used. If there's no path
+            in paths.yml the index is only kept in memory]
+        """
+        if index_file is None:
+            try:
+                index_file = load_yaml(paths_file).get('video_metadata_index', None)
+            except:
+                index_file = None
+        self.index_file = index_file
+
+        if self.index_file is not None and os.path.isfile(self.index_file):
+            self.data = load_df(self.index_file)
+        else:
+            self.data = pd.DataFrame(columns=self.columns)
+        self.data.index = self.data.videopath.values
+        self.new_entries = set() # ? videos indexed since the last save
+
+    # ------------------------------- Probe videos ------------------------------- #
+    @staticmethod
+    def get_file_stamp(videopath):
+        stat = os.stat(videopath)
+        return stat.st_mtime, stat.st_size
+
+    @staticmethod
+    def count_keyframes(videopath):
+        """[Counts the keyframes in a video with ffprobe, returns -1 if ffprobe is not available]
+        """
+        command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-skip_frame', 'nokey',
+                    '-show_entries', 'frame=pkt_pts_time', '-of', 'csv=p=0', videopath]
+        try:
+            output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+        except:
+            return -1
+        return len([l for l in output.decode().splitlines() if l.strip()])
+
+    @staticmethod
+    def get_empty_entry(videopath):
+        return dict(videopath=videopath, mtime=np.nan, size=0, nframes=0, width=0, height=0,
+                    fps=0., codec='', duration=0, n_keyframes=-1)
+
+    @staticmethod
+    def probe_video(videopath, count_keyframes=False):
+        """[Opens the video and returns a dictionary with its metadata, all zeros if the video is missing]
+        """
+        try:
+            mtime, size = VideoMetadataIndex.get_file_stamp(videopath)
+        except FileNotFoundError:
+            return VideoMetadataIndex.get_empty_entry(videopath)
+
+        cap = cv2.VideoCapture(videopath)
+        nframes = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps    = cap.get(cv2.CAP_PROP_FPS)
+        fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+        cap.release()
+
+        codec = "".join([chr((fourcc >> 8 * i) & 0xFF) for i in range(4)]).strip('\x00')
+        if fps > 0: duration = nframes/fps
+        else: duration = 0
+
+        if count_keyframes: n_keyframes = VideoMetadataIndex.count_keyframes(videopath)
+        else: n_keyframes = -1
+
+        return dict(videopath=videopath, mtime=mtime, size=size, nframes=nframes, width=width, height=height,
+                    fps=fps, codec=codec, duration=duration, n_keyframes=n_keyframes)
+
+    # ------------------------------- Index lookup ------------------------------- #
+    def is_up_to_date(self, videopath):
+        if videopath not in self.data.index: return False
+        try:
+            mtime, size = self.get_file_stamp(videopath)
+        except FileNotFoundError:
+            return False
+        entry = self.data.loc[videopath]
+        return entry['mtime'] == mtime and entry['size'] == size
+
+    def add_entries(self, entries):
+        # ? missing or unreadable videos are not indexed, they might be there (or finished writing) later
+        entries = [e for e in entries if e['nframes'] > 0]
+        if not entries: return
+        entries = pd.DataFrame(entries, columns=self.columns)
+        entries.index = entries.videopath.values
+        self.data = pd.concat([self.data.drop(entries.index, errors='ignore'), entries])
+        self.new_entries.update(entries.index)
+
+    def get(self, videopath, save=False):
+        """[Returns the metadata of a video as a pd.Series, probing the video only if it's not in the index.
+            New entries are saved with the next call to save() unless save is True]
+        """
+        if self.is_up_to_date(videopath):
+            return self.data.loc[videopath]
+
+        entry = self.probe_video(videopath)
+        self.add_entries([entry])
+        if save: self.save()
+        return pd.Series(entry)
+
+    def get_video_params(self, videopath):
+        """[Same output as Editor.get_video_params: nframes, width, height, fps]
+        """
+        entry = self.get(videopath)
+        return video_params(int(entry['nframes']), int(entry['width']), int(entry['height']), float(entry['fps']))
+
+    def scan(self, videos, n_processes=8, count_keyframes=False, save=True):
+        """[Probes in parallel all the videos that are not in the index or that changed since they were indexed]
+
+        Arguments:
+            videos {[list, str]} -- [list of paths to videos or path to a folder with videos]
+
+        Keyword Arguments:
+            n_processes {int} -- [number of threads opening videos in parallel] (default: {8})
+            count_keyframes {bool} -- [count keyframes with ffprobe, slow] (default: {False})
+        """
+        if isinstance(videos, str):
+            videos = [os.path.join(videos, f) for f in os.listdir(videos)
+                            if os.path.splitext(f)[-1].lower() in ['.mp4', '.avi', '.mov']]
+        to_probe = [v for v in videos if os.path.isfile(v) and not self.is_up_to_date(v)]
+        print('Indexing {} videos, {} already in index'.format(len(to_probe), len(videos)-len(to_probe)))
+        if not to_probe: return self.data
+
+        pool = ThreadPool(n_processes)
+        try:
+            entries = pool.map(partial(self.probe_video, count_keyframes=count_keyframes), to_probe)
+        finally:
+            pool.close()
+
+        self.add_entries(entries)
+        if save: self.save()
+        return self.data
+
+    def save(self):
+        """[Writes the new entries to index_file, merged with the entries saved there by other processes]
+        """
+        if self.index_file is None or not self.new_entries: return
+
+        if os.path.isfile(self.index_file):
+            on_disk = load_df(self.index_file)
+            on_disk.index = on_disk.videopath.values
+            new = self.data.loc[sorted(self.new_entries)]
+            self.data = pd.concat([on_disk.drop(new.index, errors='ignore'), new])
+
+        # ? write to a temporary file and replace the index, so that readers never see a partially written file
+        tmp_file = '{}.{}.tmp'.format(self.index_file, os.getpid())
+        save_df(self.data.reset_index(drop=True), tmp_file)
+        os.replace(tmp_file, self.index_file)
+        self.new_entries = set()
+
+
+# ? Index shared by all the callers of get_video_params in this process
+_index = None
+
+def get_video_metadata_index():
+    global _index
+    if _index is None:
+        _index = VideoMetadataIndex()
+        atexit.register(_index.save)
+    return _index
@@ -0,0 +1,237 @@
+import sys
+sys.path.append('./')
+
+try: import cv2
+except: pass
+import numpy as np
+
+from Utilities.video_and_plotting.video_threads import ThreadedVideoReader, ThreadedVideoWriter
+
+"""
+    Single-decode video pipeline: one cv2.VideoCapture reads the source video once and
+    each frame is fanned out to several sinks. Each sink applies its own chain of transforms
+    (crop, resize, brighten, fisheye correction, frame range...) and writes to its own file.
+
+    Usage:
+        pipeline = VideoPipeline(videopath)
+        pipeline.add_sink(savepath_compressed, Resize(.5))
+        pipeline.add_sink(savepath_crop, Crop(320, 250, 805, 300))
+        pipeline.run()
+"""
+
+# ---------------------------------------------------------------------------- #
+#                                  TRANSFORMS                                  #
+# ---------------------------------------------------------------------------- #
+"""
+    Each transform is called as transform(frame, framen) and returns the transformed frame
+    or None if the frame should not be written by the sink.
+    transform.output_size(w, h) returns the (w, h) of the frames it returns, it's used to
+    open the video writers with the correct size before any frame is decoded.
+"""
+
+class Crop:
+    def __init__(self, x0, y0, width, height):
+        """[Crops a rectangle of size width x height with the top left corner at x0, y0]
+        """
+        self.x0, self.y0 = int(x0), int(y0)
+        self.width, self.height = int(width), int(height)
+
+    def __call__(self, frame, framen):
+        return frame[self.y0:self.y0+self.height, self.x0:self.x0+self.width]
+
+    def output_size(self, w, h):
+        return min(self.width, w-self.x0), min(self.height, h-self.y0)
+
+
+class Rotate:
+    def __init__(self, k=1):
+        """[Rotates the frame by k*90 degrees counterclockwise]
+        """
+        self.k = k
+
+    def __call__(self, frame, framen):
+        return np.ascontiguousarray(np.rot90(frame, self.k))
+
+    def output_size(self, w, h):
+        if self.k % 2: return h, w
+        else: return w, h
+
+
+class Resize:
+    def __init__(self, factor):
+        """[Resizes the frame by factor [0-1] to compress the video]
+        """
+        self.factor = factor
+
+    def __call__(self, frame, framen):
+        h, w = frame.shape[:2]
+        return cv2.resize(frame, self.output_size(w, h))
+
+    def output_size(self, w, h):
+        return int(np.ceil(w*self.factor)), int(np.ceil(h*self.factor))
+
+
+class Brighten:
+    def __init__(self, add_value=100):
+        """[Adds add_value to each pixel, saturating at 255]
+        """
+        self.add_value = add_value
+
+    def __call__(self, frame, framen):
+        return cv2.add(frame, np.full_like(frame, self.add_value))
+
+    def output_size(self, w, h):
+        return w, h
+
+
+class Fisheye:
+    def __init__(self, maps):
+        """[Corrects fisheye distortions with the maps computed by FisheyeCorrection]
+
+        Arguments:
+            maps {[np.ndarray, FisheyeCorrection]} -- [HxWx3 maps array or FisheyeCorrection instance with maps loaded]
+        """
+        if not isinstance(maps, np.ndarray):
+            if maps.maps is None: maps.load_maps()
+            maps = maps.maps
+        self.map1, self.map2 = maps[:, :, 0:2], maps[:, :, 2]
+
+    def __call__(self, frame, framen):
+        return cv2.remap(frame, self.map1, self.map2, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+
+    def output_size(self, w, h):
+        return self.map2.shape[1], self.map2.shape[0]
+
+
+class FrameRange:
+    def __init__(self, start_frame=0, stop_frame=None):
+        """[Only lets through frames with start_frame <= framen < stop_frame]
+        """
+        self.start_frame = int(start_frame)
+        if stop_frame is not None: stop_frame = int(stop_frame)
+        self.stop_frame = stop_frame
+
+    def __call__(self, frame, framen):
+        if framen < self.start_frame: return None
+        if self.stop_frame is not None and framen >= self.stop_frame: return None
+        return frame
+
+    def output_size(self, w, h):
+        return w, h
+
+
+# ---------------------------------------------------------------------------- #
+#                                    PIPELINE                                  #
+# ---------------------------------------------------------------------------- #
+
+class VideoSink:
+    def __init__(self, savepath, transforms, iscolor=False, framerate=None, format='.mp4'):
+        """[Chain of transforms + video writer fed by a VideoPipeline]
+
+        Arguments:
+            savepath {[str]} -- [path of the video to be saved]
+            transforms {[list]} -- [list of transforms, applied in order]
+
+        Keyword Arguments:
+            iscolor {bool} -- [if False the sink is fed grayscale frames] (default: {False})
+            framerate {[float]} -- [fps of the output video, if None the source's is used] (default: {None})
+        """
+        self.savepath = savepath
+        self.transforms = list(transforms)
+        self.iscolor = iscolor
+        self.framerate = framerate
+        self.format = format
+        self.writer = None
+        self.frames_written = 0
+
+        # The sink is done once all the frames in its range have been decoded
+        ranges = [t for t in self.transforms if isinstance(t, FrameRange)]
+        self.start_frame = max([r.start_frame for r in ranges], default=0)
+        stops = [r.stop_frame for r in ranges if r.stop_frame is not None]
+        self.stop_frame = min(stops) if stops else None
+
+    def output_size(self, w, h):
+        for t in self.transforms:
+            w, h = t.output_size(w, h)
+        return int(w), int(h)
+
+    def open(self, w, h, fps):
+        from Utilities.video_and_plotting.video_editing import Editor
+
+        if self.framerate is not None: fps = self.framerate
+        w, h = self.output_size(w, h)
+        self.writer = ThreadedVideoWriter(Editor.open_cvwriter(self.savepath, w=w, h=h, framerate=fps, 
+                                                format=self.format, iscolor=self.iscolor))
+
+    def is_done(self, framen):
+        return self.stop_frame is not None and framen >= self.stop_frame
+
+    def process(self, frame, framen):
+        for t in self.transforms:
+            frame = t(frame, framen)
+            if frame is None: return
+        self.writer.write(frame)
+        self.frames_written += 1
+
+    def release(self):
+        if self.writer is not None:
+            self.writer.release()
+
+
+class VideoPipeline:
+    def __init__(self, videopath):
+        """[Decodes videopath once and feeds each frame to all the sinks added with add_sink]
+        """
+        self.videopath = videopath
+        self.sinks = []
+
+    def add_sink(self, savepath, *transforms, iscolor=False, framerate=None, format='.mp4'):
+        sink = VideoSink(savepath, transforms, iscolor=iscolor, framerate=framerate, format=format)
+        self.sinks.append(sink)
+        return sink
+
+    def run(self):
+        """[Decode the video and write all the sinks, returns the number of frames decoded]
+        """
+        if not self.sinks: raise ValueError('No sinks were added to the pipeline')
+
+        cap = cv2.VideoCapture(self.videopath)
+        if not cap.isOpened():
+            raise FileNotFoundError('Could not open video: {}'.format(self.videopath))
+        width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps    = cap.get(cv2.CAP_PROP_FPS)
+
+        for sink in self.sinks:
+            sink.open(width, height, fps)
+
+        # Only decode the frames that the sinks need
+        framen = min([s.start_frame for s in self.sinks])
+        if any([s.stop_frame is None for s in self.sinks]): stop_frame = None
+        else: stop_frame = max([s.stop_frame for s in self.sinks])
+
+        # ? if no sink needs color, convert to grayscale on the decoding thread
+        need_color = any([s.iscolor for s in self.sinks])
+        need_gray = any([not s.iscolor for s in self.sinks])
+        reader = ThreadedVideoReader(cap, start_frame=framen, stop_frame=stop_frame, grayscale=not need_color)
+        n_decoded = 0
+        try:
+            for frame in reader:
+                # ? convert to grayscale once and share it among the sinks that need it
+                if need_color and need_gray:
+                    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                else:
+                    gray = frame
+
+                for sink in self.sinks:
+                    if sink.is_done(framen): continue
+                    if sink.iscolor: sink.process(frame, framen)
+                    else: sink.process(gray, framen)
+                framen += 1
+                n_decoded += 1
+        finally:
+            reader.release()
+            cap.release()
+            for sink in self.sinks:
+                sink.release()
+        return n_decoded
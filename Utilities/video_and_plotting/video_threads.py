@@ -0,0 +1,173 @@
+import sys
+sys.path.append('./')
+
+try: import cv2
+except: pass
+import threading
+from queue import Queue
+
+
+"""
+    Threaded wrappers around opencv's VideoCapture and VideoWriter.
+    Decoding and encoding each run on their own thread and exchange frames with the main thread
+    through bounded queues. OpenCV releases the GIL while decoding/encoding so reading, processing
+    and writing overlap and a transform runs at max(decode, encode) speed instead of their sum.
+
+    Usage:
+        reader = ThreadedVideoReader(videopath)
+        writer = ThreadedVideoWriter(Editor.open_cvwriter(savepath, ...))
+        for frame in reader:
+            writer.write(process(frame))
+        writer.release()
+"""
+
+_END = None  # ? sentinel marking the end of the stream in the queues
+
+
+class ThreadedVideoReader:
+    def __init__(self, video, start_frame=None, stop_frame=None, grayscale=False, queue_size=128):
+        """[Reads frames from a video on a background thread]
+
+        Arguments:
+            video {[str, cv2.VideoCapture]} -- [path to video or cap object. If a path is given the cap is released when done]
+
+        Keyword Arguments:
+            start_frame {[int]} -- [frame to start reading from, if None read from the current position] (default: {None})
+            stop_frame {[int]} -- [stop before this frame number] (default: {None})
+            grayscale {bool} -- [convert frames to grayscale on the reading thread] (default: {False})
+            queue_size {int} -- [max number of decoded frames waiting to be processed] (default: {128})
+        """
+        if isinstance(video, str):
+            self.cap = cv2.VideoCapture(video)
+            self.owns_cap = True
+        else:
+            self.cap = video
+            self.owns_cap = False
+
+        if not self.cap.isOpened():
+            raise FileNotFoundError('Could not open video: {}'.format(video))
+
+        if start_frame is not None:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+            self.framen = int(start_frame)
+        else:
+            self.framen = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+        if stop_frame is not None:
+            self.n_to_read = max(int(stop_frame) - self.framen, 0)
+        else:
+            self.n_to_read = None
+
+        self.grayscale = grayscale
+        self.queue = Queue(maxsize=queue_size)
+        self.stopped = threading.Event()
+        self.exception = None
+        self.finished = False
+
+        self.thread = threading.Thread(target=self._read, daemon=True)
+        self.thread.start()
+
+    def _read(self):
+        n_read = 0
+        try:
+            while not self.stopped.is_set():
+                if self.n_to_read is not None and n_read >= self.n_to_read: break
+                ret, frame = self.cap.read()
+                if not ret: break
+                if self.grayscale and frame.ndim == 3:
+                    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                self.queue.put(frame)
+                n_read += 1
+        except Exception as e:
+            self.exception = e
+        finally:
+            self.queue.put(_END)
+
+    def read(self):
+        """[Drop in replacement for cap.read(), returns ret, frame]
+        """
+        if self.finished: return False, None
+
+        frame = self.queue.get()
+        if frame is _END:
+            self.finished = True
+            self.thread.join()
+            if self.owns_cap: self.cap.release()
+            if self.exception is not None: raise self.exception
+            return False, None
+
+        self.framen += 1
+        return True, frame
+
+    def __iter__(self):
+        while True:
+            ret, frame = self.read()
+            if not ret: break
+            yield frame
+
+    def release(self):
+        """[Stops the reading thread and releases the cap if it was opened by the reader]
+        """
+        self.stopped.set()
+        # empty the queue so that the thread is not blocked on a full queue
+        while self.thread.is_alive():
+            while not self.queue.empty():
+                self.queue.get()
+            self.thread.join(timeout=.05)
+        self.finished = True
+        if self.owns_cap: self.cap.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class ThreadedVideoWriter:
+    def __init__(self, writer, queue_size=128):
+        """[Writes frames to a cv2.VideoWriter on a background thread]
+
+        Arguments:
+            writer {[cv2.VideoWriter]} -- [opened video writer, it's released when the ThreadedVideoWriter is released]
+
+        Keyword Arguments:
+            queue_size {int} -- [max number of frames waiting to be encoded] (default: {128})
+        """
+        self.writer = writer
+        self.queue = Queue(maxsize=queue_size)
+        self.exception = None
+        self.released = False
+
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def _write(self):
+        while True:
+            frame = self.queue.get()
+            if frame is _END: break
+            if self.exception is not None: continue  # ? keep emptying the queue so that write() doesn't block
+            try:
+                self.writer.write(frame)
+            except Exception as e:
+                self.exception = e
+
+    def write(self, frame):
+        if self.exception is not None: raise self.exception
+        # ? the frame is encoded later, so it must not be modified after it's been passed here
+        self.queue.put(frame)
+
+    def release(self):
+        """[Waits for all frames to be written and releases the writer]
+        """
+        if self.released: return
+        self.released = True
+        self.queue.put(_END)
+        self.thread.join()
+        self.writer.release()
+        if self.exception is not None: raise self.exception
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
@@ -0,0 +1,93 @@
+import sys
+sys.path.append('./')
+
+try: import cv2
+except: pass
+import numpy as np
+
+from Utilities.video_and_plotting.video_threads import ThreadedVideoReader, ThreadedVideoWriter
+
+
+class VideoTiler:
+    def __init__(self, clips_l, nrows=1, ncols=None, queue_size=64, writer_queue_size=8):
+        """[Tiles multiple videos in a nrows x ncols grid. Each video is read on its own thread and
+            its frames are copied into their slice of a preallocated output frame.
+            Tiling stops at the end of the shortest video.]
+
+        Arguments:
+            clips_l {[list]} -- [list of paths to the videos to be tiled, the grid is filled row by row]
+
+        Keyword Arguments:
+            nrows {int} -- [number of rows in the grid] (default: {1})
+            ncols {[int]} -- [number of columns, if None it's the number of columns needed to fit all the videos] (default: {None})
+            queue_size {int} -- [max number of frames buffered by each reader] (default: {64})
+            writer_queue_size {int} -- [max number of tiled frames waiting to be encoded] (default: {8})
+        """
+        if not clips_l: raise ValueError('No videos to tile')
+        if ncols is None: ncols = int(np.ceil(len(clips_l)/nrows))
+        if nrows*ncols < len(clips_l):
+            raise ValueError('Cannot fit {} videos in a {}x{} grid'.format(len(clips_l), nrows, ncols))
+
+        self.clips_l = clips_l
+        self.nrows, self.ncols = nrows, ncols
+        self.queue_size = queue_size
+        self.writer_queue_size = writer_queue_size
+
+    def get_tile_params(self, caps):
+        # ? all tiles have the size of the first video, the others are resized if they don't match
+        width  = int(caps[0].get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(caps[0].get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps    = caps[0].get(cv2.CAP_PROP_FPS)
+        return width, height, fps
+
+    def get_tile_slices(self, width, height):
+        slices = []
+        for i in range(len(self.clips_l)):
+            row, col = divmod(i, self.ncols)
+            slices.append((slice(row*height, (row+1)*height), slice(col*width, (col+1)*width)))
+        return slices
+
+    def run(self, savepath, framerate=None):
+        """[Writes the tiled video to savepath, returns the number of frames written]
+        """
+        from Utilities.video_and_plotting.video_editing import Editor
+
+        caps = [cv2.VideoCapture(videofilepath) for videofilepath in self.clips_l]
+        for cap, videofilepath in zip(caps, self.clips_l):
+            if not cap.isOpened(): raise FileNotFoundError('Could not open video: {}'.format(videofilepath))
+
+        width, height, fps = self.get_tile_params(caps)
+        if framerate is None: framerate = fps
+        slices = self.get_tile_slices(width, height)
+
+        # ? the writer encodes frames asynchronously, so the output frames are taken from a ring of
+        # ? preallocated buffers large enough that no buffer is reused while it's still queued
+        buffers = np.zeros((self.writer_queue_size+2, self.nrows*height, self.ncols*width, 3), dtype=np.uint8)
+
+        writer = ThreadedVideoWriter(Editor.open_cvwriter(savepath, w=self.ncols*width, h=self.nrows*height,
+                                            framerate=framerate, iscolor=True), queue_size=self.writer_queue_size)
+        readers = [ThreadedVideoReader(cap, queue_size=self.queue_size) for cap in caps]
+
+        framen = 0
+        try:
+            while True:
+                tot_frame = buffers[framen % len(buffers)]
+                for reader, (rows, cols) in zip(readers, slices):
+                    ret, frame = reader.read()
+                    if not ret: break
+
+                    if frame.shape[0] != height or frame.shape[1] != width:
+                        frame = cv2.resize(frame, (width, height))
+                    if frame.ndim == 2: frame = frame[:, :, None]
+                    tot_frame[rows, cols] = frame
+                else:
+                    writer.write(tot_frame)
+                    framen += 1
+                    continue
+                break  # ? the shortest video is over
+        finally:
+            for reader, cap in zip(readers, caps):
+                reader.release()
+                cap.release()
+            writer.release()
+        return framen
@@ -170,6 +170,14 @@ class PopulateDatabase:
                     pass
                     # print("couldnt get dbase progress for: {} \n\n{}".format(table, e))
 
+    def cache_pose_files(self, n_processes=4):
+        """
+            Parse all the DLC pose files in the pose folder into the compact cached arrays used by TrackingData.make
+        """
+        from Processing.tracking_stats.pose_loader import cache_poses
+        pose_files = [os.path.join(self.raw_pose_folder, f) for f in os.listdir(self.raw_pose_folder) if '_pose' in f and '.h5' in f]
+        cache_poses(pose_files, TrackingData.bodyparts, n_processes=n_processes)
+
     def delete_placeholders_from_stim_table(self):
         (self.stimuli & "duration=-1").delete_quick()
 
@@ -341,6 +349,7 @@ if __name__ == '__main__':
     # p.ccm.populate(display_progress=True)  # ! ccm
 
     # ? this is considerably slower but should be automated
+    # p.cache_pose_files()
     # errors = p.trackingdata.populate(display_progress=True, suppress_errors=False, return_exception_objects =True) # ! tracking data
 
     errors = p.stimuli.populate(display_progress=True, suppress_errors=False, return_exception_objects=True) # , max_calls =10)  # ! stimuli
@@ -13,6 +13,9 @@ from Utilities.maths.stimuli_detection import *
 from Utilities.dbase.stim_times_loader import *
 
 from Processing.tracking_stats.correct_tracking import correct_tracking_data
+from Processing.tracking_stats.pose_loader import load_pose
+from database.compact_tracking import compact_entry, bodypart_blobs, segment_blobs, trial_blobs, shelter_distance_blobs
+from database.exploration_stats import summarise_recording, get_session_summaries, get_exploration_start, combine_summaries
 
 
 
@@ -540,6 +543,32 @@ def make_visual_stimuli_metadata(table):
 # !--------------------------------------------------------------------------- #
 #   !                             TRACKING DATA                                #
 # !--------------------------------------------------------------------------- #
+def get_shelter_distances(table, key, xy):
+	"""[Geodesic and euclidean distance from the shelter at each frame]
+
+	Arguments:
+		table {[TrackingData]} -- [table being populated, with the shelter distance params]
+		key {[dict]} -- [recording's key]
+		xy {[np.ndarray]} -- [(n_frames, 2) corrected tracking]
+	"""
+	from database.TablesDefinitionsV4 import Session
+	from Utilities.maths.geodesic import get_geodesic_cache
+
+	shelter = np.array(table.shelter_location, dtype=np.float64)
+	euclidean = np.hypot(xy[:, 0] - shelter[0], xy[:, 1] - shelter[1])
+
+	if table.maze_images_folder is None:
+		raise ValueError("TrackingData.maze_images_folder is needed to compute the geodesic distance from the shelter")
+	maze_type = (Session.Metadata & key).fetch1("maze_type")
+	maze_image = os.path.join(table.maze_images_folder, "{}.png".format(maze_type))
+	if not os.path.isfile(maze_image):
+		raise FileNotFoundError("Could not find image for maze design {}: {}".format(maze_type, maze_image))
+	maze = cv2.imread(maze_image, cv2.IMREAD_GRAYSCALE)
+
+	cache = get_geodesic_cache(os.path.join(table.maze_images_folder, "geodesic_fields"))
+	geodesic = cache.get_distance(maze, table.shelter_location, xy)
+	return geodesic, euclidean
+
 def make_trackingdata_table(table, key):
 	from database.TablesDefinitionsV4 import Recording, Session, CCM, MazeComponents
 
@@ -575,16 +604,16 @@ def make_trackingdata_table(table, key):
 			return
 	ccm = pd.DataFrame((CCM & key).fetch())
 
-	# load pose data
+	# load pose data: only the bodyparts we need as a (n_frames, n_bodyparts, 3) array
 	pose_file  = (Recording.FilePaths & key).fetch1("overview_pose")
 	try:
 		try:
-			posedata = pd.read_hdf(pose_file)
+			posedata, bodyparts = load_pose(pose_file, table.bodyparts)
 		except:  # adjust path to new winstor path name
 			pathparts = pose_file.split("\\")
 			pathparts.insert(1, "swc")
 			pose_file = os.path.join(*pathparts)
-			posedata = pd.read_hdf(pose_file)
+			posedata, bodyparts = load_pose(pose_file, table.bodyparts)
 	except:
 		print("Could not find {}".format(pose_file))
 		return
@@ -593,19 +622,13 @@ def make_trackingdata_table(table, key):
 	key['camera'] = 'overview' 
 	table.insert1(key)
 
-	# Get the scorer name and the name of the bodyparts
-	first_frame = posedata.iloc[0]
-	bodyparts = first_frame.index.levels[1]
-	scorer = first_frame.index.levels[0]
-
 	"""
 		Loop over bodyparts and populate Bodypart Part table
 	"""
-	bp_data = {}
-	for bp in bodyparts:
-		if bp not in table.bodyparts: continue  # skip unwanted body parts
+	bp_data, bp_likelihood = {}, {}
+	for bpn, bp in enumerate(bodyparts):
 		# Get XY pose and correct with CCM matrix
-		xy = posedata[scorer[0], bp].values[:, :2]
+		xy = posedata[:, bpn, :2]
 		try:
 			corrected_data = correct_tracking_data(xy, ccm['correction_matrix'][0], ccm['top_pad'][0], ccm['side_pad'][0], experiment, key['uid'])
 		except:
@@ -624,7 +647,8 @@ def make_trackingdata_table(table, key):
 
 		# remove low likelihood frames
 		bp_data[bp] = corrected_data.copy()
-		like = posedata[scorer[0], bp].values[:, 2]
+		like = posedata[:, bpn, 2].astype(np.float64)
+		bp_likelihood[bp] = like
 		corrected_data[like < .99] = np.nan
 
 		# If bp is body get the position on the maze
@@ -649,16 +673,30 @@ def make_trackingdata_table(table, key):
 		bpkey['speed'] = corrected_data.speed.values
 		bpkey['direction_of_mvmt'] = corrected_data.direction_of_mvmt.values
 
+		if table.compact: bpkey = compact_entry(bpkey, bodypart_blobs)
 		table.BodyPartData.insert1(bpkey)
 
+		if table.shelter_distance and bp in table.shelter_distance_bodyparts:
+			distkey = key.copy()
+			distkey['bpname'] = bp
+			distkey['geodesic_distance'], distkey['euclidean_distance'] = get_shelter_distances(table, key, corrected_data[['x', 'y']].values)
+
+			if table.compact: distkey = compact_entry(distkey, shelter_distance_blobs)
+			table.ShelterDistance.insert1(distkey)
+
+		if table.exploration_summary and bp == 'body':
+			summarykey = key.copy()
+			summarykey['bpname'] = bp
+			summarykey.update(summarise_recording(corrected_data.values))
+			table.ExplorationSummary.insert1(summarykey)
+
 	# populate body segments part table
-	body_part_data = pd.DataFrame(table.BodyPartData & key)
 	for name, (bp1, bp2) in table.skeleton.items():
 		segkey = key.copy()
 		segkey['segment_name'], segkey['bp1'], segkey['bp2'] = name, bp1, bp2
 
-		# get likelihoods
-		l1, l2  = body_part_data.loc[body_part_data.bpname == bp1].likelihood.values[0], body_part_data.loc[body_part_data.bpname == bp2].likelihood.values[0]
+		# get likelihoods, from the pose data so that the threshold below isn't affected by the compact representation
+		l1, l2  = bp_likelihood[bp1], bp_likelihood[bp2]
 		segkey['likelihood'] = np.min(np.vstack([l1, l2]).T, 1)
 
 		# get the tracking data
@@ -681,6 +719,7 @@ def make_trackingdata_table(table, key):
 		segkey['orientation'] = bone_orientation
 		segkey['angular_velocity'] = bone_angvel
 
+		if table.compact: segkey = compact_entry(segkey, segment_blobs)
 		table.BodySegmentData.insert1(segkey)
 
 
@@ -704,12 +743,15 @@ def make_exploration_table(table, key):
 	else: fps = 40
 
 
-	# Get tracking and stimuli data
+	# Get the summaries of the recordings' tracking, fall back to the tracking for recordings populated before them
 	try:
-		data = pd.DataFrame(Session * TrackingData.BodyPartData & "bpname='body'" & key).sort_values(['recording_uid'])
+		summaries = get_session_summaries(key)
 	except:
 		print("\nCould not load tracking data for session {} - can't compute exploration".format(key))
 		return
+	if not summaries:
+		print("\nCould not load tracking data for session {} - can't compute exploration".format(key))
+		return
 
 	try:
 		stimuli = pd.DataFrame((Stimuli & key).fetch()).sort_values(['overview_frame']) 
@@ -718,32 +760,32 @@ def make_exploration_table(table, key):
 		return
 
 	# Check if there was a stim
+	recordings = [s['recording_uid'] for s in summaries]
+	n_frames = np.array([s['n_frames'] for s in summaries])
 	if len(stimuli) == 0:
 		end_frame = -1
+		end = np.sum(n_frames) - 2 # ? as slicing the tracking with [:end_frame-1]
 	else:
 		# Get the comulative frame number in the session
 		first_stim = (stimuli.recording_uid.values[0], stimuli.overview_frame.values[0])
-		first_stim_rec = list(data.recording_uid.values).index(first_stim[0])
-		pre_stim_frames = np.sum([len(x) for i, x in enumerate(data.x.values) if i<first_stim_rec])
-		end_frame = np.int(pre_stim_frames + first_stim[1])
-	
-	exploration_tracking = np.vstack(data.tracking_data)[:end_frame-1, :]
-
-	# Get where the exploration starst (ie we can track the mouse correctly)
-	nonnan = np.where(~np.isnan(exploration_tracking[:, 0]) & ~np.isnan(exploration_tracking[:, 1]))[0]
-	smoothed = np.convolve(np.diff(nonnan), np.ones((250,))/250, mode='valid')
-	start = list(smoothed).index(1) 
-	exploration_tracking = exploration_tracking[start:, :]
+		first_stim_rec = recordings.index(first_stim[0])
+		pre_stim_frames = np.sum(n_frames[:first_stim_rec])
+		end_frame = int(pre_stim_frames + first_stim[1])
+		end = end_frame - 1
 
+	# Get where the exploration starst (ie we can track the mouse correctly) and the stats
+	start = get_exploration_start(summaries)
+	stats = combine_summaries(summaries, start, end)
+	roi_frames = stats['roi_frames']
 
 	# preprare stuff for entry in table
 	key['start_frame'] = start
 	key['end_frame'] = end_frame
-	key['total_travel'] = np.nansum(exploration_tracking[:, 2])
-	key['tot_time_in_shelter'] = np.where(exploration_tracking[:, -1]==0)[0].shape[0]/fps
-	key['tot_time_on_threat'] = np.where(exploration_tracking[:, -1]==1)[0].shape[0]/fps
-	key['duration'] = exploration_tracking.shape[0]/fps
-	key['median_vel'] = np.nanmedian(exploration_tracking[:, 2])*fps
+	key['total_travel'] = stats['travel']
+	key['tot_time_in_shelter'] = (roi_frames[0] if len(roi_frames) > 0 else 0)/fps
+	key['tot_time_on_threat'] = (roi_frames[1] if len(roi_frames) > 1 else 0)/fps
+	key['duration'] = stats['n_frames']/fps
+	key['median_vel'] = stats['median_speed']*fps
 
 	table.insert1(key)
 
@@ -907,6 +949,9 @@ def make_trials_table(table, key):
 	trial_key['experiment_name'] = data.experiment_name.values[0]
 	table.TrialSessionMetadata.insert1(trial_key)
 
+	# ? the trial's tracking can be sliced from TrackingData using the frames stored above
+	if not table.store_tracking: return
+
 	# Get tracking data for trial
 	parts_tracking = pd.DataFrame((TrackingData.BodyPartData & key).fetch())
 	parts_tracking.index = parts_tracking.bpname
@@ -945,6 +990,7 @@ def make_trials_table(table, key):
 		trial_key['tail_speed'] = parts_tracking.ix['tail_base'].speed[stim_frame:end_frame]
 		trial_key['tail_dir_mvmt'] = parts_tracking.ix['tail_base'].direction_of_mvmt[stim_frame:end_frame]
 
+		if TrackingData.compact: trial_key = compact_entry(trial_key, trial_blobs)
 		subtable.insert1(trial_key)
 
 
@@ -296,6 +296,18 @@ class Stimuli(dj.Imported):
 @schema
 class TrackingData(dj.Imported):
 	experiments_to_skip = ['Lambda Maze', 'PathInt2 Close', "Foraging"]
+	compact = False # ? store float32 tracking, uint8 rois and likelihood, see database.compact_tracking
+
+	# ? per frame geodesic and euclidean distance from the shelter for shelter_distance_bodyparts, stored in ShelterDistance.
+	# ? The geodesic distance is looked up in the distance field of the session's maze design, computed from
+	# ? maze_images_folder/{maze_type}.png (maze in the tracking's common coordinates, walls are black)
+	shelter_distance = False
+	shelter_distance_bodyparts = ['body']
+	shelter_location = [500, 850]
+	maze_images_folder = None
+
+	# ? summarise the body tracking in ExplorationSummary, Explorations are computed from it, see database.exploration_stats
+	exploration_summary = True
 
 	bodyparts = ['snout', 'neck', 'body', 'tail_base',]
 	skeleton = dict(head = ['snout', 'neck'], body_upper=['neck', 'body'],
@@ -335,6 +347,33 @@ class TrackingData(dj.Imported):
 			angular_velocity: longblob
 			likelihood: longblob
 		"""
+
+	class ShelterDistance(dj.Part):
+		definition = """
+			# per frame distance of a bodypart from the shelter
+			-> TrackingData.BodyPartData
+			---
+			geodesic_distance: longblob   # along the maze, nan when the bodypart is not on the maze
+			euclidean_distance: longblob
+		"""
+	
+	class ExplorationSummary(dj.Part):
+		definition = """
+			# summary of a bodypart's tracking in blocks of frames, see database.exploration_stats
+			-> TrackingData.BodyPartData
+			---
+			n_frames: int
+			block_size: int
+			leading_tracked: int        # number of tracked frames at the start of the recording
+			trailing_tracked: int       # number of tracked frames at the end of the recording
+			first_tracked_run: int      # first frame of the first long run of tracked frames, -1 if there's none
+			n_tracked: longblob         # for each block: number of tracked frames
+			travel: longblob            # distance travelled
+			roi_frames: longblob        # (n_blocks, n_rois) number of frames in each ROI
+			left_frames: longblob       # number of frames on the left side of the arena
+			right_frames: longblob      # number of frames on the right side of the arena
+			speed_hist: longblob        # (n_blocks, n_bins) histogram of the speed
+		"""
 	
 	def make(self, key):
 		make_trackingdata_table(self, key)
@@ -380,6 +419,8 @@ class Explorations(dj.Imported):
 # ---------------------------------------------------------------------------- #
 @schema
 class Trials(dj.Imported):
+	store_tracking = True # ? if False only the frame ranges are stored, use database.trial_tracking to get the trials' tracking
+
 	definition = """
 		-> Stimuli
 		-> TrackingData
@@ -482,6 +523,24 @@ class Trials(dj.Imported):
 		make_trials_table(self, key)
 
 
+# ---------------------------------------------------------------------------- #
+#                                REACTION TIMES                                #
+# ---------------------------------------------------------------------------- #
+@schema
+class ReactionTimes(dj.Manual):
+	definition = """
+		# Reaction time of escape trials, inserted in bulk by ExperimentsAnalyser.inspect_rt_metric
+		-> Trials
+		---
+		rt_frame = null: float              # frames from stim onset (at 40fps), null if no reaction was detected
+		rt_s = null: float
+		rt_frame_originalfps = null: float  # frames from stim onset at the trial's frame rate
+		body_th: float                      # speed thresholds used to detect the reaction
+		snout_th: float
+		rt_th: float
+	"""
+
+
 
 
 
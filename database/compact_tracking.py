@@ -0,0 +1,164 @@
+import sys
+sys.path.append('./')
+
+import numpy as np
+
+
+"""
+	Compact representation of the tracking data stored in the database.
+	Enabled by setting TrackingData.compact = True, it stores:
+		- coordinates and kinematics (x, y, speed, orientation...) as float32
+		- ROI ids (Trials' body_rois) as uint8, ROI_NAN marks frames without a ROI
+		- likelihoods as uint8, floored to steps of 1/LIKELIHOOD_LEVELS between 0 and 1. Thresholds that are
+		  multiples of the step (e.g. the repo's .99) give the same frames on the stored and on the original likelihoods
+
+	Entries populated before the switch are left as they are, the expand_* functions accept both
+	representations so analysis code doesn't need to know which one it's dealing with.
+	TrialsLoader.add_trials_tracking and TrialTrackingAccessor expand the fields they return so that analyses get
+	nan for frames without a ROI and likelihoods in [0, 1], but keep them as float32 unless upcast is True:
+	float32 arrays behave like float64 ones in numpy so most analyses can use them as they are.
+	migrate_to_compact converts the entries already in the database.
+"""
+
+LIKELIHOOD_LEVELS = 200 # ? .99 is a multiple of 1/LIKELIHOOD_LEVELS
+ROI_NAN = 255
+
+# ? names of the blobs in each table and how to compact them
+bodypart_blobs = dict(tracking_data='float', x='float', y='float', likelihood='likelihood', speed='float', direction_of_mvmt='float')
+segment_blobs = dict(orientation='float', angular_velocity='float', likelihood='likelihood')
+shelter_distance_blobs = dict(geodesic_distance='float', euclidean_distance='float')
+trial_blobs = dict(body_xy='float', body_speed='float', body_dir_mvmt='float', body_rois='rois', body_orientation='float',
+					body_angular_vel='float', head_orientation='float', head_angular_vel='float',
+					snout_xy='float', snout_speed='float', snout_dir_mvmt='float',
+					neck_xy='float', neck_speed='float', neck_dir_mvmt='float',
+					tail_xy='float', tail_speed='float', tail_dir_mvmt='float')
+
+
+# ---------------------------------------------------------------------------- #
+#                                   COMPACT                                    #
+# ---------------------------------------------------------------------------- #
+def compact_float(x):
+	return np.asarray(x, dtype=np.float32)
+
+def compact_likelihood(like):
+	like = np.asarray(like)
+	if like.dtype == np.uint8: return like
+	like = np.nan_to_num(np.clip(like, 0, 1), nan=0)
+	return np.floor(like * LIKELIHOOD_LEVELS).astype(np.uint8)
+
+def compact_rois(rois):
+	rois = np.asarray(rois)
+	if rois.dtype == np.uint8: return rois
+	if np.nanmax(rois, initial=0) >= ROI_NAN: raise ValueError("Too many ROIs to store them as uint8")
+	compact = np.full(rois.shape, ROI_NAN, dtype=np.uint8)
+	valid = ~np.isnan(rois)
+	compact[valid] = rois[valid]
+	return compact
+
+compacters = dict(float=compact_float, likelihood=compact_likelihood, rois=compact_rois)
+
+def compact_entry(entry, blobs):
+	"""[Returns a copy of a table entry with its blobs in the compact representation]
+
+	Arguments:
+		entry {[dict]} -- [entry to be inserted in the table]
+		blobs {[dict]} -- [name:kind of the blobs to compact, e.g. bodypart_blobs]
+	"""
+	entry = entry.copy()
+	for name, kind in blobs.items():
+		if name in entry: entry[name] = compacters[kind](entry[name])
+	return entry
+
+
+# ---------------------------------------------------------------------------- #
+#                                    EXPAND                                    #
+# ---------------------------------------------------------------------------- #
+def expand_float(x, upcast=True):
+	if upcast: return np.asarray(x, dtype=np.float64)
+	return np.asarray(x)
+
+def expand_likelihood(like, upcast=True):
+	like = np.asarray(like)
+	if like.dtype == np.uint8: like = like.astype(np.float32) / np.float32(LIKELIHOOD_LEVELS)
+	if upcast: return like.astype(np.float64)
+	return like
+
+def expand_rois(rois, upcast=True):
+	rois = np.asarray(rois)
+	if rois.dtype != np.uint8: return expand_float(rois, upcast=upcast)
+	expanded = rois.astype(np.float64 if upcast else np.float32)
+	expanded[rois == ROI_NAN] = np.nan
+	return expanded
+
+expanders = dict(float=expand_float, likelihood=expand_likelihood, rois=expand_rois)
+
+def expand_entry(entry, blobs, fields=None, upcast=True):
+	"""[Returns a copy of a fetched entry with the requested blobs decoded: nan for frames without a ROI
+		and likelihoods in [0, 1]]
+
+	Arguments:
+		entry {[dict, pd.Series]} -- [fetched entry]
+		blobs {[dict]} -- [name:kind of the blobs in the entry's table, e.g. bodypart_blobs]
+
+	Keyword Arguments:
+		fields {[list]} -- [names of the blobs to expand, if None all are expanded] (default: {None})
+		upcast {bool} -- [if True blobs are float64, otherwise float32 blobs are left as they are] (default: {True})
+	"""
+	entry = entry.copy()
+	for name, kind in blobs.items():
+		if fields is not None and name not in fields: continue
+		if name in entry: entry[name] = expanders[kind](entry[name], upcast=upcast)
+	return entry
+
+def expand_columns(df, blobs, fields=None, upcast=True):
+	"""[Same as expand_entry for a dataframe with a blob in each cell of the blobs' columns, modifies df in place]
+	"""
+	for name, kind in blobs.items():
+		if fields is not None and name not in fields: continue
+		if name not in df.columns: continue
+		if kind == 'float' and not upcast: continue
+		df[name] = [expanders[kind](v, upcast=upcast) if v is not None else v for v in df[name].values]
+	return df
+
+
+# ---------------------------------------------------------------------------- #
+#                                   MIGRATION                                  #
+# ---------------------------------------------------------------------------- #
+def migrate_table_to_compact(table, blobs, restriction={}):
+	"""[Converts the entries in table to the compact representation, updating them in place]
+
+	Arguments:
+		table {[dj.Table]} -- [e.g. TrackingData.BodyPartData]
+		blobs {[dict]} -- [name:kind of the blobs in the table]
+
+	Keyword Arguments:
+		restriction {[dict, str]} -- [only migrate entries matching this restriction] (default: {{}})
+	"""
+	keys = (table & restriction).fetch('KEY')
+	print("Migrating {} entries of {}".format(len(keys), table.table_name))
+
+	saved_bytes = 0
+	for key in keys:
+		entry = (table & key).fetch1()
+		compact = compact_entry(entry, blobs)
+		saved_bytes += np.sum([entry[k].nbytes - compact[k].nbytes for k in blobs.keys()])
+		try:
+			table.update1(compact)
+		except AttributeError: # ? older datajoint versions
+			for name in blobs.keys():
+				(table & key)._update(name, compact[name])
+	print("   ... saved {} MB".format(round(saved_bytes/1e6, 2)))
+
+def migrate_to_compact(restriction={}):
+	"""[Converts all tracking tables to the compact representation]
+	"""
+	from database.TablesDefinitionsV4 import TrackingData, Trials
+
+	migrate_table_to_compact(TrackingData.BodyPartData, bodypart_blobs, restriction)
+	migrate_table_to_compact(TrackingData.BodySegmentData, segment_blobs, restriction)
+	migrate_table_to_compact(Trials.TrialTracking, trial_blobs, restriction)
+	migrate_table_to_compact(Trials.ThreatTracking, trial_blobs, restriction)
+
+
+if __name__ == "__main__":
+	migrate_to_compact()
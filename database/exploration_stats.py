@@ -0,0 +1,205 @@
+import sys
+sys.path.append('./')
+
+import numpy as np
+
+
+"""
+	Exploration statistics from per recording summaries of the body tracking.
+	When TrackingData is populated the body tracking of each recording is summarised in blocks of block_size frames
+	(TrackingData.ExplorationSummary): number of tracked frames, distance travelled, frames in each ROI, frames on the
+	left and right side of the arena and a histogram of the speed. The exploration of a session (from when the mouse is
+	first tracked reliably to the first stimulus) is then computed by adding up the blocks of its recordings, without
+	fetching the tracking again.
+
+	Blocks that are only partially in the exploration are weighted by the fraction of their frames in it, so sums are
+	exact up to the frames in the first and last block and the median speed is interpolated from the histograms.
+"""
+
+exploration_block_size = 40  # ? frames in each block, at most 255 so that the block's histograms fit in uint8
+start_window = 250  # ? the exploration starts with the first start_window + 1 consecutive tracked frames
+left_x, right_x = 450, 550  # ? x coordinate of the left and right side of the arena, as in get_exploration_per_path_from_trials
+speed_bins = np.concatenate([[0], np.logspace(-2, np.log10(50), 63), [np.inf]]) # ? px/frame
+
+
+# ---------------------------------------------------------------------------- #
+#                                   RECORDINGS                                 #
+# ---------------------------------------------------------------------------- #
+def get_tracked_runs(tracked, window=None):
+	"""[Runs of consecutive tracked frames]
+
+	Arguments:
+		tracked {[np.ndarray]} -- [boolean array, True when the mouse is tracked]
+
+	Keyword Arguments:
+		window {[int]} -- [if None start_window] (default: {None})
+
+	Returns:
+		leading {[int]} -- [tracked frames at the start of the recording]
+		trailing {[int]} -- [tracked frames at the end of the recording]
+		first_run {[int]} -- [first frame of the first run of window + 1 tracked frames, -1 if there's none]
+	"""
+	if window is None: window = start_window
+	tracked = np.asarray(tracked, dtype=bool)
+	if not len(tracked) or not np.any(tracked): return 0, 0, -1
+
+	edges = np.diff(np.concatenate([[0], tracked.astype(np.int8), [0]]))
+	starts, ends = np.where(edges == 1)[0], np.where(edges == -1)[0]
+	lengths = ends - starts
+
+	leading = lengths[0] if starts[0] == 0 else 0
+	trailing = lengths[-1] if ends[-1] == len(tracked) else 0
+	long_runs = np.where(lengths >= window + 1)[0]
+	first_run = starts[long_runs[0]] if len(long_runs) else -1
+	return int(leading), int(trailing), int(first_run)
+
+def summarise_recording(tracking, block_size=None):
+	"""[Summarises the body tracking of a recording in blocks of frames]
+
+	Arguments:
+		tracking {[np.ndarray]} -- [TrackingData.BodyPartData tracking_data: x, y, speed, ..., ROI id in the last column]
+
+	Keyword Arguments:
+		block_size {[int]} -- [if None exploration_block_size] (default: {None})
+
+	Returns:
+		[dict] -- [the attributes of TrackingData.ExplorationSummary]
+	"""
+	if block_size is None: block_size = exploration_block_size
+	if block_size > 255: raise ValueError("block_size should be at most 255")
+
+	tracking = np.asarray(tracking, dtype=np.float64)
+	n_frames = tracking.shape[0]
+	n_blocks = int(np.ceil(n_frames / block_size))
+	block = np.arange(n_frames) // block_size
+
+	x, y, speed, rois = tracking[:, 0], tracking[:, 1], tracking[:, 2], tracking[:, -1]
+	tracked = ~np.isnan(x) & ~np.isnan(y)
+	leading, trailing, first_run = get_tracked_runs(tracked)
+
+	# ? ROI counts as (n_blocks, n_rois)
+	valid_rois = ~np.isnan(rois)
+	roi_ids = rois[valid_rois].astype(np.int64)
+	n_rois = int(np.max(roi_ids)) + 1 if len(roi_ids) else 0
+	roi_frames = np.bincount(block[valid_rois]*n_rois + roi_ids, minlength=n_blocks*n_rois).reshape(n_blocks, n_rois)
+
+	# ? speed histograms as (n_blocks, n_bins)
+	n_bins = len(speed_bins) - 1
+	valid_speed = ~np.isnan(speed)
+	speed_bin = np.clip(np.digitize(speed[valid_speed], speed_bins) - 1, 0, n_bins - 1)
+	speed_hist = np.bincount(block[valid_speed]*n_bins + speed_bin, minlength=n_blocks*n_bins).reshape(n_blocks, n_bins)
+
+	with np.errstate(invalid='ignore'):
+		left, right = tracked & (x < left_x), tracked & (x > right_x)
+	return dict(
+		n_frames = n_frames,
+		block_size = block_size,
+		leading_tracked = leading,
+		trailing_tracked = trailing,
+		first_tracked_run = first_run,
+		n_tracked = np.bincount(block, weights=tracked, minlength=n_blocks).astype(np.uint8),
+		travel = np.bincount(block[valid_speed], weights=speed[valid_speed], minlength=n_blocks).astype(np.float32),
+		roi_frames = roi_frames.astype(np.uint8),
+		left_frames = np.bincount(block, weights=left, minlength=n_blocks).astype(np.uint8),
+		right_frames = np.bincount(block, weights=right, minlength=n_blocks).astype(np.uint8),
+		speed_hist = speed_hist.astype(np.uint8),
+	)
+
+
+# ---------------------------------------------------------------------------- #
+#                                    SESSIONS                                  #
+# ---------------------------------------------------------------------------- #
+def get_exploration_start(summaries, window=None):
+	"""[First frame (in the session) of the first run of window + 1 consecutive tracked frames, runs can span recordings]
+
+	Arguments:
+		summaries {[list]} -- [ExplorationSummary entries of the session's recordings, in order]
+	"""
+	if window is None: window = start_window
+	offset, carry_start, carry_len = 0, None, 0
+	for summary in summaries:
+		n = int(summary['n_frames'])
+		leading, trailing = int(summary['leading_tracked']), int(summary['trailing_tracked'])
+
+		if carry_len and leading and carry_len + leading >= window + 1: return carry_start
+		if summary['first_tracked_run'] >= 0: return offset + int(summary['first_tracked_run'])
+
+		if trailing == n:
+			if not carry_len: carry_start = offset
+			carry_len += n
+		else:
+			carry_start, carry_len = offset + n - trailing, trailing
+		offset += n
+	raise ValueError("The mouse is never tracked for {} consecutive frames".format(window + 1))
+
+def _blocks_weights(summary, start, end):
+	""" Fraction of each block's frames in [start, end) (frames relative to the recording) """
+	n, size = int(summary['n_frames']), int(summary['block_size'])
+	block_starts = np.arange(0, n, size)
+	block_ends = np.minimum(block_starts + size, n)
+	inside = np.clip(np.minimum(block_ends, end) - np.maximum(block_starts, start), 0, None)
+	return inside / (block_ends - block_starts)
+
+def get_median_from_histogram(hist, bins=None):
+	""" Median of the values in a histogram, interpolated linearly within the bin """
+	if bins is None: bins = speed_bins
+	hist = np.asarray(hist, dtype=np.float64)
+	total = np.sum(hist)
+	if total <= 0: return np.nan
+
+	cum = np.cumsum(hist)
+	i = int(np.searchsorted(cum, total / 2))
+	low, high = bins[i], bins[i+1]
+	if not np.isfinite(high): return low
+	before = cum[i] - hist[i]
+	return low + (high - low) * (total / 2 - before) / hist[i]
+
+def combine_summaries(summaries, start, end):
+	"""[Adds up the blocks of the recordings' summaries between two session frames]
+
+	Arguments:
+		summaries {[list]} -- [ExplorationSummary entries of the session's recordings, in order]
+		start {[int]} -- [first frame, in session frames]
+		end {[int]} -- [end frame (excluded), in session frames]
+
+	Returns:
+		[dict] -- [n_frames, n_tracked, travel (px), roi_frames (frames in each ROI id), left_frames, right_frames,
+					median_speed (px/frame)]
+	"""
+	totals = dict(n_frames=max(end - start, 0), n_tracked=0., travel=0., left_frames=0., right_frames=0.)
+	roi_frames, speed_hist = np.zeros(0), np.zeros(len(speed_bins) - 1)
+
+	offset = 0
+	for summary in summaries:
+		n = int(summary['n_frames'])
+		if offset < end and offset + n > start:
+			w = _blocks_weights(summary, start - offset, end - offset)
+			for k in ['n_tracked', 'travel', 'left_frames', 'right_frames']:
+				totals[k] += np.sum(w * np.asarray(summary[k], dtype=np.float64))
+
+			rois = np.asarray(summary['roi_frames'], dtype=np.float64)
+			if rois.ndim == 2 and rois.shape[1]:
+				rois = np.sum(w[:, None] * rois, axis=0)
+				if len(rois) > len(roi_frames): roi_frames = np.pad(roi_frames, (0, len(rois) - len(roi_frames)))
+				roi_frames[:len(rois)] += rois
+			speed_hist += np.sum(w[:, None] * np.asarray(summary['speed_hist'], dtype=np.float64), axis=0)
+		offset += n
+
+	totals['roi_frames'] = roi_frames
+	totals['median_speed'] = get_median_from_histogram(speed_hist)
+	return totals
+
+def get_session_summaries(key, fallback=True):
+	"""[ExplorationSummary entries of the body for each recording in a session, sorted by recording]
+
+	Keyword Arguments:
+		fallback {bool} -- [if some of the session's recordings were populated before the summaries, the summaries
+							of all recordings are computed from their tracking (so that frame offsets are right)] (default: {True})
+	"""
+	from database.TablesDefinitionsV4 import TrackingData
+	body = TrackingData.BodyPartData & "bpname='body'" & key
+	summaries = sorted((TrackingData.ExplorationSummary & "bpname='body'" & key).fetch(as_dict=True), key=lambda s: s['recording_uid'])
+	if not fallback or len(summaries) == len(body): return summaries
+
+	recordings, tracking = body.fetch("recording_uid", "tracking_data", order_by="recording_uid")
+	return [dict(recording_uid=rec, **summarise_recording(t)) for rec, t in zip(recordings, tracking)]
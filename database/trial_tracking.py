@@ -0,0 +1,202 @@
+import sys
+sys.path.append('./')
+
+import os
+import numpy as np
+from collections import OrderedDict
+
+from database.compact_tracking import expand_entry, trial_blobs, shelter_distance_blobs
+
+
+"""
+	Trial tracking as views into the session's tracking.
+	Trials.TrialTracking and Trials.ThreatTracking store copies of slices of the arrays already in
+	TrackingData.BodyPartData and TrackingData.BodySegmentData ([stim_frame:at_shelter_frame] and [stim_frame:out_of_t_frame]).
+	With Trials.store_tracking = False only the Trials entries (which have the frame ranges) are populated and
+	the tracking for each trial is sliced from the recording's arrays when it's needed:
+		- each recording's arrays are fetched once and kept in memory (the last max_recordings used)
+		- if a cache_folder is given they are also saved there as .npy and memory mapped when loaded again
+		- the trial tracking returned are numpy views (no copy) into those arrays, so they're read only
+
+	Usage:
+		accessor = TrialTrackingAccessor()
+		tracking = accessor.get_trial_tracking(trial)  # trial: Trials entry as dict or pd.Series
+		trials = accessor.add_trial_tracking(trials)   # add the tracking columns to a dataframe of trials
+
+	After fixing the tracking of a recording only its TrackingData entries need to be repopulated,
+	the trials pick up the new tracking once the cached arrays are cleared with accessor.clear(recording_uid).
+	If TrackingData is stored in the compact representation ROIs and likelihoods are decoded (so they're copies) and
+	the tracking is float32, use upcast=True to get float64 copies of all fields.
+"""
+
+# ? for each field of Trials.TrialTracking: (table, bodypart or segment name, attribute, columns)
+trial_tracking_fields = OrderedDict(
+	body_xy = 			('part', 'body', 'tracking_data', slice(0, 2)),
+	body_speed = 		('part', 'body', 'speed', None),
+	body_dir_mvmt = 	('part', 'body', 'direction_of_mvmt', None),
+	body_rois = 		('part', 'body', 'tracking_data', -1),
+	body_orientation = 	('segment', 'body', 'orientation', None),
+	body_angular_vel = 	('segment', 'body', 'angular_velocity', None),
+
+	head_orientation = 	('segment', 'head', 'orientation', None),
+	head_angular_vel = 	('segment', 'head', 'angular_velocity', None),
+
+	snout_xy = 			('part', 'snout', 'tracking_data', slice(0, 2)),
+	snout_speed = 		('part', 'snout', 'speed', None),
+	snout_dir_mvmt = 	('part', 'snout', 'direction_of_mvmt', None),
+
+	neck_xy = 			('part', 'neck', 'tracking_data', slice(0, 2)),
+	neck_speed = 		('part', 'neck', 'speed', None),
+	neck_dir_mvmt = 	('part', 'neck', 'direction_of_mvmt', None),
+
+	tail_xy = 			('part', 'tail_base', 'tracking_data', slice(0, 2)),
+	tail_speed = 		('part', 'tail_base', 'speed', None),
+	tail_dir_mvmt = 	('part', 'tail_base', 'direction_of_mvmt', None),
+)
+
+# ? fields from TrackingData.ShelterDistance, only returned when asked for in fields (they're only there with TrackingData.shelter_distance)
+shelter_distance_fields = OrderedDict(
+	body_geodesic_distance = 	('shelter', 'body', 'geodesic_distance', None),
+	body_shelter_distance = 	('shelter', 'body', 'euclidean_distance', None),
+)
+all_tracking_fields = OrderedDict(list(trial_tracking_fields.items()) + list(shelter_distance_fields.items()))
+
+# ? how each field is upcast if the tracking is stored in the compact representation (see database.compact_tracking)
+tracking_fields_blobs = dict(trial_blobs, **{f:shelter_distance_blobs[attr] for f, (_, _, attr, _) in shelter_distance_fields.items()})
+
+
+def get_trial_end_frame(trial, threat=False):
+	"""[Frame at which the trial's tracking ends: leaving the threat platform for ThreatTracking, reaching the
+		shelter for TrialTracking. As in make_trials_table at_shelter_frame is -1 if the mouse didn't return to the shelter]
+	"""
+	if threat: return int(trial['out_of_t_frame'])
+	else: return int(trial['at_shelter_frame'])
+
+
+class TrialTrackingAccessor:
+	def __init__(self, cache_folder=None, max_recordings=16, fields=None, upcast=False):
+		"""[Returns the tracking of trials as slices of the tracking of the recording they belong to]
+
+		Keyword Arguments:
+			cache_folder {[str]} -- [if not None the recordings' arrays are saved here and memory mapped] (default: {None})
+			max_recordings {int} -- [number of recordings whose arrays are kept in memory] (default: {16})
+			fields {[list]} -- [names of the Trials.TrialTracking fields (or of shelter_distance_fields) to return, 
+							if None all the Trials.TrialTracking fields are returned] (default: {None})
+			upcast {bool} -- [if True compact (float32) tracking is returned as float64] (default: {False})
+		"""
+		self.cache_folder = cache_folder
+		if self.cache_folder is not None and not os.path.isdir(self.cache_folder):
+			os.makedirs(self.cache_folder)
+
+		self.max_recordings = max_recordings
+		if fields is None: fields = list(trial_tracking_fields.keys())
+		self.fields = fields
+		self.upcast = upcast
+		self.recordings = OrderedDict()
+
+	# ------------------------------ Recording data ------------------------------ #
+	def get_cache_path(self, recording_uid, camera, source, name, attribute):
+		return os.path.join(self.cache_folder, "{}_{}".format(recording_uid, camera), "{}_{}_{}.npy".format(source, name, attribute))
+
+	def get_needed_arrays(self):
+		return set([(source, name, attribute) for source, name, attribute, _ in
+						[all_tracking_fields[f] for f in self.fields]])
+
+	def fetch_recording(self, recording_uid, camera):
+		from database.TablesDefinitionsV4 import TrackingData
+		key = dict(recording_uid=recording_uid, camera=camera)
+
+		arrays = {}
+		parts = {bp:entry for bp, entry in zip(*(TrackingData.BodyPartData & key).fetch('bpname', 'KEY'))}
+		segments = {s:entry for s, entry in zip(*(TrackingData.BodySegmentData & key).fetch('segment_name', 'KEY'))}
+		for source, name, attribute in self.get_needed_arrays():
+			if source == 'part':
+				arrays[(source, name, attribute)] = (TrackingData.BodyPartData & parts[name]).fetch1(attribute)
+			elif source == 'shelter':
+				arrays[(source, name, attribute)] = (TrackingData.ShelterDistance & parts[name]).fetch1(attribute)
+			else:
+				arrays[(source, name, attribute)] = (TrackingData.BodySegmentData & segments[name]).fetch1(attribute)
+		return arrays
+
+	def load_recording(self, recording_uid, camera):
+		if self.cache_folder is None:
+			return self.fetch_recording(recording_uid, camera)
+
+		needed = self.get_needed_arrays()
+		paths = {k:self.get_cache_path(recording_uid, camera, *k) for k in needed}
+		if not all([os.path.isfile(p) for p in paths.values()]):
+			arrays = self.fetch_recording(recording_uid, camera)
+			folder = os.path.split(list(paths.values())[0])[0]
+			if not os.path.isdir(folder): os.makedirs(folder)
+			for k, array in arrays.items():
+				np.save(paths[k], np.asarray(array))
+		return {k:np.load(p, mmap_mode='r') for k, p in paths.items()}
+
+	def get_recording(self, recording_uid, camera='overview'):
+		"""[Returns a dictionary with the arrays of a recording needed to slice the trials' tracking]
+		"""
+		rec = (recording_uid, camera)
+		if rec in self.recordings:
+			self.recordings.move_to_end(rec)
+		else:
+			self.recordings[rec] = self.load_recording(recording_uid, camera)
+			while len(self.recordings) > self.max_recordings:
+				self.recordings.popitem(last=False)
+		return self.recordings[rec]
+
+	def clear(self, recording_uid=None):
+		"""[Forgets the arrays of a recording (or of all recordings) so that they're fetched again from the database]
+		"""
+		import shutil
+
+		for rec in list(self.recordings.keys()):
+			if recording_uid is None or rec[0] == recording_uid:
+				del self.recordings[rec]
+
+		if self.cache_folder is None: return
+		for fld in os.listdir(self.cache_folder):
+			if recording_uid is None or fld.startswith(recording_uid+"_"):
+				shutil.rmtree(os.path.join(self.cache_folder, fld))
+
+	# ------------------------------ Trial tracking ------------------------------ #
+	def get_trial_tracking(self, trial, threat=False):
+		"""[Returns a dictionary with the same fields as Trials.TrialTracking (or Trials.ThreatTracking if threat=True)
+			for a trial, each value is a view into the recording's tracking]
+
+		Arguments:
+			trial {[dict, pd.Series]} -- [Trials entry, needs recording_uid, camera, stim_frame, at_shelter_frame and out_of_t_frame]
+		"""
+		arrays = self.get_recording(trial['recording_uid'], trial.get('camera', 'overview'))
+		start, end = int(trial['stim_frame']), get_trial_end_frame(trial, threat=threat)
+
+		tracking = {}
+		for field in self.fields:
+			source, name, attribute, columns = all_tracking_fields[field]
+			array = arrays[(source, name, attribute)]
+			if columns is None: tracking[field] = array[start:end]
+			else: tracking[field] = array[start:end, columns]
+		return expand_entry(tracking, tracking_fields_blobs, fields=self.fields, upcast=self.upcast)
+
+	def add_trial_tracking(self, trials, threat=False):
+		"""[Adds the trial tracking columns to a dataframe of Trials entries, trials are grouped by recording
+			so that each recording is loaded once]
+		"""
+		columns = {f:[None]*len(trials) for f in self.fields}
+		order = np.argsort(trials.recording_uid.values, kind='stable')
+		for i in order:
+			tracking = self.get_trial_tracking(trials.iloc[i], threat=threat)
+			for f, v in tracking.items(): columns[f][i] = v
+
+		trials = trials.copy()
+		for f, v in columns.items(): trials[f] = v
+		return trials
+
+
+# ? Accessor shared by all the callers in this process
+_accessor = None
+
+def get_trial_tracking_accessor():
+	global _accessor
+	if _accessor is None:
+		_accessor = TrialTrackingAccessor()
+	return _accessor
@@ -0,0 +1,71 @@
+import sys
+sys.path.append('./')
+
+import tracemalloc
+import pytest
+
+np = pytest.importorskip("numpy")
+distance = pytest.importorskip("scipy.spatial.distance")
+
+from Utilities.maths.distances import rowwise_distances, point_distances, step_distances
+
+
+@pytest.fixture
+def trajectory():
+	return np.random.RandomState(0).uniform(0, 1000, size=(50, 2))
+
+
+def test_rowwise_distances(trajectory):
+	other = trajectory[::-1]
+	expected = np.diag(distance.cdist(trajectory, other))
+	assert np.allclose(rowwise_distances(trajectory, other), expected)
+	assert np.allclose(rowwise_distances(trajectory, other, chunk=7), expected)
+
+def test_point_distances(trajectory):
+	shelter = [500, 850]
+	expected = distance.cdist(trajectory, np.array([shelter]))[:, 0]
+	assert np.allclose(point_distances(trajectory, shelter), expected)
+	assert np.allclose(point_distances(trajectory, shelter, chunk=7), expected)
+
+def test_step_distances(trajectory):
+	expected = np.concatenate([[0], np.sqrt(np.sum(np.diff(trajectory, axis=0)**2, axis=1))])
+	assert np.allclose(step_distances(trajectory), expected)
+	assert np.allclose(step_distances(trajectory[:1]), [0])
+
+def test_nan_frames(trajectory):
+	trajectory = trajectory.copy()
+	trajectory[10] = np.nan
+	dist = step_distances(trajectory)
+	assert np.isnan(dist[10]) and np.isnan(dist[11])
+	assert not np.any(np.isnan(np.delete(dist, [10, 11])))
+
+def test_distance_from_shelter_long_session():
+	# ? a 100k frames session: an n x n distance matrix would need 80GB, row-wise norms need a few MB
+	math_utils = pytest.importorskip("Utilities.maths.math_utils")
+	v = np.random.RandomState(1).uniform(0, 1000, size=(100000, 2))
+	shelter = (500, 850)
+
+	tracemalloc.start()
+	dist = math_utils.calc_distance_from_shelter(v, shelter)
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	assert dist.shape == (100000, )
+	assert np.allclose(dist[:100], distance.cdist(v[:100], np.array([shelter]))[:, 0])
+	assert peak < 50e6
+
+def test_distance_between_two_vectors_long_session():
+	# ? this function used to build the n x n cdist matrix between the two trajectories
+	math_utils = pytest.importorskip("Utilities.maths.math_utils")
+	rng = np.random.RandomState(2)
+	v1, v2 = rng.uniform(0, 1000, size=(100000, 2)), rng.uniform(0, 1000, size=(100000, 2))
+
+	tracemalloc.start()
+	dist = math_utils.calc_distance_between_points_two_vectors_2d(v1, v2)
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	assert dist.shape == (100000, )
+	assert np.allclose(dist, np.linalg.norm(v1 - v2, axis=1))
+	assert np.allclose(dist[:100], np.diag(distance.cdist(v1[:100], v2[:100])))
+	assert peak < 50e6